@@ -0,0 +1,162 @@
+"""
+Admission control and time budgets for the read API.
+
+Routes wrapped with @admitted(name) run at most `concurrency` at a time per
+process. Up to `queue` more requests wait for a slot, for at most
+ADMISSION_QUEUE_WAIT_MS; anything beyond that is shed at once with a 503 and
+Retry-After instead of holding a worker thread.
+
+An admitted request runs inside pymongo.timeout() with whatever is left of
+its REQUEST_BUDGET_MS (queueing time included). The driver turns that into
+maxTimeMS on every command the handler sends and fails the request once the
+budget is spent, so a database under load cannot hold threads for longer
+than the budget. Handlers turn such failures into a 503 with
+error_response().
+
+Limits, per process:
+
+    ADMISSION_CONCURRENCY     requests per route running at once (default 4, 0 = no limit)
+    ADMISSION_QUEUE           requests per route waiting for a slot (default 8)
+    ADMISSION_LIMITS          per-route overrides as concurrency:queue[:budget_ms],
+                              e.g. "qe_demo=1:2,anomalies=2:4:20000"
+    ADMISSION_QUEUE_WAIT_MS   longest wait for a slot (default 1000)
+    REQUEST_BUDGET_MS         time budget per request (default 5000)
+    ADMISSION_RETRY_AFTER     Retry-After seconds on a 503 (default 1)
+"""
+import os
+import time
+import threading
+import functools
+import pymongo
+from flask import jsonify
+from pymongo.errors import PyMongoError
+import metrics
+
+CONCURRENCY = int(os.environ.get("ADMISSION_CONCURRENCY", 4))
+QUEUE = int(os.environ.get("ADMISSION_QUEUE", 8))
+QUEUE_WAIT = int(os.environ.get("ADMISSION_QUEUE_WAIT_MS", 1000)) / 1000
+BUDGET = int(os.environ.get("REQUEST_BUDGET_MS", 5000)) / 1000
+RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", 1))
+
+SHED = metrics.REGISTRY.register(metrics.Counter(
+    "http_requests_shed_total", "Requests refused with 503 before running.", ("route", "reason")))
+TIMED_OUT = metrics.REGISTRY.register(metrics.Counter(
+    "http_requests_timed_out_total", "Admitted requests that ran out of their time budget.", ("route",)))
+QUEUED = metrics.REGISTRY.register(metrics.Gauge(
+    "http_admission_queued", "Requests waiting for a slot.", ("route",)))
+
+
+def _limits(value):
+    """{route: (concurrency, queue, budget seconds or None)} from ADMISSION_LIMITS."""
+    limits = {}
+    for item in value.split(","):
+        if "=" in item:
+            route, limit = (part.strip() for part in item.split("=", 1))
+            concurrency, queue, budget = (limit.split(":") + ["", ""])[:3]
+            limits[route] = (int(concurrency), int(queue) if queue else QUEUE,
+                             int(budget) / 1000 if budget else None)
+    return limits
+
+
+LIMITS = _limits(os.environ.get("ADMISSION_LIMITS", ""))
+
+
+class Limiter:
+    """A counting semaphore with a bounded, time-limited wait queue."""
+
+    def __init__(self, route, concurrency, queue):
+        self.route = route
+        self.concurrency = concurrency
+        self.queue = queue
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout):
+        """None once admitted, else the reason the request is shed."""
+        if not self.concurrency:
+            return None
+        with self._cond:
+            if self.active < self.concurrency:
+                self.active += 1
+                return None
+            if self.waiting >= self.queue:
+                return "queue_full"
+            self.waiting += 1
+            QUEUED.inc(route=self.route)
+            try:
+                admitted = self._cond.wait_for(lambda: self.active < self.concurrency, timeout)
+            finally:
+                self.waiting -= 1
+                QUEUED.dec(route=self.route)
+            if not admitted:
+                return "queue_timeout"
+            self.active += 1
+            return None
+
+    def release(self):
+        if not self.concurrency:
+            return
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+
+_limiters = {}
+
+
+def limiter(route):
+    if route not in _limiters:
+        concurrency, queue, _ = LIMITS.get(route, (CONCURRENCY, QUEUE, None))
+        _limiters[route] = Limiter(route, concurrency, queue)
+    return _limiters[route]
+
+
+def _unavailable(message):
+    response = jsonify({"error": message})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(RETRY_AFTER)
+    return response
+
+
+def admitted(route, budget=None):
+    """
+    Decorator: run the view under `route`'s limiter and time budget
+    (`budget` seconds, default REQUEST_BUDGET_MS; ADMISSION_LIMITS wins).
+    """
+    def decorator(view):
+        slots = limiter(route)
+        seconds = LIMITS.get(route, (None, None, None))[2] or budget or BUDGET
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            deadline = time.monotonic() + seconds
+            reason = slots.acquire(min(QUEUE_WAIT, seconds))
+            if reason is not None:
+                SHED.inc(route=route, reason=reason)
+                return _unavailable("Server is busy, retry later")
+            try:
+                with pymongo.timeout(max(deadline - time.monotonic(), 0.001)):
+                    return view(*args, **kwargs)
+            finally:
+                slots.release()
+        return wrapper
+    return decorator
+
+
+def is_timeout(error):
+    """True for driver errors caused by an expired time budget (or maxTimeMS)."""
+    return isinstance(error, PyMongoError) and error.timeout
+
+
+def error_response(route, error):
+    """
+    The response for an exception caught in an admitted handler: 503 when the
+    time budget ran out, else the usual 500 with the error message.
+    """
+    if is_timeout(error):
+        TIMED_OUT.inc(route=route)
+        return _unavailable("Request exceeded its time budget")
+    response = jsonify({"error": str(error)})
+    response.status_code = 500
+    return response
@@ -0,0 +1,179 @@
+"""
+Usage anomalies for /api/usage/anomalies.
+
+A 5-minute bucket is anomalous when its average usage is above the
+ANOMALY_PERCENTILE of all 5-minute buckets that fell in the same local
+(day-of-week, hour-of-day) slot over the last ANOMALY_BASELINE_DAYS days.
+
+Percentiles are not mergeable, so the baseline is kept as histograms
+instead: BASELINE_COLLECTION counts bucket averages per (local day, slot,
+ANOMALY_BIN_WIDTH-wide bin). refresh_baseline() folds in only the buckets
+completed since the last refresh, days older than the baseline window are
+deleted, and percentiles are read from the summed histograms, which makes
+them approximate to one bin width. The resulting thresholds are cached in
+process for ANOMALY_BASELINE_TTL seconds.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+import pytz
+from pymongo.errors import DuplicateKeyError
+import db
+import usage
+
+BASELINE_COLLECTION = "usage_baseline"
+STATE_COLLECTION = "usage_baseline_state"
+
+BASELINE_DAYS = int(os.environ.get("ANOMALY_BASELINE_DAYS", 28))
+PERCENTILE = float(os.environ.get("ANOMALY_PERCENTILE", 0.95))
+# Histogram resolution in kW; percentiles are accurate to one bin
+BIN_WIDTH = float(os.environ.get("ANOMALY_BIN_WIDTH", 0.05))
+# Slots with fewer buckets than this are not judged
+MIN_SAMPLES = int(os.environ.get("ANOMALY_MIN_SAMPLES", 20))
+BASELINE_TTL = float(os.environ.get("ANOMALY_BASELINE_TTL", 600))
+
+
+def slot_of(bucket_utc):
+    """(day of week, hour) in local time for a naive UTC datetime; Sunday is 1 as in $dayOfWeek."""
+    local = pytz.utc.localize(bucket_utc).astimezone(usage.LOCAL_ZONE)
+    return local.isoweekday() % 7 + 1, local.hour
+
+
+def baseline_pipeline(start, end):
+    """Histogram of the 5-minute bucket averages in [start, end) per local day and slot."""
+    timezone = usage.LOCAL_ZONE.zone
+    return usage.bucket_pipeline(start, end) + [
+        {"$project": {
+            "day": {"$dateToString": {"date": "$_id", "format": "%Y-%m-%d", "timezone": timezone}},
+            "dow": {"$dayOfWeek": {"date": "$_id", "timezone": timezone}},
+            "hour": {"$hour": {"date": "$_id", "timezone": timezone}},
+            "bin": {"$floor": {"$divide": [{"$divide": ["$total", "$count"]}, BIN_WIDTH]}}
+        }},
+        {"$group": {
+            "_id": {"day": "$day", "dow": "$dow", "hour": "$hour", "bin": "$bin"},
+            "count": {"$sum": 1}
+        }},
+        {"$merge": {
+            "into": BASELINE_COLLECTION,
+            "on": "_id",
+            "whenMatched": [{"$set": {"count": {"$add": ["$count", "$$new.count"]}}}],
+            "whenNotMatched": "insert"
+        }}
+    ]
+
+
+def refresh_baseline(database, now=None):
+    """
+    Add the buckets completed since the last refresh to the histograms.
+
+    The watermark is advanced before the aggregation runs, with a conditional
+    update, so concurrent refreshes (several workers) never count a range
+    twice; it is put back if the aggregation fails.
+    """
+    now = now or datetime.utcnow()
+    until = usage.floor_to_bucket(now)
+    state = database[STATE_COLLECTION]
+    current = state.find_one({"_id": "watermark"})
+    since = current["until"] if current else until - timedelta(days=BASELINE_DAYS)
+    if since >= until:
+        return None
+
+    try:
+        if current is None:
+            state.insert_one({"_id": "watermark", "until": until})
+        elif not state.update_one({"_id": "watermark", "until": since}, {"$set": {"until": until}}).matched_count:
+            # Another process took this range
+            return None
+    except DuplicateKeyError:
+        # Another process created the watermark first
+        return None
+
+    try:
+        database[usage.READINGS_COLLECTION].aggregate(baseline_pipeline(since, until))
+    except Exception:
+        state.update_one({"_id": "watermark", "until": until}, {"$set": {"until": since}})
+        raise
+
+    oldest_day = (pytz.utc.localize(until).astimezone(usage.LOCAL_ZONE) - timedelta(days=BASELINE_DAYS)).strftime("%Y-%m-%d")
+    database[BASELINE_COLLECTION].delete_many({"_id.day": {"$lt": oldest_day}})
+    return since, until
+
+
+def percentile_from_histogram(bins, q):
+    """Approximate q-quantile of sorted [(bin, count), ...]: the midpoint of the bin holding it."""
+    total = sum(count for _, count in bins)
+    rank = q * total
+    seen = 0
+    for bin_index, count in bins:
+        seen += count
+        if seen >= rank:
+            return (bin_index + 0.5) * BIN_WIDTH
+    return (bins[-1][0] + 0.5) * BIN_WIDTH
+
+
+def load_baseline(database):
+    """{(dow, hour): {"samples", "p50", "threshold"}} from the summed histograms."""
+    pipeline = [
+        {"$group": {
+            "_id": {"dow": "$_id.dow", "hour": "$_id.hour", "bin": "$_id.bin"},
+            "count": {"$sum": "$count"}
+        }},
+        {"$sort": {"_id.bin": 1}}
+    ]
+    histograms = {}
+    for doc in database[BASELINE_COLLECTION].aggregate(pipeline):
+        key = (doc["_id"]["dow"], doc["_id"]["hour"])
+        histograms.setdefault(key, []).append((doc["_id"]["bin"], doc["count"]))
+    return {
+        slot: {
+            "samples": sum(count for _, count in bins),
+            "p50": percentile_from_histogram(bins, 0.5),
+            "threshold": percentile_from_histogram(bins, PERCENTILE)
+        }
+        for slot, bins in histograms.items()
+    }
+
+
+class BaselineCache:
+    def __init__(self, ttl=BASELINE_TTL):
+        self.ttl = ttl
+        self._baseline = None
+        self._expires = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._baseline is None or time.monotonic() >= self._expires:
+                database = db.get_db()
+                refresh_baseline(database)
+                self._baseline = load_baseline(database)
+                self._expires = time.monotonic() + self.ttl
+            return self._baseline
+
+    def invalidate(self):
+        with self._lock:
+            self._baseline = None
+
+
+cache = BaselineCache()
+
+
+def find_anomalies(intervals, baseline):
+    """Score usage.compute_usage() buckets; returns (scored buckets, anomalous ones)."""
+    scored, anomalies = [], []
+    for bucket, avg_usage, samples in intervals:
+        slot = baseline.get(slot_of(bucket))
+        if slot is None or slot["samples"] < MIN_SAMPLES:
+            continue
+        point = {
+            **usage.format_point(bucket, avg_usage, samples),
+            "bucket": bucket.isoformat(),
+            "p50": slot["p50"],
+            "threshold": slot["threshold"],
+            "ratio": avg_usage / slot["threshold"] if slot["threshold"] else None
+        }
+        scored.append(point)
+        if avg_usage > slot["threshold"]:
+            anomalies.append(point)
+    return scored, anomalies
@@ -1,162 +1,407 @@
 import os
-from flask import Flask, jsonify, send_from_directory, render_template
-from pymongo import MongoClient, errors
-from datetime import datetime, timedelta
-from collections import defaultdict
+from flask import Blueprint, Flask, Response, current_app, jsonify, request, send_from_directory, render_template, stream_with_context
+from datetime import datetime, timedelta, timezone
 from flask_cors import CORS
-from qe_utils import get_encryption_client, close_encryption_resources, QE_NAMESPACE
-
-app = Flask(__name__)
-# Allow all origins with more permissive CORS settings
-CORS(app, resources={r"/api/*": {"origins": "*"}})
-
-# --- MongoDB connection setup ---
-# These should match what you're using in insert_ts_2.py
-MONGODB_URI = os.environ.get("MONGODB_URI")          # e.g. "cluster0.mongodb.net"
-MONGODB_USERNAME = os.environ.get("MONGODB_USERNAME") # e.g. "myUser"
-MONGODB_PASSWORD = os.environ.get("MONGODB_PASSWORD") # e.g. "myPassword"
-
-try:
-    # Construct the connection string for MongoDB - SAME FORMAT as insert_ts_2.py
-    connection_string = f"mongodb+srv://{MONGODB_USERNAME}:{MONGODB_PASSWORD}@{MONGODB_URI}/?retryWrites=true&w=majority"
-    print(f"Connecting to MongoDB with URI: {MONGODB_URI}")
-    
-    # Add timeout to fail faster if connection isn't working
-    client = MongoClient(connection_string, serverSelectionTimeoutMS=5000)
-    
-    # Test connection
-    client.admin.command('ping')
-    print("Successfully connected to MongoDB!")
-    
-    # Define database and collection
-    db = client["smart_home"]
-    collection = db["sensor_readings"]
-except Exception as e:
-    print(f"MongoDB connection error: {e}")
-    print("Application will start but database operations will fail")
-    # Create a client anyway to prevent app from crashing, but operations will fail
-    connection_string = "mongodb://localhost:27017/"  # This won't be used
-    client = MongoClient(connection_string)
-    db = client["smart_home"]
-    collection = db["sensor_readings"]
-
-@app.route('/')
+import admission
+import anomalies
+import assets
+import compression
+import db
+import device_stats
+import devices
+import ingest
+import metrics
+import profiling
+import read_profiles
+import retention
+import serialization
+import usage
+import usage_stream
+
+bp = Blueprint("smart_home", __name__)
+
+# Which usage.ENGINES implementation serves /api/usage
+USAGE_ENGINE = os.environ.get("USAGE_ENGINE", "python")
+# How /api/usage fills buckets without readings (usage.FILL_POLICIES); ?fill= overrides
+USAGE_FILL = os.environ.get("USAGE_FILL", "null")
+# Users per /api/users/usage request
+USERS_BATCH_MAX = int(os.environ.get("USERS_BATCH_MAX", 100))
+# Responses with more points than this are streamed in chunks
+STREAM_THRESHOLD = int(os.environ.get("JSON_STREAM_THRESHOLD", 5000))
+# Most rows /api/device-stats returns
+DEVICE_STATS_LIMIT_MAX = int(os.environ.get("DEVICE_STATS_LIMIT_MAX", 1000))
+# /api/qe_demo runs qe_utils.prepared rather than a per-request auto-encryption client
+QE_PREPARED = os.environ.get("QE_PREPARED", "1") != "0"
+
+def create_app():
+    """
+    Application factory.
+
+    Nothing here touches the network: the MongoClient is created lazily by
+    db.get_client() on the first request in each process (see /readyz).
+    """
+    app = Flask(__name__)
+    # Allow all origins with more permissive CORS settings
+    CORS(app, resources={r"/api/*": {"origins": "*"}})
+    serialization.init_app(app)
+    app.register_blueprint(bp)
+    assets.init_app(app)
+    compression.init_app(app)
+    metrics.init_app(app)
+    profiling.init_app(app)
+    return app
+
+@bp.route('/healthz')
+def healthz():
+    """Liveness: the process is up and serving requests. Does not touch MongoDB."""
+    return jsonify({"status": "ok"})
+
+@bp.route('/readyz')
+def readyz():
+    """Readiness: a ping through the connection pool succeeds."""
+    try:
+        db.ping()
+        return jsonify({"status": "ready"})
+    except Exception as e:
+        return jsonify({"status": "unavailable", "error": str(e)}), 503
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint for this process."""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+@bp.route('/')
 def serve_index():
-    # Serve the index.html from the 'static' directory
-    return send_from_directory('static', 'index.html')
+    # The page is small and names its assets by content hash, so it is
+    # revalidated on every load while the assets are cached for good
+    response = Response(render_template('index.html'), mimetype="text/html")
+    response.add_etag()
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
-@app.route('/<path:path>')
+@bp.route('/<path:path>')
 def serve_static(path):
     return send_from_directory('static', path)
 
-@app.route('/api/usage')
+@bp.route('/api/usage')
+@admission.admitted("usage")
 def get_usage():
     """
-    Returns the last 3.5 days of electricity usage.
-    Groups data by 5-minute intervals (EST), sums current_usage for each interval.
+    Returns the last 3.5 days of electricity usage (or the window given by
+    ?start=&end= / ?days=). Groups data by 5-minute intervals, averages
+    current_usage for each interval and labels them in local time (?tz=, an
+    IANA zone name; default USAGE_TIMEZONE). Longer or older windows are served from
+    the hourly or daily retention tiers; X-Usage-Tier names the one used.
+
+    Every interval of the window is returned; ?fill= (null, linear, locf or
+    none) decides the usage of intervals without readings, which have
+    samples=0.
+
+    Responses carry an ETag; a matching If-None-Match gets a 304 without
+    running the aggregation.
     """
     try:
-        # Calculate the cutoff (last 3.5 days instead of 3)
-        now_utc = datetime.utcnow()
-        cutoff_utc = now_utc - timedelta(days=3.5)
-
-        # Query for documents in the last 3.5 days
-        docs = collection.find({"Timestamp": {"$gte": cutoff_utc}})
-
-        # We will group by 5-minute intervals in UTC, 
-        # then convert to EST when returning. 
-        usage_by_interval = defaultdict(float)
-        count_by_interval = defaultdict(int)
-
-        for doc in docs:
-            ts_utc = doc.get("Timestamp")
-            current_usage = doc.get("current_usage", 0.0)
-
-            if ts_utc:
-                # Truncate to 5-minute intervals
-                # First truncate to the minute
-                truncated_minute = ts_utc.replace(second=0, microsecond=0)
-                # Then calculate which 5-minute interval this belongs to
-                minute_part = truncated_minute.minute
-                interval_minute = (minute_part // 5) * 5
-                interval_time = truncated_minute.replace(minute=interval_minute)
-                
-                # Accumulate usage and count for averaging
-                usage_by_interval[interval_time] += float(current_usage)
-                count_by_interval[interval_time] += 1
-
-        # Calculate average usage for each 5-minute interval
-        avg_usage_by_interval = {}
-        for interval_time, total_usage in usage_by_interval.items():
-            count = count_by_interval[interval_time]
-            if count > 0:
-                avg_usage_by_interval[interval_time] = total_usage / count
-            else:
-                avg_usage_by_interval[interval_time] = total_usage
-
-        # Sort the intervals in ascending order
-        sorted_intervals = sorted(avg_usage_by_interval.keys())
-
-        # Prepare data for JSON response
-        # Convert each interval to local EST time
-        import pytz
-        est = pytz.timezone("US/Eastern")
-
-        data_points = []
-        for interval_utc in sorted_intervals:
-            interval_est = interval_utc.astimezone(est)
-            # Format: "MM/DD hh:mm AM/PM" - Keep the date part for day separators
-            interval_label = interval_est.strftime("%m/%d %I:%M %p")
-
-            data_points.append({
-                "label": interval_label,
-                "usage": avg_usage_by_interval[interval_utc],
-                # Add full date info for the frontend to use
-                "fullDate": interval_est.strftime("%Y-%m-%d")
-            })
-
-        print(f"Returning {len(data_points)} data points (5-minute intervals)")
-        return jsonify(data_points)
+        start_utc, end_utc = usage.parse_window(request.args, retention.MAX_WINDOW_DAYS)
+        fill = usage.parse_fill(request.args, USAGE_FILL)
+        zone = usage.parse_timezone(request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid parameters: {e}"}), 400
+
+    try:
+        database = db.get_db(retention.read_profile(retention.choose_tier(start_utc, end_utc)))
+        # The ETag's watermark always comes from the primary's view
+        latest = usage.latest_timestamp(db.get_db("interactive"))
+        etag = usage.usage_etag(latest, start_utc, end_utc, fill, USAGE_ENGINE, zone)
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        # Query + bucketing (for the python engine this includes cursor getMore time)
+        with metrics.timed_phase("aggregate"):
+            tier, intervals = retention.query_usage(database, start_utc, end_utc,
+                                                    engine=USAGE_ENGINE, fill=fill)
+
+        with metrics.timed_phase("format"):
+            # Prepare data for JSON response, labelled in local time
+            data_points = usage.format_points(intervals, zone)
+
+        print(f"Returning {len(data_points)} data points ({tier} tier)")
+        if len(data_points) > STREAM_THRESHOLD:
+            response = Response(
+                stream_with_context(serialization.stream_array(current_app.json, data_points)),
+                mimetype="application/json"
+            )
+        else:
+            with metrics.timed_phase("serialize"):
+                response = jsonify(data_points)
+        response.headers["X-Usage-Tier"] = tier
+        response.set_etag(etag)
+        if latest is not None:
+            response.last_modified = latest.replace(tzinfo=timezone.utc)
+        # Cacheable, but always revalidated: the data changes with every reading
+        response.cache_control.no_cache = True
+        return response
     except Exception as e:
         print(f"Error in get_usage: {e}")
-        return jsonify({"error": str(e)}), 500
+        return admission.error_response("usage", e)
+
+def _too_many_points(start, end):
+    # Per-user series come from raw readings only; the retention tiers are global
+    return (end - start) / timedelta(minutes=usage.BUCKET_MINUTES) > retention.MAX_POINTS
+
+def _user_series(intervals, start, end, fill, zone):
+    dense = usage.densify(intervals, usage.floor_to_bucket(start), end, timedelta(minutes=usage.BUCKET_MINUTES), fill)
+    return usage.format_points(dense, zone)
+
+@bp.route('/api/users/<user_id>/usage')
+@admission.admitted("user_usage")
+def get_user_usage(user_id):
+    """
+    One user's usage in 5-minute intervals, with the same window, fill and
+    tz parameters as /api/usage.
+    """
+    try:
+        start_utc, end_utc = usage.parse_window(request.args, retention.RAW_WINDOW_DAYS)
+        fill = usage.parse_fill(request.args, USAGE_FILL)
+        zone = usage.parse_timezone(request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid parameters: {e}"}), 400
+    end_utc = end_utc or datetime.utcnow()
+    if _too_many_points(start_utc, end_utc):
+        return jsonify({"error": f"Per-user windows are limited to {retention.MAX_POINTS} 5-minute intervals"}), 400
+
+    try:
+        database = db.get_db(read_profiles.select("user_usage", "interactive"))
+        with metrics.timed_phase("aggregate"):
+            intervals = usage.user_usage(database, user_id, start_utc, end_utc)
+        with metrics.timed_phase("format"):
+            data_points = _user_series(intervals, start_utc, end_utc, fill, zone)
+        with metrics.timed_phase("serialize"):
+            return jsonify(data_points)
+    except Exception as e:
+        print(f"Error in get_user_usage: {e}")
+        return admission.error_response("user_usage", e)
+
+@bp.route('/api/users/usage')
+@admission.admitted("users_usage")
+def get_users_usage():
+    """
+    Usage series for several users (?ids=user1,user2,...) from a single
+    aggregation, as {user_id: [points]}.
+    """
+    user_ids = [user_id for user_id in request.args.get("ids", "").split(",") if user_id]
+    if not user_ids:
+        return jsonify({"error": "ids is required"}), 400
+    if len(user_ids) > USERS_BATCH_MAX:
+        return jsonify({"error": f"At most {USERS_BATCH_MAX} users per request"}), 400
+    try:
+        start_utc, end_utc = usage.parse_window(request.args, retention.RAW_WINDOW_DAYS)
+        fill = usage.parse_fill(request.args, USAGE_FILL)
+        zone = usage.parse_timezone(request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid parameters: {e}"}), 400
+    end_utc = end_utc or datetime.utcnow()
+    if _too_many_points(start_utc, end_utc):
+        return jsonify({"error": f"Per-user windows are limited to {retention.MAX_POINTS} 5-minute intervals"}), 400
 
-@app.route('/api/qe_demo')
+    try:
+        database = db.get_db(read_profiles.select("users_usage", "analytics"))
+        with metrics.timed_phase("aggregate"):
+            series = usage.users_usage(database, user_ids, start_utc, end_utc)
+        with metrics.timed_phase("format"):
+            result = {
+                user_id: _user_series(intervals, start_utc, end_utc, fill, zone)
+                for user_id, intervals in series.items()
+            }
+        with metrics.timed_phase("serialize"):
+            return jsonify(result)
+    except Exception as e:
+        print(f"Error in get_users_usage: {e}")
+        return admission.error_response("users_usage", e)
+
+@bp.route('/api/usage/devices')
+@admission.admitted("device_usage")
+def get_device_usage():
+    """
+    Average and total usage per device over the last 3.5 days, with device
+    attributes joined from the in-app device cache.
+    """
+    try:
+        cutoff_utc = datetime.utcnow() - timedelta(days=usage.WINDOW_DAYS)
+        database = db.get_db(read_profiles.select("device_usage", "interactive"))
+        totals = usage.device_totals(database, cutoff_utc)
+        attributes = devices.cache.get_many([row["deviceId"] for row in totals])
+        return jsonify([{**row, **(attributes.get(row["deviceId"]) or {})} for row in totals])
+    except Exception as e:
+        print(f"Error in get_device_usage: {e}")
+        return admission.error_response("device_usage", e)
+
+@bp.route('/api/device-stats')
+@admission.admitted("device_stats")
+def get_device_stats():
+    """
+    Users, devices and energy consumption per region, city, device type and
+    brand from the materialized device_stats collection. ?region=, ?city=,
+    ?deviceType= and ?brand= filter exactly; ?minUsers=, ?sort= (a
+    device_stats.SORT_FIELDS name, descending) and ?limit= shape the result.
+    """
+    try:
+        filters = {field: request.args[field] for field in device_stats.GROUP_FIELDS if request.args.get(field)}
+        min_users = int(request.args.get("minUsers", 0))
+        limit = int(request.args.get("limit", 100))
+        if not 0 < limit <= DEVICE_STATS_LIMIT_MAX:
+            raise ValueError(f"limit must be between 1 and {DEVICE_STATS_LIMIT_MAX}")
+        sort = request.args.get("sort", "users")
+        if sort not in device_stats.SORT_FIELDS:
+            raise ValueError(f"sort must be one of {', '.join(device_stats.SORT_FIELDS)}")
+    except ValueError as e:
+        return jsonify({"error": f"Invalid parameters: {e}"}), 400
+
+    try:
+        # A periodically refreshed report; a lagging secondary is fine
+        database = db.get_db(read_profiles.select("device_stats", "analytics"))
+        stats = device_stats.query_stats(database, filters, min_users=min_users, sort=sort, limit=limit)
+        return jsonify({"refreshedAt": device_stats.refreshed_at(database), "stats": stats})
+    except Exception as e:
+        print(f"Error in get_device_stats: {e}")
+        return admission.error_response("device_stats", e)
+
+@bp.route('/api/usage/anomalies')
+# The first request after ANOMALY_BASELINE_TTL also refreshes the baseline
+@admission.admitted("anomalies", budget=20)
+def get_usage_anomalies():
+    """
+    5-minute buckets in the window (default: the last 3.5 days) whose average
+    usage is above the percentile baseline for their local weekday and hour.
+    ?all=1 also returns every scored bucket.
+    """
+    try:
+        start_utc, end_utc = usage.parse_window(request.args, retention.RAW_WINDOW_DAYS)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid window: {e}"}), 400
+
+    try:
+        with metrics.timed_phase("baseline"):
+            baseline = anomalies.cache.get()
+        database = db.get_db(read_profiles.select("anomalies", "interactive"))
+        with metrics.timed_phase("aggregate"):
+            intervals = usage.compute_usage(database, start_utc, end_utc, engine=USAGE_ENGINE)
+        with metrics.timed_phase("format"):
+            scored, flagged = anomalies.find_anomalies(intervals, baseline)
+        result = {
+            "percentile": anomalies.PERCENTILE,
+            "baselineDays": anomalies.BASELINE_DAYS,
+            "buckets": len(scored),
+            "anomalies": flagged
+        }
+        if request.args.get("all"):
+            result["scored"] = scored
+        with metrics.timed_phase("serialize"):
+            return jsonify(result)
+    except Exception as e:
+        print(f"Error in get_usage_anomalies: {e}")
+        return admission.error_response("anomalies", e)
+
+@bp.route('/api/usage/stream')
+def stream_usage():
+    """
+    Server-sent events with the running average of the open 5-minute buckets.
+    All clients of this process share one database watcher (see usage_stream).
+    Each stream holds a worker thread, so beyond USAGE_STREAM_MAX_CLIENTS
+    streams per process clients get 503 and keep the static chart.
+    """
+    client_queue = usage_stream.tailer.subscribe()
+    if client_queue is None:
+        admission.SHED.inc(route="stream", reason="stream_limit")
+        response = jsonify({"error": "Too many live update streams, retry later"})
+        response.status_code = 503
+        response.headers["Retry-After"] = str(admission.RETRY_AFTER)
+        return response
+    return Response(
+        stream_with_context(usage_stream.event_stream(client_queue)),
+        mimetype="text/event-stream",
+        # Stop proxies (e.g. nginx) from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@bp.route('/api/readings', methods=['POST'])
+def post_readings():
+    """
+    Accept one reading, a JSON array or an NDJSON batch into the write buffer.
+    Returns 202 once buffered; 429 with Retry-After when the buffer is full.
+    """
+    try:
+        raw_readings = ingest.parse_body(request.get_data(), request.content_type)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid body: {e}"}), 400
+
+    if len(raw_readings) > ingest.MAX_BATCH:
+        return jsonify({"error": f"At most {ingest.MAX_BATCH} readings per request"}), 413
+
+    docs = []
+    for index, raw in enumerate(raw_readings):
+        try:
+            docs.append(ingest.validate_reading(raw))
+        except ingest.ValidationError as e:
+            return jsonify({"error": str(e), "index": index}), 400
+
+    # Static attributes live in the devices collection, not on every reading
+    reported = {}
+    for doc in docs:
+        attributes = devices.split_attributes(doc)
+        if attributes:
+            reported[doc["metadata"]["deviceId"]] = attributes
+
+    if not ingest.buffer.offer(docs):
+        response = jsonify({"error": "Ingest buffer is full, retry later"})
+        response.headers["Retry-After"] = str(ingest.RETRY_AFTER)
+        return response, 429
+
+    for device_id, attributes in reported.items():
+        try:
+            devices.cache.ensure(device_id, attributes)
+        except Exception as e:
+            print(f"Could not update attributes of device {device_id}: {e}")
+
+    return jsonify({"accepted": len(docs)}), 202
+
+@bp.route('/api/qe_demo')
+@admission.admitted("qe_demo")
 def get_senior_citizens_west_coast():
     """Returns senior citizens in West Coast region using queryable encryption."""
+    # Deferred so the encryption stack is only loaded on first QE use
+    from qe_utils import (get_encryption_client, close_encryption_resources, QE_NAMESPACE,
+                          SENIOR_WEST_COAST_FILTER, senior_west_coast_result, prepared)
+
     try:
+        if QE_PREPARED:
+            # Filter encrypted once and cached; no query analysis per request
+            results = prepared.find()
+            return jsonify(senior_west_coast_result(results))
+
         # Get encrypted client
         encrypted_client, client_encryption = get_encryption_client()
         
         # Query encrypted data
         db_name, coll_name = QE_NAMESPACE.split(".")
-        results = list(encrypted_client[db_name][coll_name].find({
-            "age": {"$gte": 65},
-            "location.region": "West Coast"
-        }))
-        
-        # Prepare results for JSON response
-        for doc in results:
-            doc["_id"] = str(doc["_id"])
-            if "created_at" in doc:
-                doc["created_at"] = doc["created_at"].isoformat()
+        # ObjectId and datetime values are encoded by the app's JSON provider
+        results = list(encrypted_client[db_name][coll_name].find(SENIOR_WEST_COAST_FILTER))
         
         # Close resources
         close_encryption_resources(encrypted_client, client_encryption)
         
-        return jsonify({
-            "count": len(results),
-            "message": "Senior citizens (age ≥ 65) in the West Coast region",
-            "results": results
-        })
+        return jsonify(senior_west_coast_result(results))
     except Exception as e:
         print(f"QE demo error: {e}")
+        if admission.is_timeout(e):
+            return admission.error_response("qe_demo", e)
         return jsonify({
             "error": str(e),
             "message": "Failed to query encrypted data. Check AWS credentials and data setup."
         }), 500
 
-@app.route('/qe_demo')
+@bp.route('/qe_demo')
 def qe_demo_page():
     """
     Render the Queryable Encryption demo page
@@ -164,6 +409,7 @@ def qe_demo_page():
     return render_template('qe_demo.html')
 
 if __name__ == '__main__':
-    # Run the Flask app
-    print("Starting Flask app on http://localhost:5000")
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # Run the Flask development server (use wsgi.py with gunicorn in production)
+    port = int(os.environ.get("PORT", 5000))
+    print(f"Starting Flask app on http://localhost:{port}")
+    create_app().run(debug=True, host='0.0.0.0', port=port)
@@ -0,0 +1,230 @@
+"""
+ASGI serving mode: /api/usage and /api/qe_demo on Starlette with Motor.
+
+    uvicorn --app-dir app asgi:app --host 0.0.0.0 --port 8000 --workers 4
+
+The Flask app holds a worker thread for every in-flight request, most of
+which is spent waiting on MongoDB. Here each worker runs one event loop and a
+waiting request is a suspended coroutine. Motor 3 still runs driver calls on
+a shared thread pool underneath (MOTOR_MAX_WORKERS), so that pool, not the
+number of connected clients, bounds concurrent MongoDB operations per worker.
+Motor is used rather than pymongo's own async client: that client
+(pymongo.asynchronous) is experimental in the pinned pymongo 4.9.2, and
+Motor 3.6 is the supported async driver for it.
+
+Only the I/O differs from the Flask routes. Window and fill parsing, ETags,
+tier choice, read profiles, pipelines, densify() and format_points() are the
+same functions, so both modes return identical bodies. Raw windows are
+always bucketed on the server (the aggregate engine): the python engine
+would move every reading through the event loop.
+
+Also serves /healthz, /readyz and /metrics. Requires starlette, uvicorn and
+motor (see requirements.txt).
+"""
+import os
+import time
+import asyncio
+import contextlib
+from datetime import datetime, timezone
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import Response
+from starlette.routing import Route
+from werkzeug.http import http_date, parse_etags
+import compression
+import connection
+import db
+import metrics
+import qe_utils
+import read_profiles
+import retention
+import serialization
+import usage
+
+# How /api/usage fills buckets without readings when ?fill= is not given
+USAGE_FILL = os.environ.get("USAGE_FILL", "null")
+# Raw windows are bucketed on the server; this names it in the ETag
+ENGINE = "aggregate"
+
+_client = None
+# /api/qe_demo runs qe_utils.prepared filters rather than auto-encrypting each query
+QE_PREPARED = os.environ.get("QE_PREPARED", "1") != "0"
+
+# (encrypted Motor client, ClientEncryption or None), created on the first QE request
+_qe = None
+_qe_lock = asyncio.Lock()
+
+
+def get_client():
+    global _client
+    if _client is None:
+        print(f"Creating async MongoDB client for {connection.MONGODB_URI} (pid {os.getpid()})")
+        _client = connection.create_async_client(appname="api-async")
+    return _client
+
+
+def get_db(profile=None):
+    database = get_client()[db.DATABASE_NAME]
+    return read_profiles.with_profile(database, profile) if profile else database
+
+
+def _json(obj, status_code=200, headers=None):
+    return Response(serialization.dumps(obj), status_code=status_code,
+                    media_type="application/json", headers=headers)
+
+
+def timed(route):
+    """Record the http_request_* metrics for a handler, like metrics.init_app() does for Flask."""
+    def decorator(handler):
+        async def wrapper(request):
+            start = time.perf_counter()
+            metrics.REQUESTS_IN_FLIGHT.inc(route=route)
+            status = 500
+            try:
+                response = await handler(request)
+                status = response.status_code
+                return response
+            finally:
+                metrics.REQUESTS_IN_FLIGHT.dec(route=route)
+                metrics.REQUEST_DURATION.observe(time.perf_counter() - start, route=route,
+                                                 method=request.method, status=status)
+        return wrapper
+    return decorator
+
+
+async def healthz(request):
+    return _json({"status": "ok"})
+
+
+async def readyz(request):
+    try:
+        await asyncio.wait_for(get_client().admin.command("ping"), db.READY_TIMEOUT)
+        return _json({"status": "ready"})
+    except Exception as e:
+        return _json({"status": "unavailable", "error": str(e)}, 503)
+
+
+async def metrics_endpoint(request):
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
+async def latest_timestamp(database):
+    newest = await database[usage.READINGS_COLLECTION].find_one(
+        {}, {"Timestamp": 1}, sort=[("Timestamp", -1)])
+    return newest["Timestamp"] if newest else None
+
+
+async def query_usage(database, start, end, fill):
+    """retention.query_usage() on Motor: (tier name, densified intervals)."""
+    now = datetime.utcnow()
+    tier = retention.choose_tier(start, end, now)
+    if tier["name"] == "raw":
+        pipeline = usage.bucket_pipeline(start, end) + [{"$sort": {"_id": 1}}]
+        cursor = database[usage.READINGS_COLLECTION].aggregate(pipeline)
+    else:
+        cursor = database[tier["collection"]].find(
+            retention.tier_filter(tier, start, end), retention.TIER_PROJECTION, sort=retention.TIER_SORT)
+    docs = await cursor.to_list(length=None)
+    return tier["name"], retention.densify_tier(usage.bucket_intervals(docs), tier, start, end, fill, now)
+
+
+@timed("/api/usage")
+async def get_usage(request):
+    """Same parameters, headers and body as the Flask /api/usage."""
+    try:
+        start_utc, end_utc = usage.parse_window(request.query_params, retention.MAX_WINDOW_DAYS)
+        fill = usage.parse_fill(request.query_params, USAGE_FILL)
+        zone = usage.parse_timezone(request.query_params)
+    except ValueError as e:
+        return _json({"error": f"Invalid parameters: {e}"}, 400)
+
+    try:
+        database = get_db(retention.read_profile(retention.choose_tier(start_utc, end_utc)))
+        # The ETag's watermark always comes from the primary's view
+        latest = await latest_timestamp(get_db("interactive"))
+        etag = usage.usage_etag(latest, start_utc, end_utc, fill, ENGINE, zone)
+        if parse_etags(request.headers.get("if-none-match")).contains_weak(etag):
+            return Response(status_code=304, headers={"ETag": f'"{etag}"'})
+
+        tier, intervals = await query_usage(database, start_utc, end_utc, fill)
+        data_points = usage.format_points(intervals, zone)
+        headers = {"X-Usage-Tier": tier, "ETag": f'"{etag}"', "Cache-Control": "no-cache"}
+        if latest is not None:
+            headers["Last-Modified"] = http_date(latest.replace(tzinfo=timezone.utc))
+        return _json(data_points, headers=headers)
+    except Exception as e:
+        print(f"Error in get_usage: {e}")
+        return _json({"error": str(e)}, 500)
+
+
+async def get_encrypted_collection():
+    """
+    The QE collection through a per-worker encrypted Motor client. Key vault
+    setup is blocking pymongo code, so it runs on a thread, once. With
+    QE_PREPARED the client bypasses query analysis and only decrypts.
+    """
+    global _qe
+    async with _qe_lock:
+        if _qe is None:
+            if QE_PREPARED:
+                client = connection.create_async_client(
+                    appname="qe-async", auto_encryption_opts=qe_utils.bypass_encryption_opts())
+                _qe = (client, None)
+            else:
+                auto_encryption_opts, client_encryption = await asyncio.to_thread(qe_utils.get_auto_encryption_opts)
+                client = connection.create_async_client(appname="qe-async", auto_encryption_opts=auto_encryption_opts)
+                _qe = (client, client_encryption)
+    db_name, coll_name = qe_utils.QE_NAMESPACE.split(".")
+    return _qe[0][db_name][coll_name]
+
+
+@timed("/api/qe_demo")
+async def get_senior_citizens_west_coast(request):
+    """Same query and body as the Flask /api/qe_demo."""
+    try:
+        collection = await get_encrypted_collection()
+        if QE_PREPARED:
+            # Encrypting a new filter is blocking; cache hits return at once
+            query = await asyncio.to_thread(qe_utils.prepared.filter)
+        else:
+            query = qe_utils.SENIOR_WEST_COAST_FILTER
+        results = await collection.find(query).to_list(length=None)
+        return _json(qe_utils.senior_west_coast_result(results))
+    except Exception as e:
+        print(f"QE demo error: {e}")
+        return _json({
+            "error": str(e),
+            "message": "Failed to query encrypted data. Check AWS credentials and data setup."
+        }, 500)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """Close this worker's clients on shutdown."""
+    global _client, _qe
+    yield
+    if _qe is not None:
+        qe_utils.close_encryption_resources(*_qe)
+        qe_utils.prepared.close()
+        _qe = None
+    if _client is not None:
+        _client.close()
+        _client = None
+
+
+def create_app():
+    return Starlette(
+        routes=[
+            Route("/healthz", healthz),
+            Route("/readyz", readyz),
+            Route("/metrics", metrics_endpoint),
+            Route("/api/usage", get_usage),
+            Route("/api/qe_demo", get_senior_citizens_west_coast),
+        ],
+        middleware=[Middleware(GZipMiddleware, minimum_size=compression.MIN_SIZE)],
+        lifespan=lifespan,
+    )
+
+
+app = create_app()
@@ -0,0 +1,71 @@
+"""
+Content-hashed URLs for the files in app/static.
+
+Templates reference assets with asset_url("dashboard.js"), which renders as
+/assets/dashboard.<hash>.js where <hash> is taken from the file's contents.
+Those URLs change whenever the file does, so they are served with a
+one-year immutable Cache-Control; the HTML pages that reference them are
+revalidated on every load instead (see compression.py and app.serve_index).
+"""
+import os
+import hashlib
+import threading
+from flask import Blueprint, abort, send_from_directory
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+# One year; hashed URLs never change content
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+HASH_LENGTH = 10
+
+bp = Blueprint("assets", __name__)
+
+# logical name -> hashed name, and back. Built on first use; files in
+# app/static only change with a deploy, which starts new processes.
+_manifest = None
+_reverse = None
+_lock = threading.Lock()
+
+
+def hashed_name(name, content):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(content).hexdigest()[:HASH_LENGTH]}{ext}"
+
+
+def manifest():
+    global _manifest, _reverse
+    if _manifest is None:
+        with _lock:
+            if _manifest is None:
+                built = {}
+                for root, _, files in os.walk(STATIC_DIR):
+                    for filename in files:
+                        path = os.path.join(root, filename)
+                        name = os.path.relpath(path, STATIC_DIR).replace(os.sep, "/")
+                        with open(path, "rb") as f:
+                            built[name] = hashed_name(name, f.read())
+                _reverse = {hashed: name for name, hashed in built.items()}
+                _manifest = built
+    return _manifest
+
+
+def asset_url(name):
+    """URL of a file in app/static that can be cached forever."""
+    return f"/assets/{manifest()[name]}"
+
+
+@bp.route('/assets/<path:filename>')
+def serve_asset(filename):
+    manifest()
+    name = _reverse.get(filename)
+    if name is None:
+        # Unknown or outdated hash
+        abort(404)
+    response = send_from_directory(STATIC_DIR, name, max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def init_app(app):
+    app.register_blueprint(bp)
+    app.jinja_env.globals["asset_url"] = asset_url
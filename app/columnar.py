@@ -0,0 +1,153 @@
+"""
+Columnar reads: a find() decoded straight into NumPy arrays.
+
+Python-side aggregation used to iterate a cursor of full reading documents
+(brand, model, temperature, pressure, ...) to read two fields from each.
+fetch() asks the server for only the named columns, converted to a fixed
+BSON type by the projection, and reads the raw batches with
+find_raw_batches(). When every document in a batch has the same layout,
+which the projection makes the normal case, the batch bytes are viewed
+through a structured dtype and each column is copied out in one operation.
+No per-document Python objects are created. A batch that does not fit
+(a missing field, or the server ordering fields differently) is decoded
+with bson.decode_all() instead, so the result is the same either way.
+
+    columns = columnar.fetch(db.sensor_readings, {"Timestamp": {"$gte": start}},
+                             {"Timestamp": columnar.DATE, "current_usage": columnar.DOUBLE})
+    starts, sums, counts = columnar.bucket(columns["Timestamp"], columns["current_usage"], 300)
+
+Column names are top-level field names. DATE columns are datetime64[ms]
+(NaT where missing), DOUBLE columns float64 (NaN where missing or not
+numeric).
+"""
+import os
+import math
+import numpy as np
+import bson
+
+DATE = "date"
+DOUBLE = "double"
+
+# BSON element type codes and value sizes for the column kinds
+_TYPES = {DATE: (0x09, "<i8"), DOUBLE: (0x01, "<f8")}
+_SIZES = {0x09: 8, 0x01: 8}
+
+# Documents per raw batch requested from the server
+BATCH_SIZE = int(os.environ.get("COLUMNAR_BATCH_SIZE", 50000))
+
+
+def projection(columns):
+    """find() projection that returns each column with a fixed BSON type."""
+    project = {"_id": 0}
+    for name, kind in columns.items():
+        if kind == DATE:
+            project[name] = f"${name}"
+        elif kind == DOUBLE:
+            project[name] = {"$convert": {"input": f"${name}", "to": "double",
+                                          "onError": math.nan, "onNull": math.nan}}
+        else:
+            raise ValueError(f"Unknown column kind '{kind}'")
+    return project
+
+
+def _dtype(kind):
+    return np.dtype("datetime64[ms]") if kind == DATE else np.dtype(np.float64)
+
+
+def _layout(order, columns):
+    """Structured dtype of one document whose fields are `order`, in that order."""
+    fields = [("_length", "<i4")]
+    for index, name in enumerate(order):
+        fields += [(f"_type{index}", "u1"),
+                   (f"_name{index}", f"S{len(name.encode()) + 1}"),
+                   (name, _TYPES[columns[name]][1])]
+    fields.append(("_end", "u1"))
+    return np.dtype(fields)
+
+
+def _first_order(raw):
+    """Field names of the first document in `raw`, or None if it has a field of another type."""
+    if len(raw) < 5:
+        return None
+    length = int.from_bytes(raw[:4], "little")
+    offset, order = 4, []
+    while offset < length - 1:
+        size = _SIZES.get(raw[offset])
+        end = raw.find(b"\x00", offset + 1)
+        if size is None or end < 0:
+            return None
+        order.append(raw[offset + 1:end].decode())
+        offset = end + 1 + size
+    return tuple(order)
+
+
+def _view(raw, columns):
+    """The batch as a structured array, or None if its documents do not all share one layout."""
+    order = _first_order(raw)
+    if order is None or sorted(order) != sorted(columns):
+        return None
+    layout = _layout(order, columns)
+    if len(raw) % layout.itemsize:
+        return None
+    docs = np.frombuffer(raw, dtype=layout)
+    if not (docs["_length"] == layout.itemsize).all() or docs["_end"].any():
+        return None
+    for index, name in enumerate(order):
+        if not ((docs[f"_type{index}"] == _TYPES[columns[name]][0]).all()
+                and (docs[f"_name{index}"] == name.encode()).all()):
+            return None
+    return docs
+
+
+def decode_batch(raw, columns):
+    """{name: array} for the documents in one raw batch."""
+    docs = _view(raw, columns)
+    if docs is not None:
+        return {
+            name: docs[name].astype(_dtype(kind))
+            for name, kind in columns.items()
+        }
+    # Slow path: decode to dicts
+    decoded = bson.decode_all(raw)
+    result = {}
+    for name, kind in columns.items():
+        values = [doc.get(name) for doc in decoded]
+        if kind == DOUBLE:
+            values = [math.nan if value is None else value for value in values]
+        result[name] = np.array(values, dtype=_dtype(kind))
+    return result
+
+
+def fetch(collection, query, columns, batch_size=BATCH_SIZE):
+    """{name: array} of `columns` ({name: DATE or DOUBLE}) for the documents matching `query`."""
+    parts = {name: [] for name in columns}
+    for raw in collection.find_raw_batches(query, projection(columns), batch_size=batch_size):
+        for name, array in decode_batch(raw, columns).items():
+            parts[name].append(array)
+    return {
+        name: np.concatenate(arrays) if arrays else np.array([], dtype=_dtype(columns[name]))
+        for name, arrays in parts.items()
+    }
+
+
+def bucket(timestamps, values, step_seconds):
+    """
+    Sum and count `values` per `step_seconds` bucket of `timestamps` (aligned
+    to the epoch), with floor division and bincount. Returns the non-empty
+    buckets as (starts datetime64[ms], sums, counts), in ascending order.
+    Entries with a NaT timestamp are skipped.
+    """
+    present = ~np.isnat(timestamps)
+    if not present.all():
+        timestamps, values = timestamps[present], values[present]
+    if not len(timestamps):
+        return np.array([], dtype="datetime64[ms]"), np.array([]), np.array([], dtype=np.int64)
+    step = step_seconds * 1000
+    index = np.floor_divide(timestamps.astype("datetime64[ms]").astype(np.int64), step)
+    origin = index.min()
+    index -= origin
+    counts = np.bincount(index)
+    sums = np.bincount(index, weights=values)
+    filled = np.flatnonzero(counts)
+    starts = ((filled + origin) * step).astype("datetime64[ms]")
+    return starts, sums[filled], counts[filled]
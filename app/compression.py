@@ -0,0 +1,75 @@
+"""
+Response compression.
+
+An after_request hook compresses responses of at least COMPRESS_MIN_SIZE
+bytes whose content type is text-like, using brotli when the client accepts
+it and the Brotli package is installed, gzip otherwise. Streamed responses
+(the SSE stream, chunked JSON arrays) are left alone; compressing them would
+mean buffering them.
+"""
+import os
+import gzip
+from flask import request
+import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))
+GZIP_LEVEL = int(os.environ.get("COMPRESS_GZIP_LEVEL", 6))
+# Brotli quality 4 compresses better than gzip -6 at a similar speed
+BROTLI_QUALITY = int(os.environ.get("COMPRESS_BROTLI_QUALITY", 4))
+
+COMPRESSIBLE = ("text/", "application/json", "application/javascript", "image/svg+xml")
+
+COMPRESSED_BYTES = metrics.REGISTRY.register(metrics.Counter(
+    "http_compressed_bytes_total", "Response bytes before and after compression.", ("encoding", "stage")))
+
+
+def choose_encoding(accept_encoding):
+    if brotli is not None and "br" in accept_encoding:
+        return "br"
+    if "gzip" in accept_encoding:
+        return "gzip"
+    return None
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def compress_response(response):
+    response.vary.add("Accept-Encoding")
+    streamed = response.is_streamed and not response.direct_passthrough
+    if (response.status_code != 200 or streamed or "Content-Encoding" in response.headers
+            or not (response.mimetype or "").startswith(COMPRESSIBLE)):
+        return response
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    # Files from send_from_directory are passed through; read them so they
+    # can be compressed (static files here are small)
+    response.direct_passthrough = False
+    data = response.get_data()
+    if len(data) < MIN_SIZE:
+        return response
+
+    compressed = compress(data, encoding)
+    COMPRESSED_BYTES.inc(len(data), encoding=encoding, stage="in")
+    COMPRESSED_BYTES.inc(len(compressed), encoding=encoding, stage="out")
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    # The compressed body is a different representation of the same resource
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    app.after_request(compress_response)
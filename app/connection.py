@@ -0,0 +1,224 @@
+"""
+The one place MongoClients are built, for the app and for every script.
+
+create_client() applies the same pool, compression and timeout settings
+everywhere, tags connections with an appname (visible in server logs,
+currentOp and Atlas' profiler) and attaches pool_metrics, which exports
+connection-pool statistics to the /metrics registry, and read_profiles.monitor,
+which counts where reads were routed. Clients that serve Flask requests pass
+request_metrics=True to also attach metrics.command_timer, which adds each
+command's time to the current request's MongoDB time.
+
+Settings, all optional:
+
+    MONGODB_MAX_POOL_SIZE            connections per server (default 100)
+    MONGODB_MIN_POOL_SIZE            connections kept open (default 0)
+    MONGODB_MAX_IDLE_TIME_MS         close idle connections after this (default: never)
+    MONGODB_WAIT_QUEUE_TIMEOUT_MS    wait for a free connection at most this long
+    MONGODB_COMPRESSORS              wire compression, in order of preference
+                                     (default zstd,snappy,zlib; unavailable ones are skipped)
+    MONGODB_CONNECT_TIMEOUT_MS       TCP connect + handshake (default 10000)
+    MONGODB_SERVER_SELECTION_TIMEOUT_MS  (default 5000)
+    MONGODB_TIMEOUT_MS               client-wide per-operation timeout (default: none)
+    MONGODB_APPNAME                  appname prefix (default smart-home)
+"""
+import os
+import time
+import threading
+from pymongo import MongoClient, monitoring
+import metrics
+import read_profiles
+
+MONGODB_URI = os.environ.get("MONGODB_URI")          # e.g. "cluster0.mongodb.net"
+MONGODB_USERNAME = os.environ.get("MONGODB_USERNAME") # e.g. "myUser"
+MONGODB_PASSWORD = os.environ.get("MONGODB_PASSWORD") # e.g. "myPassword"
+
+
+def _optional_int(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+MAX_POOL_SIZE = int(os.environ.get("MONGODB_MAX_POOL_SIZE", 100))
+MIN_POOL_SIZE = int(os.environ.get("MONGODB_MIN_POOL_SIZE", 0))
+MAX_IDLE_TIME_MS = _optional_int("MONGODB_MAX_IDLE_TIME_MS")
+WAIT_QUEUE_TIMEOUT_MS = _optional_int("MONGODB_WAIT_QUEUE_TIMEOUT_MS")
+COMPRESSORS = os.environ.get("MONGODB_COMPRESSORS", "zstd,snappy,zlib")
+CONNECT_TIMEOUT_MS = int(os.environ.get("MONGODB_CONNECT_TIMEOUT_MS", 10000))
+SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get("MONGODB_SERVER_SELECTION_TIMEOUT_MS", 5000))
+TIMEOUT_MS = _optional_int("MONGODB_TIMEOUT_MS")
+APP_NAME = os.environ.get("MONGODB_APPNAME", "smart-home")
+
+# Python package each compressor needs; zlib is in the standard library
+_COMPRESSOR_MODULES = {"zstd": "zstandard", "snappy": "snappy", "zlib": "zlib"}
+
+POOL_CONNECTIONS = metrics.REGISTRY.register(metrics.Gauge(
+    "mongo_pool_connections", "Open pooled connections per server.", ("address",)))
+POOL_CHECKED_OUT = metrics.REGISTRY.register(metrics.Gauge(
+    "mongo_pool_checked_out", "Connections currently checked out per server.", ("address",)))
+POOL_CHECKOUTS = metrics.REGISTRY.register(metrics.Counter(
+    "mongo_pool_checkouts_total", "Connection checkouts by outcome.", ("outcome",)))
+POOL_CHECKOUT_WAIT = metrics.REGISTRY.register(metrics.Histogram(
+    "mongo_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection."))
+POOL_CLEARED = metrics.REGISTRY.register(metrics.Counter(
+    "mongo_pool_cleared_total", "Pools cleared after network errors or failovers.", ("address",)))
+
+
+def connection_string(uri=None):
+    """`uri` if given, else the Atlas SRV string built from the MONGODB_* variables."""
+    return uri or f"mongodb+srv://{MONGODB_USERNAME}:{MONGODB_PASSWORD}@{MONGODB_URI}/?retryWrites=true&w=majority"
+
+
+def available_compressors(names=COMPRESSORS):
+    """The configured compressors whose Python package is installed, in order."""
+    available = []
+    for name in (n.strip() for n in names.split(",")):
+        module = _COMPRESSOR_MODULES.get(name)
+        if module is None:
+            continue
+        try:
+            __import__(module)
+        except ImportError:
+            continue
+        available.append(name)
+    return available
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Feeds connection-pool events into the mongo_pool_* metrics."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._open = 0
+        self._lock = threading.Lock()
+
+    def _address(self, event):
+        host, port = event.address
+        return f"{host}:{port}"
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        POOL_CLEARED.inc(address=self._address(event))
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self._open += 1
+        POOL_CONNECTIONS.inc(address=self._address(event))
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self._open -= 1
+        POOL_CONNECTIONS.dec(address=self._address(event))
+
+    def connection_check_out_started(self, event):
+        # Checkout events fire on the thread that asked for the connection
+        self._local.started = time.perf_counter()
+
+    def _observe_wait(self):
+        started = getattr(self._local, "started", None)
+        if started is not None:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started)
+            self._local.started = None
+
+    def connection_check_out_failed(self, event):
+        self._observe_wait()
+        POOL_CHECKOUTS.inc(outcome=str(event.reason))
+
+    def connection_checked_out(self, event):
+        self._observe_wait()
+        POOL_CHECKOUTS.inc(outcome="ok")
+        POOL_CHECKED_OUT.inc(address=self._address(event))
+
+    def connection_checked_in(self, event):
+        POOL_CHECKED_OUT.dec(address=self._address(event))
+
+    def open_connections(self):
+        """Open connections across all servers of every client in this process."""
+        with self._lock:
+            return self._open
+
+
+pool_metrics = PoolMetrics()
+
+
+def client_options(appname=None, **overrides):
+    """Keyword arguments for MongoClient; `overrides` win over the environment."""
+    options = {
+        "appname": f"{APP_NAME}-{appname}" if appname else APP_NAME,
+        "maxPoolSize": MAX_POOL_SIZE,
+        "minPoolSize": MIN_POOL_SIZE,
+        "connectTimeoutMS": CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": SERVER_SELECTION_TIMEOUT_MS,
+    }
+    compressors = available_compressors()
+    if compressors:
+        options["compressors"] = ",".join(compressors)
+    for name, value in (("maxIdleTimeMS", MAX_IDLE_TIME_MS),
+                        ("waitQueueTimeoutMS", WAIT_QUEUE_TIMEOUT_MS),
+                        ("timeoutMS", TIMEOUT_MS)):
+        if value is not None:
+            options[name] = value
+    options.update(overrides)
+    return options
+
+
+def create_client(uri=None, appname=None, event_listeners=(), request_metrics=False, **overrides):
+    """
+    A MongoClient with the shared settings. `appname` names the entry point
+    (e.g. "api", "insert-sensor-data"); extra keyword arguments are passed to
+    MongoClient and override the defaults (e.g. maxPoolSize for a load test).
+    request_metrics=True is for clients used inside Flask requests: their
+    command time counts towards the request's MongoDB time.
+    """
+    listeners = [pool_metrics, read_profiles.monitor]
+    if request_metrics:
+        listeners.append(metrics.command_timer)
+    return MongoClient(
+        connection_string(uri),
+        event_listeners=[*listeners, *event_listeners],
+        **client_options(appname, **overrides)
+    )
+
+
+def create_async_client(uri=None, appname=None, event_listeners=(), **overrides):
+    """
+    create_client() for asyncio code: a Motor client with the same settings
+    and pool and read-profile listeners. There is no request_metrics: the
+    command timer keeps per-thread totals, which mean nothing on an event
+    loop. Motor is only needed by the ASGI mode, so it is imported
+    here rather than at module level.
+    """
+    from motor.motor_asyncio import AsyncIOMotorClient
+    return AsyncIOMotorClient(
+        connection_string(uri),
+        event_listeners=[pool_metrics, read_profiles.monitor, *event_listeners],
+        **client_options(appname, **overrides)
+    )
+
+
+def prewarm(client, connections=None, timeout=5.0):
+    """
+    Select a server and open the pool before the first real operation.
+
+    A ping opens the first connection; the pool's background task then
+    fills it to minPoolSize, which this waits for (up to `timeout` seconds)
+    so that the first requests do not pay for TCP, TLS and auth handshakes.
+    Returns the number of open connections.
+    """
+    connections = MIN_POOL_SIZE if connections is None else connections
+    client.admin.command("ping")
+    deadline = time.monotonic() + timeout
+    while pool_metrics.open_connections() < connections and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return pool_metrics.open_connections()
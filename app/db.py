@@ -0,0 +1,71 @@
+import os
+import threading
+import pymongo
+import connection
+import read_profiles
+
+# --- MongoDB connection setup ---
+# Connection string, pool and timeout settings come from connection.py
+
+DATABASE_NAME = "smart_home"
+COLLECTION_NAME = "sensor_readings"
+
+# Upper bound for the /readyz ping, in seconds
+READY_TIMEOUT = float(os.environ.get("MONGODB_READY_TIMEOUT", 2))
+# Open the pool when a gunicorn worker starts instead of on its first request
+PREWARM = os.environ.get("MONGODB_PREWARM", "1") == "1"
+
+# One client (and therefore one connection pool) per process. The owning pid
+# is remembered so a forked child never reuses its parent's client.
+_client = None
+_client_pid = None
+_lock = threading.Lock()
+
+def get_client():
+    """
+    Return this process's MongoClient, creating it on first use.
+
+    Creating a MongoClient does not block: server discovery happens on
+    background threads, so the first query (or /readyz) is what waits for the
+    cluster. A client inherited across fork() is discarded, not closed - its
+    sockets and monitor threads belong to the parent.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _lock:
+            if _client is None or _client_pid != pid:
+                print(f"Creating MongoDB client for {connection.MONGODB_URI} (pid {pid})")
+                _client = connection.create_client(appname="api", request_metrics=True)
+                _client_pid = pid
+    return _client
+
+def get_db(profile=None):
+    """The app database, reading with a read_profiles profile if one is given."""
+    database = get_client()[DATABASE_NAME]
+    return read_profiles.with_profile(database, profile) if profile else database
+
+def get_collection(name=COLLECTION_NAME):
+    return get_db()[name]
+
+def ping():
+    """Round-trip to the cluster through the pool, bounded by READY_TIMEOUT."""
+    with pymongo.timeout(READY_TIMEOUT):
+        get_client().admin.command('ping')
+
+def prewarm():
+    """Open this process's pool (see connection.prewarm); failures are only logged."""
+    try:
+        opened = connection.prewarm(get_client())
+        print(f"MongoDB pool pre-warmed with {opened} connections (pid {os.getpid()})")
+    except Exception as e:
+        print(f"MongoDB pool pre-warm failed: {e}")
+
+def close_client():
+    """Close this process's client and its pooled connections."""
+    global _client, _client_pid
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
@@ -0,0 +1,197 @@
+"""
+Materialized device statistics for /api/device-stats.
+
+STATS_COLLECTION holds one document per (region, city, deviceType, brand)
+with the number of distinct users owning such a device, the number of
+devices and their total and average energyConsumption: the report
+overload_system.py computes from the users collection with $unwind and
+$addToSet, kept up to date instead of recomputed.
+
+Distinct-user counts cannot be adjusted in place when a user changes, so
+the refresh goes through CONTRIB_COLLECTION, one document per user and
+group. refresh() takes the users whose updated_at is at or after the
+watermark, replaces their contribution documents, and regroups only the
+groups those users were in before or are in now, with $merge into
+STATS_COLLECTION. Reprocessing a user is harmless, so the window overlaps
+the previous one by SETTLE_SECONDS to pick up writes that were in flight.
+
+Deleted users are only noticed by a full refresh (full=True), which
+reprocesses every user and drops the contributions of users that are gone.
+insert_user_data.py replaces the whole collection, so run one after it.
+"""
+import os
+import uuid
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
+
+USERS_COLLECTION = "users"
+STATS_COLLECTION = "device_stats"
+CONTRIB_COLLECTION = "device_stats_users"
+STATE_COLLECTION = "device_stats_state"
+
+# Users per batch of contribution updates
+BATCH_SIZE = int(os.environ.get("DEVICE_STATS_BATCH", 1000))
+SETTLE_SECONDS = int(os.environ.get("DEVICE_STATS_SETTLE_SECONDS", 5))
+
+GROUP_FIELDS = ("region", "city", "deviceType", "brand")
+SORT_FIELDS = ("users", "devices", "totalConsumption", "avgConsumptionPerUser", "avgConsumptionPerDevice")
+
+
+def ensure_indexes(database):
+    database[USERS_COLLECTION].create_index([("updated_at", 1)])
+    database[CONTRIB_COLLECTION].create_index([("_id.user", 1)])
+    database[CONTRIB_COLLECTION].create_index([("key", 1)])
+
+
+def contribution_pipeline(user_ids, run_id):
+    """Per user and group: devices and their consumption, $merged into CONTRIB_COLLECTION."""
+    return [
+        {"$match": {"_id": {"$in": user_ids}}},
+        {"$unwind": "$devices"},
+        {"$group": {
+            "_id": {
+                "user": "$_id",
+                "region": "$location.region",
+                "city": "$location.city",
+                "deviceType": "$devices.deviceType",
+                "brand": "$devices.brand"
+            },
+            "devices": {"$sum": 1},
+            "consumption": {"$sum": "$devices.energyConsumption"}
+        }},
+        {"$set": {
+            "key": {field: f"$_id.{field}" for field in GROUP_FIELDS},
+            "run": {"$literal": run_id}
+        }},
+        {"$merge": {"into": CONTRIB_COLLECTION, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ]
+
+
+def stats_pipeline(keys):
+    """Regroup the contributions of the given group keys and $merge them into STATS_COLLECTION."""
+    return [
+        {"$match": {"key": {"$in": keys}}},
+        {"$group": {
+            "_id": "$key",
+            "users": {"$sum": 1},
+            "devices": {"$sum": "$devices"},
+            "totalConsumption": {"$sum": "$consumption"}
+        }},
+        {"$set": {
+            "avgConsumptionPerUser": {"$divide": ["$totalConsumption", "$users"]},
+            "avgConsumptionPerDevice": {"$divide": ["$totalConsumption", "$devices"]},
+            "refreshedAt": "$$NOW"
+        }},
+        {"$merge": {"into": STATS_COLLECTION, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ]
+
+
+def _keys(cursor):
+    # Group keys as tuples; regroup() turns them back into documents with the
+    # fields in GROUP_FIELDS order, which is how contribution_pipeline()
+    # stores them, so $in matches them exactly
+    return {tuple(doc["key"][field] for field in GROUP_FIELDS) for doc in cursor}
+
+
+def regroup(database, keys):
+    """Recompute the stats of `keys` (tuples in GROUP_FIELDS order) and drop groups left empty."""
+    if not keys:
+        return
+    key_docs = [dict(zip(GROUP_FIELDS, key)) for key in keys]
+    contrib = database[CONTRIB_COLLECTION]
+    contrib.aggregate(stats_pipeline(key_docs))
+    remaining = _keys(contrib.find({"key": {"$in": key_docs}}, {"key": 1}))
+    emptied = [dict(zip(GROUP_FIELDS, key)) for key in keys - remaining]
+    if emptied:
+        database[STATS_COLLECTION].delete_many({"_id": {"$in": emptied}})
+
+
+def refresh_users(database, user_ids, run_id):
+    """Replace the contributions of `user_ids` and regroup every group they touch."""
+    contrib = database[CONTRIB_COLLECTION]
+    selector = {"_id.user": {"$in": user_ids}}
+    before = _keys(contrib.find(selector, {"key": 1}))
+    contrib.delete_many(selector)
+    database[USERS_COLLECTION].aggregate(contribution_pipeline(user_ids, run_id))
+    after = _keys(contrib.find(selector, {"key": 1}))
+    regroup(database, before | after)
+
+
+def _batches(cursor, size=BATCH_SIZE):
+    batch = []
+    for doc in cursor:
+        batch.append(doc["_id"])
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def refresh(database, full=False, now=None):
+    """
+    Bring STATS_COLLECTION up to date with the users changed since the
+    watermark (or with all users when `full`, or on the first run).
+    Returns the number of users processed, or None if another process
+    holds the range.
+
+    As in anomalies.refresh_baseline(), the watermark is advanced first with
+    a conditional update so concurrent refreshes do not overlap, and put
+    back if the refresh fails.
+    """
+    now = now or datetime.utcnow()
+    state = database[STATE_COLLECTION]
+    current = state.find_one({"_id": "watermark"})
+    since = None if full or current is None else current["until"]
+
+    try:
+        if current is None:
+            state.insert_one({"_id": "watermark", "until": now})
+        elif not state.update_one({"_id": "watermark", "until": current["until"]},
+                                   {"$set": {"until": now}}).matched_count:
+            return None
+    except DuplicateKeyError:
+        return None
+
+    run_id = uuid.uuid4().hex
+    query = {} if since is None else {"updated_at": {"$gte": since - timedelta(seconds=SETTLE_SECONDS)}}
+    processed = 0
+    try:
+        cursor = database[USERS_COLLECTION].find(query, {"_id": 1}).sort("_id", 1)
+        for user_ids in _batches(cursor):
+            refresh_users(database, user_ids, run_id)
+            processed += len(user_ids)
+        if since is None:
+            # Contributions not rewritten by this run belong to deleted users
+            contrib = database[CONTRIB_COLLECTION]
+            stale = {"run": {"$ne": run_id}}
+            keys = _keys(contrib.find(stale, {"key": 1}))
+            contrib.delete_many(stale)
+            regroup(database, keys)
+    except Exception:
+        if current is not None:
+            state.update_one({"_id": "watermark", "until": now}, {"$set": {"until": current["until"]}})
+        else:
+            state.delete_one({"_id": "watermark", "until": now})
+        raise
+    return processed
+
+
+def refreshed_at(database):
+    """The watermark of the last refresh, or None before the first one."""
+    current = database[STATE_COLLECTION].find_one({"_id": "watermark"})
+    return current["until"] if current else None
+
+
+def query_stats(database, filters=None, min_users=0, sort="users", limit=100):
+    """
+    Stats documents matching the exact-match `filters` (GROUP_FIELDS names),
+    flattened, sorted by `sort` descending.
+    """
+    if sort not in SORT_FIELDS:
+        raise ValueError(f"sort must be one of {', '.join(SORT_FIELDS)}")
+    query = {f"_id.{field}": value for field, value in (filters or {}).items() if field in GROUP_FIELDS}
+    if min_users:
+        query["users"] = {"$gte": min_users}
+    cursor = database[STATS_COLLECTION].find(query, {"refreshedAt": 0}).sort([(sort, -1), ("_id", 1)]).limit(limit)
+    return [{**doc.pop("_id"), **doc} for doc in cursor]
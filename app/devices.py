@@ -0,0 +1,104 @@
+"""
+Static device attributes, stored once per deviceId in the `devices`
+collection instead of on every reading.
+
+DeviceCache is a read-through, in-process cache in front of that collection.
+Entries expire after DEVICE_CACHE_TTL seconds so edits made by other
+processes show up eventually; writes through this process invalidate the
+entry immediately.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timezone
+import db
+import metrics
+
+DEVICES_COLLECTION = "devices"
+# Attributes that are fixed per deviceId
+STATIC_FIELDS = ("brand", "model", "device_name", "category")
+
+CACHE_TTL = float(os.environ.get("DEVICE_CACHE_TTL", 300))
+CACHE_MAX = int(os.environ.get("DEVICE_CACHE_MAX", 10000))
+
+CACHE_LOOKUPS = metrics.REGISTRY.register(metrics.Counter(
+    "device_cache_lookups_total", "Device attribute lookups by result.", ("result",)))
+
+
+def split_attributes(reading):
+    """Remove the static attributes from a reading and return them."""
+    return {field: reading.pop(field) for field in STATIC_FIELDS if field in reading}
+
+
+class DeviceCache:
+    def __init__(self, ttl=CACHE_TTL, max_size=CACHE_MAX):
+        self.ttl = ttl
+        self.max_size = max_size
+        # deviceId -> (expires_at, attributes or None when the device is unknown)
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _collection(self):
+        return db.get_collection(DEVICES_COLLECTION)
+
+    def _fresh(self, device_id, now):
+        entry = self._entries.get(device_id)
+        if entry is not None and entry[0] > now:
+            return entry
+        return None
+
+    def get_many(self, device_ids):
+        """Attributes for each id (None for unknown devices), loading misses in one query."""
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            for device_id in set(device_ids):
+                entry = self._fresh(device_id, now)
+                if entry is None:
+                    missing.append(device_id)
+                else:
+                    found[device_id] = entry[1]
+        CACHE_LOOKUPS.inc(len(found), result="hit")
+
+        if missing:
+            CACHE_LOOKUPS.inc(len(missing), result="miss")
+            loaded = {
+                doc.pop("_id"): doc
+                for doc in self._collection().find({"_id": {"$in": missing}}, {"updated_at": 0})
+            }
+            with self._lock:
+                if len(self._entries) + len(missing) > self.max_size:
+                    # Cheap bound: start over rather than tracking recency
+                    self._entries.clear()
+                for device_id in missing:
+                    attributes = loaded.get(device_id)
+                    self._entries[device_id] = (now + self.ttl, attributes)
+                    found[device_id] = attributes
+        return found
+
+    def get(self, device_id):
+        return self.get_many([device_id])[device_id]
+
+    def invalidate(self, device_id=None):
+        """Forget one device, or every device when device_id is None."""
+        with self._lock:
+            if device_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(device_id, None)
+
+    def ensure(self, device_id, attributes):
+        """Store attributes reported with a reading if they differ from what is known."""
+        known = self.get(device_id) or {}
+        if all(known.get(field) == value for field, value in attributes.items()):
+            return False
+        self._collection().update_one(
+            {"_id": device_id},
+            {"$set": {**attributes, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        self.invalidate(device_id)
+        return True
+
+
+cache = DeviceCache()
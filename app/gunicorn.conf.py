@@ -0,0 +1,70 @@
+"""
+Gunicorn configuration for the production serving profile.
+
+Sizing
+------
+The API spends most of each request waiting on MongoDB, so concurrency comes
+from threads rather than processes:
+
+    workers = 2 * CPU cores + 1          (WEB_CONCURRENCY)
+    threads = target in-flight requests / workers, usually 4-8 (WEB_THREADS)
+
+An open /api/usage/stream holds a thread until the browser disconnects; each
+worker serves at most USAGE_STREAM_MAX_CLIENTS of them (default threads // 2)
+and refuses the rest with 503, so live dashboards cannot take every thread.
+
+Every worker owns one MongoClient whose pool should hold one connection per
+thread (MONGODB_MAX_POOL_SIZE, default 100, is plenty; set
+MONGODB_MIN_POOL_SIZE to WEB_THREADS to keep them open), so the cluster sees
+at most
+
+    instances * workers * threads
+
+busy connections. Keep that under the Atlas tier's connection limit.
+
+Preload
+-------
+WEB_PRELOAD=1 imports the app once in the master so workers fork with the code
+already loaded (faster boot, shared memory pages). No MongoClient is created in
+the master either way: db.get_client() creates one in each worker, post_worker_init
+pre-warms its pool (MONGODB_PREWARM=0 to skip) and worker_exit closes it.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("WEB_THREADS", 4))
+worker_class = "gthread" if threads > 1 else "sync"
+preload_app = os.environ.get("WEB_PRELOAD", "1") == "1"
+
+# Requests that hold a worker longer than this are killed and the worker restarted
+timeout = int(os.environ.get("WEB_TIMEOUT", 30))
+# Time given to in-flight requests on SIGTERM before workers are killed
+graceful_timeout = int(os.environ.get("WEB_GRACEFUL_TIMEOUT", 20))
+keepalive = 5
+
+# Recycle workers periodically to bound memory growth
+max_requests = int(os.environ.get("WEB_MAX_REQUESTS", 5000))
+max_requests_jitter = max_requests // 10
+
+accesslog = "-"
+
+
+def post_worker_init(worker):
+    """Open the worker's connection pool before it accepts requests."""
+    import db
+    if db.PREWARM:
+        db.prewarm()
+
+
+def worker_exit(server, worker):
+    """Drain the ingest buffer, then close the worker's client so its pooled connections are released cleanly."""
+    import sys
+    import db
+    import ingest
+    ingest.buffer.close()
+    db.close_client()
+    # Only loaded once /api/qe_demo has been served
+    if "qe_utils" in sys.modules:
+        sys.modules["qe_utils"].prepared.close()
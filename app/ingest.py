@@ -0,0 +1,232 @@
+"""
+Buffered ingest for POST /api/readings.
+
+Readings are validated cheaply, appended to an in-process WriteBuffer and
+acknowledged with 202. A background thread flushes the buffer with
+insert_many(ordered=False) whenever INGEST_FLUSH_SIZE readings are waiting or
+INGEST_FLUSH_INTERVAL seconds have passed. When INGEST_BUFFER_MAX readings are
+already buffered new requests are refused (429) so a slow database turns
+into backpressure on the devices instead of unbounded memory growth. The
+buffer is drained on shutdown (atexit, and gunicorn's worker_exit hook).
+
+Readings use the sample_docs.json shape; the body is either one JSON object,
+a JSON array, or NDJSON (one object per line).
+"""
+import os
+import json
+import math
+import atexit
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from pymongo.errors import BulkWriteError, PyMongoError
+import db
+import metrics
+import usage
+
+BUFFER_MAX = int(os.environ.get("INGEST_BUFFER_MAX", 50000))
+FLUSH_SIZE = int(os.environ.get("INGEST_FLUSH_SIZE", 1000))
+FLUSH_INTERVAL = float(os.environ.get("INGEST_FLUSH_INTERVAL", 1.0))
+# Largest request body accepted, in readings
+MAX_BATCH = int(os.environ.get("INGEST_MAX_BATCH", 5000))
+# Seconds a client is told to wait when the buffer is full
+RETRY_AFTER = 2
+
+DEVICE_STATES = {"active", "idle", "standby"}
+NUMERIC_FIELDS = ("current_usage", "temperature", "pressure", "battery_level")
+STRING_FIELDS = ("brand", "model", "device_name", "category", "device_state")
+ALLOWED_FIELDS = {"Timestamp", "metadata", "_id"} | set(NUMERIC_FIELDS) | set(STRING_FIELDS)
+
+READINGS_INGESTED = metrics.REGISTRY.register(metrics.Counter(
+    "ingest_readings_total", "Readings handled by the write buffer by outcome.", ("outcome",)))
+BUFFERED = metrics.REGISTRY.register(metrics.Gauge(
+    "ingest_buffer_readings", "Readings waiting in the write buffer."))
+FLUSH_DURATION = metrics.REGISTRY.register(metrics.Histogram(
+    "ingest_flush_duration_seconds", "insert_many latency per buffer flush."))
+
+
+class ValidationError(ValueError):
+    """A reading that cannot be accepted; the message is returned to the client."""
+
+
+def _parse_timestamp(value):
+    # Extended JSON as exported in sample_docs.json: {"$date": "..."}
+    if isinstance(value, dict) and "$date" in value:
+        value = value["$date"]
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        # Epoch milliseconds; NaN, infinities and values past year 9999 fail here
+        try:
+            return datetime.fromtimestamp(value / 1000.0, tz=timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            raise ValidationError(f"Timestamp {value} is out of range")
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            raise ValidationError(f"Timestamp '{value}' is not ISO 8601")
+        if not parsed.tzinfo:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        # Normalized to UTC here, so a local time that is outside years
+        # 1-9999 in UTC is refused instead of failing BSON encoding later
+        try:
+            return parsed.astimezone(timezone.utc)
+        except OverflowError:
+            raise ValidationError(f"Timestamp '{value}' is out of range")
+    raise ValidationError("Timestamp must be an ISO 8601 string, epoch milliseconds or {\"$date\": ...}")
+
+
+def validate_reading(raw):
+    """Check one reading and return the document to insert."""
+    if not isinstance(raw, dict):
+        raise ValidationError("reading must be a JSON object")
+    unknown = set(raw) - ALLOWED_FIELDS
+    if unknown:
+        raise ValidationError(f"unknown fields: {', '.join(sorted(unknown))}")
+
+    metadata = raw.get("metadata")
+    if not isinstance(metadata, dict) or not isinstance(metadata.get("UserId"), str) \
+            or not isinstance(metadata.get("deviceId"), str):
+        raise ValidationError("metadata.UserId and metadata.deviceId are required strings")
+    if "Timestamp" not in raw:
+        raise ValidationError("Timestamp is required")
+    if "current_usage" not in raw:
+        raise ValidationError("current_usage is required")
+
+    doc = {
+        "Timestamp": _parse_timestamp(raw["Timestamp"]),
+        "metadata": {"UserId": metadata["UserId"], "deviceId": metadata["deviceId"]}
+    }
+    for field in NUMERIC_FIELDS:
+        if field in raw:
+            value = raw[field]
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                raise ValidationError(f"{field} must be a number")
+            try:
+                value = float(value)
+            except OverflowError:
+                value = math.inf
+            # json.loads accepts NaN and Infinity, which would poison every $sum/$avg
+            if not math.isfinite(value):
+                raise ValidationError(f"{field} must be a finite number")
+            doc[field] = value
+    for field in STRING_FIELDS:
+        if field in raw:
+            if not isinstance(raw[field], str):
+                raise ValidationError(f"{field} must be a string")
+            doc[field] = raw[field]
+    if "device_state" in doc and doc["device_state"] not in DEVICE_STATES:
+        raise ValidationError(f"device_state must be one of {', '.join(sorted(DEVICE_STATES))}")
+    return doc
+
+
+def parse_body(body, content_type):
+    """Split a request body into raw readings (JSON object, JSON array or NDJSON)."""
+    text = body.decode("utf-8")
+    if "ndjson" in (content_type or "") or "jsonl" in (content_type or ""):
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    parsed = json.loads(text)
+    return parsed if isinstance(parsed, list) else [parsed]
+
+
+class WriteBuffer:
+    def __init__(self, max_size=BUFFER_MAX, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.max_size = max_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._thread_pid = None
+        self._closing = False
+
+    def __len__(self):
+        with self._cond:
+            return len(self._pending)
+
+    def _ensure_flusher(self):
+        # Threads do not survive fork, so a forked worker starts its own; a
+        # flusher that died for any other reason is replaced as well
+        if self._thread is None or self._thread_pid != os.getpid() or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="ingest-flusher", daemon=True)
+            self._thread_pid = os.getpid()
+            self._thread.start()
+
+    def offer(self, docs):
+        """Buffer all of `docs`, or none of them if that would exceed max_size."""
+        with self._cond:
+            if self._closing or len(self._pending) + len(docs) > self.max_size:
+                READINGS_INGESTED.inc(len(docs), outcome="rejected")
+                return False
+            self._ensure_flusher()
+            self._pending.extend(docs)
+            BUFFERED.set(len(self._pending))
+            if len(self._pending) >= self.flush_size:
+                self._cond.notify()
+            return True
+
+    def _take_batch(self):
+        batch = []
+        while self._pending and len(batch) < self.flush_size:
+            batch.append(self._pending.popleft())
+        BUFFERED.set(len(self._pending))
+        return batch
+
+    def _insert(self, batch):
+        began = time.perf_counter()
+        try:
+            db.get_collection(usage.READINGS_COLLECTION).insert_many(batch, ordered=False)
+            READINGS_INGESTED.inc(len(batch), outcome="inserted")
+            return True
+        except BulkWriteError as e:
+            # ordered=False: everything except the reported documents was written
+            failed = len(e.details.get("writeErrors", []))
+            READINGS_INGESTED.inc(len(batch) - failed, outcome="inserted")
+            READINGS_INGESTED.inc(failed, outcome="failed")
+            print(f"Ingest flush: {failed} of {len(batch)} readings failed: {e.details.get('writeErrors', [])[:1]}")
+            return True
+        except PyMongoError as e:
+            print(f"Ingest flush failed ({e}); will retry {len(batch)} readings")
+            return False
+        except Exception as e:
+            # Not a database error, so retrying would fail the same way (e.g.
+            # a document BSON cannot encode); drop the batch and keep flushing
+            READINGS_INGESTED.inc(len(batch), outcome="failed")
+            print(f"Ingest flush: dropped {len(batch)} readings that could not be written: {e!r}")
+            return True
+        finally:
+            FLUSH_DURATION.observe(time.perf_counter() - began)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closing and len(self._pending) < self.flush_size:
+                    self._cond.wait(self.flush_interval)
+                batch = self._take_batch()
+                if not batch and self._closing:
+                    return
+            if batch and not self._insert(batch):
+                # Put the batch back at the front and back off; it came out of
+                # the buffer so it still fits
+                with self._cond:
+                    self._pending.extendleft(reversed(batch))
+                    BUFFERED.set(len(self._pending))
+                    if self._closing:
+                        return
+                time.sleep(self.flush_interval)
+
+    def close(self, timeout=10):
+        """Stop accepting readings and flush what is buffered."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+            thread = self._thread if self._thread_pid == os.getpid() else None
+        if thread is not None:
+            thread.join(timeout)
+        remaining = len(self)
+        if remaining:
+            print(f"Ingest buffer closed with {remaining} readings not written")
+
+
+buffer = WriteBuffer()
+atexit.register(buffer.close)
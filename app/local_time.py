@@ -0,0 +1,120 @@
+"""
+Local-time labels for UTC bucket series.
+
+pymongo returns naive datetimes that are UTC. Calling astimezone() on them
+treats them as the server's local time, so labels shifted with the host's TZ,
+and formatting every point with two strftime() calls was most of the cost of
+a long series.
+
+labels() instead turns the buckets into an int64 array of epoch seconds,
+finds the zone's UTC offset transitions inside the window once, and maps
+every bucket to local time with one searchsorted() over those transitions.
+Local days are formatted once each and times of day come from a table, so
+a series crossing a DST change gets the offset in force at each bucket: on
+the fall-back day the hour after the change repeats its labels, on the
+spring-forward day the skipped hour never appears.
+
+Zones are IANA names (pytz); DEFAULT_ZONE (USAGE_TIMEZONE, default
+US/Eastern) is the one the dashboard has always used. numpy is imported on
+first use so that it stays off the worker boot path.
+"""
+import os
+import calendar
+import functools
+from datetime import datetime, timedelta, timezone
+import pytz
+
+DEFAULT_ZONE = os.environ.get("USAGE_TIMEZONE", "US/Eastern")
+
+DAY = 86400
+# Transitions are searched for at this step; no zone changes offset twice
+# within one, so each change lies in a step whose ends disagree
+SCAN_STEP = 6 * 3600
+
+# "hh:mm AM/PM" for every minute of the day
+TIMES_OF_DAY = [datetime(2000, 1, 1, minute // 60, minute % 60).strftime("%I:%M %p") for minute in range(1440)]
+
+
+@functools.lru_cache(maxsize=64)
+def get_zone(name=None):
+    """The tzinfo for an IANA zone name; ValueError for unknown ones."""
+    try:
+        return pytz.timezone(name or DEFAULT_ZONE)
+    except pytz.UnknownTimeZoneError:
+        raise ValueError(f"Unknown timezone '{name}'")
+
+
+def to_epoch(ts):
+    """Epoch seconds of a datetime; naive ones are UTC, as pymongo returns them."""
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return calendar.timegm(ts.utctimetuple())
+
+
+def epochs(buckets):
+    """int64 epoch seconds of a sequence of datetimes."""
+    import numpy as np
+
+    return np.fromiter((to_epoch(ts) for ts in buckets), dtype=np.int64, count=len(buckets))
+
+
+def _offset(zone, epoch):
+    return int(datetime.fromtimestamp(epoch, zone).utcoffset().total_seconds())
+
+
+def transitions(zone, start, end):
+    """
+    (epoch seconds, UTC offset seconds) arrays for [start, end] epoch seconds:
+    the first entry is the offset in force at `start`, each later one a
+    change of offset and the instant it takes effect.
+    """
+    import numpy as np
+
+    at = [start]
+    offsets = [_offset(zone, start)]
+    low = start
+    while low < end:
+        high = min(low + SCAN_STEP, end)
+        if _offset(zone, high) != offsets[-1]:
+            # Bisect to the first second with the new offset
+            before, after = low, high
+            while after - before > 1:
+                middle = (before + after) // 2
+                if _offset(zone, middle) == offsets[-1]:
+                    before = middle
+                else:
+                    after = middle
+            at.append(after)
+            offsets.append(_offset(zone, after))
+        low = high
+    return np.array(at, dtype=np.int64), np.array(offsets, dtype=np.int64)
+
+
+def local_seconds(epoch_array, zone):
+    """Local wall-clock time of each epoch, as seconds since the epoch."""
+    import numpy as np
+
+    if not len(epoch_array):
+        return epoch_array
+    at, offsets = transitions(zone, int(epoch_array.min()), int(epoch_array.max()))
+    return epoch_array + offsets[np.searchsorted(at, epoch_array, side="right") - 1]
+
+
+def labels(buckets, zone=None):
+    """
+    ("MM/DD hh:mm AM/PM" labels, "YYYY-MM-DD" dates) in `zone` for UTC
+    bucket datetimes, the fields format_point() has always produced.
+    """
+    import numpy as np
+
+    if zone is None or isinstance(zone, str):
+        zone = get_zone(zone)
+    local = local_seconds(epochs(buckets), zone)
+    days, day_index = np.unique(local // DAY, return_inverse=True)
+    minutes = (local % DAY) // 60
+    dates = [datetime(1970, 1, 1) + timedelta(days=int(day)) for day in days]
+    prefixes = [date.strftime("%m/%d ") for date in dates]
+    full_dates = [date.strftime("%Y-%m-%d") for date in dates]
+    day_index = day_index.tolist()
+    return ([prefixes[day] + TIMES_OF_DAY[minute] for day, minute in zip(day_index, minutes.tolist())],
+            [full_dates[day] for day in day_index])
@@ -0,0 +1,255 @@
+"""
+Request and MongoDB instrumentation, exported at /metrics in the Prometheus
+text format.
+
+Metrics live in process memory, so under gunicorn every worker reports its
+own series; add the worker pid as a scrape label or aggregate at query time.
+
+MongoDB time is measured by a pymongo CommandListener. Commands run on the
+thread that issued them, so the listener adds each command's duration to a
+thread-local total that the request hooks read to split a request's wall time
+into MongoDB time and Python time (iteration, bucketing, serialization).
+"""
+import bisect
+import threading
+import time
+from flask import g, has_request_context, request
+from pymongo import monitoring
+
+# Default latency buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Response size buckets in bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    """Base class: a named family of series keyed by label values."""
+    type_name = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            series = list(self._series.items())
+        for key, value in sorted(series):
+            lines.extend(self._render_series(key, value))
+        return lines
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _render_series(self, key, value):
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', le))} {cumulative}")
+        labels = _format_labels(self.label_names, key)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "Request latency by route.", ("route", "method", "status")))
+REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "http_requests_in_flight", "Requests currently being served.", ("route",)))
+RESPONSE_SIZE = REGISTRY.register(Histogram(
+    "http_response_size_bytes", "Response body size by route.", ("route",), buckets=SIZE_BUCKETS))
+REQUEST_MONGO_TIME = REGISTRY.register(Histogram(
+    "http_request_mongodb_seconds", "Time spent waiting on MongoDB commands per request.", ("route",)))
+REQUEST_PYTHON_TIME = REGISTRY.register(Histogram(
+    "http_request_python_seconds", "Request time not spent in MongoDB commands.", ("route",)))
+REQUEST_PHASE = REGISTRY.register(Histogram(
+    "http_request_phase_seconds", "Wall time of named phases inside a handler (includes any MongoDB time).",
+    ("route", "phase")))
+MONGO_COMMAND_DURATION = REGISTRY.register(Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command round-trip time.", ("command", "collection")))
+MONGO_COMMANDS = REGISTRY.register(Counter(
+    "mongodb_commands_total", "MongoDB commands by collection and outcome.", ("command", "collection", "outcome")))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class CommandTimer(monitoring.CommandListener):
+    """Records per-command durations and per-collection counts."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _pending(self):
+        pending = getattr(self._local, "pending", None)
+        if pending is None:
+            pending = self._local.pending = {}
+        return pending
+
+    def reset(self):
+        """Start a new per-thread MongoDB time total (called at request start)."""
+        self._local.total = 0.0
+
+    def total(self):
+        return getattr(self._local, "total", 0.0)
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        if not isinstance(target, str):
+            # getMore carries the cursor id; the collection is a separate field
+            target = event.command.get("collection", "")
+        self._pending()[event.request_id] = target
+
+    def _finish(self, event, outcome):
+        collection = self._pending().pop(event.request_id, "")
+        seconds = event.duration_micros / 1e6
+        MONGO_COMMAND_DURATION.observe(seconds, command=event.command_name, collection=collection)
+        MONGO_COMMANDS.inc(command=event.command_name, collection=collection, outcome=outcome)
+        self._local.total = self.total() + seconds
+
+    def succeeded(self, event):
+        self._finish(event, "success")
+
+    def failed(self, event):
+        self._finish(event, "failure")
+
+
+command_timer = CommandTimer()
+
+
+class timed_phase:
+    """Context manager recording a named phase of the current request."""
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        route = g.get("metrics_route", "unmatched") if has_request_context() else "none"
+        REQUEST_PHASE.observe(time.perf_counter() - self.start, route=route, phase=self.phase)
+        return False
+
+
+def _route():
+    rule = request.url_rule
+    return rule.rule if rule is not None else "unmatched"
+
+
+def init_app(app):
+    """Register the request timing hooks on a Flask app."""
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+        g.metrics_route = _route()
+        command_timer.reset()
+        REQUESTS_IN_FLIGHT.inc(route=g.metrics_route)
+
+    @app.after_request
+    def _record(response):
+        start = g.get("metrics_start")
+        if start is None:
+            return response
+        route = g.metrics_route
+        elapsed = time.perf_counter() - start
+        mongo = command_timer.total()
+        REQUEST_DURATION.observe(elapsed, route=route, method=request.method, status=response.status_code)
+        REQUEST_MONGO_TIME.observe(mongo, route=route)
+        REQUEST_PYTHON_TIME.observe(max(elapsed - mongo, 0.0), route=route)
+        # Streamed responses have no length up front
+        if response.content_length is not None:
+            RESPONSE_SIZE.observe(response.content_length, route=route)
+        return response
+
+    @app.teardown_request
+    def _finish(exc):
+        route = g.pop("metrics_route", None)
+        if route is not None:
+            REQUESTS_IN_FLIGHT.dec(route=route)
@@ -0,0 +1,181 @@
+"""
+On-demand request profiling for hot endpoints.
+
+A profiled request is sampled by a background thread that reads the request
+thread's stack every PROFILE_INTERVAL_MS and counts identical stacks. The
+result is stored as collapsed stacks ("root;child;leaf count" per line), which
+flamegraph.pl, speedscope and inferno read directly.
+
+A request is profiled when either
+  - it carries X-Profile-Token: <PROFILE_TOKEN> plus an "X-Profile: 1" header
+    or a "?profile=1" query flag, or
+  - it is picked by random sampling (PROFILE_SAMPLE_RATE, 0 disables).
+
+With "X-Profile: return" (or "?profile=return") the collapsed stacks replace
+the response body; otherwise the profile is stored and its id is returned in
+the X-Profile-Id header. Stored profiles are kept per route (the newest
+PROFILE_KEEP of each) and served from /debug/profiles, which also requires
+the token. When profiling is not triggered the cost per request is one route
+lookup and one random() call.
+"""
+import os
+import sys
+import hmac
+import time
+import random
+import itertools
+import threading
+from collections import Counter, deque
+from flask import Blueprint, Response, abort, g, jsonify, request
+
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN")
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", 2))
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 20))
+PROFILE_ROUTES = set(os.environ.get("PROFILE_ROUTES", "/api/usage,/api/qe_demo").split(","))
+
+bp = Blueprint("profiling", __name__, url_prefix="/debug/profiles")
+
+# route -> deque of profile metadata (oldest first); profile_id -> collapsed stacks
+_index = {}
+_profiles = {}
+_store_lock = threading.Lock()
+_ids = itertools.count(1)
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    # Function-level granularity so samples from different lines merge
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+class StackSampler:
+    """Samples one thread's Python stack on a timer until stopped."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started_at
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(labels))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _authorized():
+    supplied = request.headers.get("X-Profile-Token", "")
+    return bool(PROFILE_TOKEN) and hmac.compare_digest(supplied, PROFILE_TOKEN)
+
+
+def _requested_mode():
+    """'store', 'return' or None for this request."""
+    flag = request.headers.get("X-Profile") or request.args.get("profile")
+    if flag and _authorized():
+        return "return" if flag == "return" else "store"
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return "store"
+    return None
+
+
+def _store(route, sampler):
+    profile_id = f"{int(time.time())}-{next(_ids)}"
+    meta = {
+        "id": profile_id,
+        "route": route,
+        "samples": sampler.samples,
+        "duration_ms": round(sampler.duration * 1000, 1),
+        "created": time.time()
+    }
+    with _store_lock:
+        entries = _index.setdefault(route, deque())
+        entries.append(meta)
+        _profiles[profile_id] = sampler.collapsed()
+        while len(entries) > PROFILE_KEEP:
+            _profiles.pop(entries.popleft()["id"], None)
+    return profile_id
+
+
+def init_app(app):
+    """Register the profiling hooks and the /debug/profiles endpoints."""
+    app.register_blueprint(bp)
+
+    @app.before_request
+    def _maybe_start_profile():
+        rule = request.url_rule
+        if rule is None or rule.rule not in PROFILE_ROUTES:
+            return
+        mode = _requested_mode()
+        if mode is None:
+            return
+        sampler = StackSampler(threading.get_ident(), PROFILE_INTERVAL_MS / 1000.0)
+        g.profile = (mode, rule.rule, sampler)
+        sampler.start()
+
+    @app.after_request
+    def _finish_profile(response):
+        profile = g.pop("profile", None)
+        if profile is None:
+            return response
+        mode, route, sampler = profile
+        sampler.stop()
+        if mode == "return":
+            return Response(sampler.collapsed(), content_type="text/plain; charset=utf-8")
+        response.headers["X-Profile-Id"] = _store(route, sampler)
+        return response
+
+    @app.teardown_request
+    def _stop_profile(exc):
+        # after_request is skipped when the view's exception propagates, but
+        # teardown always runs: stop the sampler and keep what it collected
+        profile = g.pop("profile", None)
+        if profile is None:
+            return
+        mode, route, sampler = profile
+        sampler.stop()
+        _store(route, sampler)
+
+
+@bp.before_request
+def _require_token():
+    if not _authorized():
+        abort(403)
+
+
+@bp.route("")
+def list_profiles():
+    """Stored profiles grouped by route, newest last."""
+    with _store_lock:
+        return jsonify({route: list(entries) for route, entries in _index.items()})
+
+
+@bp.route("/<profile_id>")
+def get_profile(profile_id):
+    """A stored profile as collapsed stacks."""
+    with _store_lock:
+        collapsed = _profiles.get(profile_id)
+    if collapsed is None:
+        abort(404)
+    return Response(collapsed, content_type="text/plain; charset=utf-8")
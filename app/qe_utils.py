@@ -1,88 +1,121 @@
 import os
-import boto3
-from pymongo import MongoClient
-from pymongo.encryption import ClientEncryption
-from pymongo.encryption_options import AutoEncryptionOpts
-from bson.binary import STANDARD, Binary, UUID_SUBTYPE
-from bson.codec_options import CodecOptions
+import threading
+from collections import OrderedDict
+import connection
+import metrics
 
 # Configuration from environment variables
 AWS_ACCESS_KEY = os.environ.get("AWS_ACCESS_KEY")
 AWS_SECRET_KEY = os.environ.get("AWS_SECRET_KEY")
 AWS_KMS_KEY_ID = os.environ.get("AWS_KMS_KEY_ID")
-MONGODB_URI = os.environ.get("MONGODB_URI")
-MONGODB_USERNAME = os.environ.get("MONGODB_USERNAME")
-MONGODB_PASSWORD = os.environ.get("MONGODB_PASSWORD")
+
+# Encrypted filters kept by the prepared-query cache (0 disables caching)
+PREPARED_CACHE_MAX = int(os.environ.get("QE_PREPARED_CACHE_MAX", 128))
 
 # Collection names
 KEY_VAULT_NAMESPACE = "encryption.__keyVault"
 QE_NAMESPACE = "smart_home.users_encrypted"
 
-def get_encryption_client():
-    """Get a MongoDB client configured for automatic encryption."""
-    # Connection string
-    connection_string = f"mongodb+srv://{MONGODB_USERNAME}:{MONGODB_PASSWORD}@{MONGODB_URI}/?retryWrites=true&w=majority"
-    client = MongoClient(connection_string)
-    
+# Data key alternate names for the encrypted fields
+AGE_KEY_NAME = "qe_demo_age_key"
+REGION_KEY_NAME = "qe_demo_region_key"
+
+# The schema leaves contention at the server default; explicitly encrypted
+# query payloads must use the same value
+CONTENTION = 8
+
+# The /api/qe_demo query; both fields are encrypted
+SENIOR_AGE = 65
+WEST_COAST = "West Coast"
+SENIOR_WEST_COAST_FILTER = {
+    "age": {"$gte": SENIOR_AGE},
+    "location.region": WEST_COAST
+}
+
+PREPARED_LOOKUPS = metrics.REGISTRY.register(metrics.Counter(
+    "qe_prepared_filter_lookups_total", "Prepared encrypted filter lookups.", ("result",)))
+
+def senior_west_coast_result(results):
+    """The /api/qe_demo response body."""
+    return {
+        "count": len(results),
+        "message": "Senior citizens (age ≥ 65) in the West Coast region",
+        "results": results
+    }
+
+def _kms_providers():
+    return {
+        "aws": {
+            "accessKeyId": AWS_ACCESS_KEY,
+            "secretAccessKey": AWS_SECRET_KEY
+        }
+    }
+
+def _data_key(client, client_encryption, alt_name):
+    """The id of the data key named `alt_name`, created if it does not exist yet."""
+    key_vault_db, key_vault_coll = KEY_VAULT_NAMESPACE.split(".")
+    key = client[key_vault_db][key_vault_coll].find_one({"keyAltNames": alt_name})
+    if key:
+        return key["_id"]
+    return client_encryption.create_data_key(
+        "aws",
+        master_key={
+            "region": "us-east-1",
+            "key": AWS_KMS_KEY_ID,
+            "endpoint": "kms.us-east-1.amazonaws.com"
+        },
+        key_alt_names=[alt_name]
+    )
+
+def setup_keys():
+    """
+    Set up the key vault and data keys. Returns (key vault client,
+    ClientEncryption, {"age": key id, "region": key id}).
+    """
+    # Imported here so that workers which never serve a QE request don't pay
+    # for the encryption machinery at boot
+    from pymongo.encryption import ClientEncryption
+    from bson.binary import STANDARD
+    from bson.codec_options import CodecOptions
+
+    # Key vault client
+    client = connection.create_client(appname="qe-keyvault")
+
     # Setup key vault collection with index
     key_vault_db, key_vault_coll = KEY_VAULT_NAMESPACE.split(".")
     if key_vault_coll not in client[key_vault_db].list_collection_names():
         client[key_vault_db].create_collection(key_vault_coll)
-    
+
     client[key_vault_db][key_vault_coll].create_index(
         [("keyAltNames", 1)],
         unique=True,
         partialFilterExpression={"keyAltNames": {"$exists": True}}
     )
-    
-    # KMS provider configuration
-    kms_providers = {
-        "aws": {
-            "accessKeyId": AWS_ACCESS_KEY,
-            "secretAccessKey": AWS_SECRET_KEY
-        }
-    }
-    
+
     # Create ClientEncryption for key management
     client_encryption = ClientEncryption(
-        kms_providers,
+        _kms_providers(),
         KEY_VAULT_NAMESPACE,
         client,
         CodecOptions(uuid_representation=STANDARD),
     )
-    
+
     # Get or create data keys for each field
-    age_key = client[key_vault_db][key_vault_coll].find_one({"keyAltNames": "qe_demo_age_key"})
-    region_key = client[key_vault_db][key_vault_coll].find_one({"keyAltNames": "qe_demo_region_key"})
-    
-    if not age_key:
-        # Create a new data key for age field
-        age_key_id = client_encryption.create_data_key(
-            "aws",
-            master_key={
-                "region": "us-east-1",
-                "key": AWS_KMS_KEY_ID,
-                "endpoint": "kms.us-east-1.amazonaws.com"
-            },
-            key_alt_names=["qe_demo_age_key"]
-        )
-    else:
-        age_key_id = age_key["_id"]
-
-    if not region_key:
-        # Create a new data key for region field
-        region_key_id = client_encryption.create_data_key(
-            "aws",
-            master_key={
-                "region": "us-east-1",
-                "key": AWS_KMS_KEY_ID,
-                "endpoint": "kms.us-east-1.amazonaws.com"
-            },
-            key_alt_names=["qe_demo_region_key"]
-        )
-    else:
-        region_key_id = region_key["_id"]
-    
+    keys = {
+        "age": _data_key(client, client_encryption, AGE_KEY_NAME),
+        "region": _data_key(client, client_encryption, REGION_KEY_NAME)
+    }
+    return client, client_encryption, keys
+
+def get_auto_encryption_opts():
+    """
+    Set up the key vault and data keys and return (AutoEncryptionOpts,
+    ClientEncryption) for a client that encrypts QE_NAMESPACE automatically.
+    """
+    from pymongo.encryption_options import AutoEncryptionOpts
+
+    _, client_encryption, keys = setup_keys()
+
     # Define encryption schema with separate keys
     encrypted_fields_map = {
         QE_NAMESPACE: {
@@ -90,35 +123,151 @@ def get_encryption_client():
                 {
                     "path": "age",
                     "bsonType": "int",
-                    "keyId": age_key_id,
+                    "keyId": keys["age"],
                     "queries": [{"queryType": "range"}]
                 },
                 {
                     "path": "location.region",
                     "bsonType": "string",
-                    "keyId": region_key_id,
+                    "keyId": keys["region"],
                     "queries": [{"queryType": "equality"}]
                 }
             ]
         }
     }
-    
-    # Create encrypted client
-    encrypted_client = MongoClient(
-        connection_string,
-        auto_encryption_opts=AutoEncryptionOpts(
-            kms_providers=kms_providers,
-            key_vault_namespace=KEY_VAULT_NAMESPACE,
-            encrypted_fields_map=encrypted_fields_map
-        )
+
+    auto_encryption_opts = AutoEncryptionOpts(
+        kms_providers=_kms_providers(),
+        key_vault_namespace=KEY_VAULT_NAMESPACE,
+        encrypted_fields_map=encrypted_fields_map
     )
-    
+    return auto_encryption_opts, client_encryption
+
+def get_encryption_client():
+    """Get a MongoDB client configured for automatic encryption."""
+    auto_encryption_opts, client_encryption = get_auto_encryption_opts()
+    encrypted_client = connection.create_client(appname="qe", auto_encryption_opts=auto_encryption_opts,
+                                              request_metrics=True)
     return encrypted_client, client_encryption
 
+def bypass_encryption_opts():
+    """
+    AutoEncryptionOpts for a client that only decrypts: query analysis is
+    bypassed, so filters must already hold encrypted payloads.
+    """
+    from pymongo.encryption_options import AutoEncryptionOpts
+
+    return AutoEncryptionOpts(
+        kms_providers=_kms_providers(),
+        key_vault_namespace=KEY_VAULT_NAMESPACE,
+        bypass_query_analysis=True,
+        mongocryptd_bypass_spawn=True
+    )
+
+class PreparedQueries:
+    """
+    The /api/qe_demo query with explicitly encrypted payloads.
+
+    Automatic encryption runs query analysis (mongocryptd or crypt_shared)
+    and encrypts the payloads on every find(). Here filter() encrypts the
+    region with ClientEncryption.encrypt() and the age bound with
+    encrypt_expression(), once per (min_age, region), and keeps the result
+    in an LRU of PREPARED_CACHE_MAX filters. find() runs it on a client with
+    bypass_query_analysis, which still decrypts the results.
+
+    Key setup and the clients are created on first use and kept for the life
+    of the process. The async app uses filter() with its own Motor client.
+    """
+
+    def __init__(self, max_size=PREPARED_CACHE_MAX):
+        self.max_size = max_size
+        self._filters = OrderedDict()
+        self._lock = threading.Lock()
+        self._setup_lock = threading.Lock()
+        self._key_vault_client = None
+        self._client_encryption = None
+        self._keys = None
+        self._client = None
+
+    def _setup(self):
+        with self._setup_lock:
+            if self._client_encryption is None:
+                self._key_vault_client, self._client_encryption, self._keys = setup_keys()
+
+    def encrypt_filter(self, min_age, region):
+        """Encrypt the filter for `age >= min_age` and `location.region == region`, uncached."""
+        from pymongo.encryption import Algorithm, QueryType
+        from pymongo.encryption_options import RangeOpts
+
+        self._setup()
+        # Range payloads come from a match expression; the schema gives the
+        # age field no range options, so RangeOpts() uses the same defaults
+        age = self._client_encryption.encrypt_expression(
+            {"$and": [{"age": {"$gte": min_age}}]},
+            Algorithm.RANGE,
+            key_id=self._keys["age"],
+            query_type=QueryType.RANGE,
+            contention_factor=CONTENTION,
+            range_opts=RangeOpts()
+        )
+        region = self._client_encryption.encrypt(
+            region,
+            Algorithm.INDEXED,
+            key_id=self._keys["region"],
+            query_type=QueryType.EQUALITY,
+            contention_factor=CONTENTION
+        )
+        return {"$and": [age, {"location.region": region}]}
+
+    def filter(self, min_age=SENIOR_AGE, region=WEST_COAST):
+        """The encrypted filter for these parameters, from the cache when possible."""
+        key = (min_age, region)
+        with self._lock:
+            if key in self._filters:
+                self._filters.move_to_end(key)
+                PREPARED_LOOKUPS.inc(result="hit")
+                return self._filters[key]
+        PREPARED_LOOKUPS.inc(result="miss")
+        # Encrypted outside the lock: two threads may both encrypt a new
+        # key, and either result is valid
+        encrypted = self.encrypt_filter(min_age, region)
+        if self.max_size:
+            with self._lock:
+                self._filters[key] = encrypted
+                self._filters.move_to_end(key)
+                while len(self._filters) > self.max_size:
+                    self._filters.popitem(last=False)
+        return encrypted
+
+    def collection(self):
+        """QE_NAMESPACE through the bypass client."""
+        with self._setup_lock:
+            if self._client is None:
+                self._client = connection.create_client(
+                    appname="qe-prepared", auto_encryption_opts=bypass_encryption_opts(), request_metrics=True)
+        db_name, coll_name = QE_NAMESPACE.split(".")
+        return self._client[db_name][coll_name]
+
+    def find(self, min_age=SENIOR_AGE, region=WEST_COAST):
+        """Decrypted documents matching the prepared filter."""
+        return list(self.collection().find(self.filter(min_age, region)))
+
+    def close(self):
+        with self._setup_lock, self._lock:
+            self._filters.clear()
+            if self._client is not None:
+                self._client.close()
+            if self._client_encryption is not None:
+                self._client_encryption.close()
+                self._key_vault_client.close()
+            self._client = self._client_encryption = self._key_vault_client = self._keys = None
+
+prepared = PreparedQueries()
+
 def close_encryption_resources(encrypted_client, client_encryption):
     """Close encryption resources to prevent memory leaks."""
     if client_encryption:
         client_encryption.close()
-    
+
     if encrypted_client:
-        encrypted_client.close() 
\ No newline at end of file
+        encrypted_client.close()
@@ -0,0 +1,134 @@
+"""
+Named read profiles: which replica-set members a workload reads from.
+
+    primary      the primary only (the driver default, and all writes)
+    interactive  primaryPreferred: dashboard requests read fresh data and
+                 fall back to a secondary only while there is no primary
+    analytics    secondary, preferring members tagged READ_ANALYTICS_TAGS
+                 (Atlas analytics nodes by default, then any secondary) and
+                 skipping members more than READ_ANALYTICS_MAX_STALENESS
+                 seconds behind the primary
+
+Each place that reads picks a profile under a workload name (select()), and
+READ_PROFILE_ROUTES overrides the defaults per workload, e.g.
+"users_usage=interactive,usage_tiered=primary". Scripts take --read-profile.
+
+Decisions are counted in mongo_read_profile_total{profile,workload}; the
+monitor attached to every client by connection.create_client() counts the
+reads each kind of member actually served in
+mongo_reads_by_server_total{mode,server_type}.
+"""
+import os
+import threading
+from pymongo import monitoring
+from pymongo.read_preferences import Primary, PrimaryPreferred, Secondary
+import metrics
+
+
+def _tag_sets(value):
+    """'nodeType:ANALYTICS;' -> [{'nodeType': 'ANALYTICS'}, {}] (an empty set matches any member)."""
+    tag_sets = []
+    for tag_set in value.split(";"):
+        pairs = (pair.split(":", 1) for pair in tag_set.split(",") if pair.strip())
+        tag_sets.append({key.strip(): tag.strip() for key, tag in pairs})
+    return tag_sets
+
+
+ANALYTICS_TAGS = _tag_sets(os.environ.get("READ_ANALYTICS_TAGS", "nodeType:ANALYTICS;"))
+# The server rejects anything below 90 seconds
+ANALYTICS_MAX_STALENESS = max(int(os.environ.get("READ_ANALYTICS_MAX_STALENESS", 120)), 90)
+
+PROFILES = {
+    "primary": Primary(),
+    "interactive": PrimaryPreferred(),
+    "analytics": Secondary(tag_sets=ANALYTICS_TAGS, max_staleness=ANALYTICS_MAX_STALENESS),
+}
+
+# Commands whose routing follows the read preference
+READ_COMMANDS = {"find", "aggregate", "count", "distinct", "getMore", "explain"}
+
+ROUTING = metrics.REGISTRY.register(metrics.Counter(
+    "mongo_read_profile_total", "Read profile chosen per workload.", ("profile", "workload")))
+SERVED_READS = metrics.REGISTRY.register(metrics.Counter(
+    "mongo_reads_by_server_total", "Read commands by requested mode and the kind of member that ran them.",
+    ("mode", "server_type")))
+
+
+def _overrides(value):
+    overrides = {}
+    for item in value.split(","):
+        if "=" in item:
+            workload, profile = (part.strip() for part in item.split("=", 1))
+            overrides[workload] = profile
+    return overrides
+
+
+OVERRIDES = _overrides(os.environ.get("READ_PROFILE_ROUTES", ""))
+
+
+def read_preference(profile):
+    try:
+        return PROFILES[profile]
+    except KeyError:
+        raise ValueError(f"Unknown read profile {profile!r}; expected one of {', '.join(PROFILES)}")
+
+
+def select(workload, default):
+    """The profile for `workload` (READ_PROFILE_ROUTES wins over `default`), counted in the metrics."""
+    profile = OVERRIDES.get(workload, default)
+    read_preference(profile)
+    ROUTING.inc(profile=profile, workload=workload)
+    return profile
+
+
+def with_profile(database, profile):
+    """`database` (a pymongo Database or Collection) reading with `profile`."""
+    return database.with_options(read_preference=read_preference(profile))
+
+
+def add_argument(parser, default="primary"):
+    """The --read-profile option shared by the scripts."""
+    parser.add_argument('--read-profile', choices=sorted(PROFILES), default=default,
+                        help=f'Replica-set members to read from (default: {default})')
+
+
+class RoutingMonitor(monitoring.TopologyListener, monitoring.CommandListener):
+    """
+    Counts read commands by the mode they asked for and the type of server
+    they were sent to. Server types come from topology events, so the
+    monitor is shared by every client in the process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._server_types = {}
+
+    def opened(self, event):
+        pass
+
+    def description_changed(self, event):
+        servers = event.new_description.server_descriptions()
+        with self._lock:
+            self._server_types.update(
+                (address, description.server_type_name) for address, description in servers.items())
+
+    def closed(self, event):
+        pass
+
+    def started(self, event):
+        if event.command_name not in READ_COMMANDS:
+            return
+        # The driver only sends $readPreference when it is not "primary"
+        mode = event.command.get("$readPreference", {}).get("mode", "primary")
+        with self._lock:
+            server_type = self._server_types.get(event.connection_id, "Unknown")
+        SERVED_READS.inc(mode=mode, server_type=server_type)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+monitor = RoutingMonitor()
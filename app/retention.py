@@ -0,0 +1,204 @@
+"""
+Tiered retention for sensor readings.
+
+Raw readings are kept for RETENTION_RAW_DAYS and then expired by the time
+series collection's own TTL. Before that, run_rollups() summarises them into
+two tiers:
+
+- usage_hourly: one document per hour, kept for RETENTION_HOURLY_DAYS
+  (TTL index on Timestamp)
+- usage_daily:  one document per UTC day, kept for RETENTION_DAILY_DAYS
+  (0 = forever)
+
+Each summary document holds total/count (so averages can be recombined),
+min, max, an approximate p95 of current_usage and the number of readings in
+each device_state. Both tiers are computed from raw readings, so
+run_rollups() has to run more often than raw readings expire; hourly is the
+intended schedule (see scripts/run_retention.py).
+
+choose_tier() picks the finest tier that still holds the start of a window
+and returns at most RETENTION_MAX_POINTS points for it; query_usage() reads
+that tier and returns the same (bucket_start, average_usage, samples) tuples
+as the usage engines, densified to the tier's step.
+"""
+import os
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, DESCENDING
+import read_profiles
+import usage
+
+HOURLY_COLLECTION = "usage_hourly"
+DAILY_COLLECTION = "usage_daily"
+
+RAW_DAYS = float(os.environ.get("RETENTION_RAW_DAYS", 30))
+HOURLY_DAYS = float(os.environ.get("RETENTION_HOURLY_DAYS", 365))
+DAILY_DAYS = float(os.environ.get("RETENTION_DAILY_DAYS", 0))
+# Finest resolution wins as long as the window fits in this many points
+MAX_POINTS = int(os.environ.get("RETENTION_MAX_POINTS", 1500))
+
+# device_state values accepted by ingest.validate_reading
+STATES = ("active", "idle", "standby")
+
+# Ordered finest first. "raw" is served by the usage engines.
+TIERS = [
+    {"name": "raw", "unit": "minute", "step": timedelta(minutes=usage.BUCKET_MINUTES), "days": RAW_DAYS},
+    {"name": "hourly", "unit": "hour", "step": timedelta(hours=1), "days": HOURLY_DAYS,
+     "collection": HOURLY_COLLECTION},
+    {"name": "daily", "unit": "day", "step": timedelta(days=1), "days": DAILY_DAYS,
+     "collection": DAILY_COLLECTION},
+]
+TIERS_BY_NAME = {tier["name"]: tier for tier in TIERS}
+# Longest window of /api/usage, which is served from the tiers: what the
+# coarsest tier keeps, or RETENTION_MAX_WINDOW_DAYS when it keeps everything
+MAX_WINDOW_DAYS = TIERS[-1]["days"] or float(os.environ.get("RETENTION_MAX_WINDOW_DAYS", 3650))
+# Longest window of the routes that always bucket raw readings (anomalies,
+# per-user usage); older readings have expired anyway
+RAW_WINDOW_DAYS = RAW_DAYS
+
+if RAW_DAYS < usage.WINDOW_DAYS:
+    raise ValueError(f"RETENTION_RAW_DAYS must cover the {usage.WINDOW_DAYS} day dashboard window")
+
+
+def floor_to_tier(ts, tier):
+    if tier["unit"] == "day":
+        return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    if tier["unit"] == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return usage.floor_to_bucket(ts)
+
+
+def summary_pipeline(tier, start=None):
+    """Summarise raw readings from `start` onwards into `tier` buckets."""
+    group = {
+        "_id": {"$dateTrunc": {"date": "$Timestamp", "unit": tier["unit"]}},
+        "total": {"$sum": "$current_usage"},
+        "count": {"$sum": 1},
+        "min": {"$min": "$current_usage"},
+        "max": {"$max": "$current_usage"},
+        # $percentile needs MongoDB 7.0+
+        "p95": {"$percentile": {"input": "$current_usage", "p": [0.95], "method": "approximate"}},
+    }
+    for state in STATES:
+        group[f"state_{state}"] = {"$sum": {"$cond": [{"$eq": ["$device_state", state]}, 1, 0]}}
+
+    return [
+        {"$match": {"Timestamp": {"$gte": start}} if start is not None else {}},
+        {"$group": group},
+        {"$set": {
+            # TTL indexes cannot use _id, so the bucket start is repeated
+            "Timestamp": "$_id",
+            "p95": {"$arrayElemAt": ["$p95", 0]},
+            "states": {state: f"$state_{state}" for state in STATES},
+        }},
+        {"$unset": [f"state_{state}" for state in STATES]},
+        {"$merge": {"into": tier["collection"], "on": "_id", "whenMatched": "replace"}},
+    ]
+
+
+def refresh_tier(db, tier, since=None, now=None):
+    """
+    Recompute `tier` buckets from `since` onwards. With since=None the
+    refresh starts at the newest stored bucket (which may have been open when
+    it was written), or covers all raw readings if the tier is empty.
+
+    The refresh never starts before the oldest bucket whose raw readings are
+    all still retained: recomputing a bucket whose readings have partly
+    expired would overwrite a correct summary with a partial one.
+    """
+    now = now or datetime.utcnow()
+    if since is None:
+        newest = db[tier["collection"]].find_one({}, sort=[("_id", DESCENDING)])
+        since = newest["_id"] if newest else None
+
+    start = None
+    if since is not None:
+        # Buckets before raw_floor may already have lost readings to the TTL
+        raw_floor = floor_to_tier(now - timedelta(days=RAW_DAYS), tier) + tier["step"]
+        start = max(floor_to_tier(since, tier), raw_floor)
+
+    db[usage.READINGS_COLLECTION].aggregate(summary_pipeline(tier, start))
+    return start
+
+
+def run_rollups(db, since=None, now=None):
+    """Bring every summary tier up to date. Returns {tier name: refresh start}."""
+    return {
+        tier["name"]: refresh_tier(db, tier, since, now)
+        for tier in TIERS if "collection" in tier
+    }
+
+
+def apply_ttl(db):
+    """
+    Set expireAfterSeconds on the raw time series collection and TTL indexes
+    on the summary tiers. A tier with 0 days keeps its data forever.
+    """
+    db.command("collMod", usage.READINGS_COLLECTION, expireAfterSeconds=int(RAW_DAYS * 86400))
+    for tier in TIERS:
+        if "collection" not in tier:
+            continue
+        collection = db[tier["collection"]]
+        if tier["days"]:
+            collection.create_index("Timestamp", name="Timestamp_ttl",
+                                    expireAfterSeconds=int(tier["days"] * 86400))
+        elif "Timestamp_ttl" in collection.index_information():
+            collection.drop_index("Timestamp_ttl")
+
+
+def choose_tier(start, end=None, now=None):
+    """
+    The finest tier that still holds `start` and covers [start, end) in at
+    most MAX_POINTS buckets; the coarsest tier if none does.
+    """
+    now = now or datetime.utcnow()
+    end = end or now
+    for tier in TIERS:
+        retained = not tier["days"] or start >= now - timedelta(days=tier["days"])
+        if retained and (end - start) / tier["step"] <= MAX_POINTS:
+            return tier
+    return TIERS[-1]
+
+
+def read_profile(tier):
+    """
+    The read_profiles profile for reading `tier`: windows served from the
+    rollup tiers are analytics reads, since a lagging secondary only delays
+    the newest hourly or daily bucket.
+    """
+    if tier["name"] == "raw":
+        return read_profiles.select("usage", "interactive")
+    return read_profiles.select("usage_tiered", "analytics")
+
+
+def tier_filter(tier, start, end=None):
+    """find() filter for the buckets of a rollup tier that cover [start, end)."""
+    bounds = {"$gte": floor_to_tier(start, tier)}
+    if end is not None:
+        bounds["$lt"] = end
+    return {"_id": bounds}
+
+
+# Projection and sort for reading a rollup tier with tier_filter()
+TIER_PROJECTION = {"total": 1, "count": 1}
+TIER_SORT = [("_id", ASCENDING)]
+
+
+def densify_tier(intervals, tier, start, end, fill, now):
+    """One point per `tier` step of [start, end or now), filled according to `fill`."""
+    return usage.densify(intervals, floor_to_tier(start, tier), end or now, tier["step"], fill)
+
+
+def query_usage(db, start, end=None, engine="python", fill="null", now=None):
+    """
+    Average usage per bucket of the tier chosen for the window, with empty
+    buckets filled by usage.densify() according to `fill`.
+    Returns (tier name, [(bucket_start, average_usage, samples), ...]).
+    """
+    now = now or datetime.utcnow()
+    tier = choose_tier(start, end, now)
+    if tier["name"] == "raw":
+        intervals = usage.compute_usage(db, start, end, engine=engine)
+    else:
+        cursor = db[tier["collection"]].find(tier_filter(tier, start, end), TIER_PROJECTION, sort=TIER_SORT)
+        intervals = usage.bucket_intervals(cursor)
+    return tier["name"], densify_tier(intervals, tier, start, end, fill, now)
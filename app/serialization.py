@@ -0,0 +1,102 @@
+"""
+JSON encoding for API responses.
+
+create_app() installs one of two Flask JSON providers, chosen with
+JSON_BACKEND:
+
+- orjson: orjson's native encoder (the default when orjson is installed)
+- stdlib: Flask's json-module provider
+
+Both encode BSON types directly, so documents from pymongo can be passed to
+jsonify() as they are: ObjectId as its hex string, datetimes as ISO 8601
+(naive ones are UTC, as pymongo returns them) and Decimal128 as a decimal
+string so no precision is lost.
+
+stream_array() encodes a large list in chunks for a streamed response
+instead of building the whole body in memory first. dumps() encodes the same
+way outside Flask (the ASGI mode in asgi.py).
+"""
+import os
+import json
+from datetime import datetime, timezone
+from bson import Decimal128, ObjectId
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_BACKEND = os.environ.get("JSON_BACKEND", "orjson" if orjson else "stdlib")
+# Items encoded per chunk by stream_array()
+STREAM_CHUNK = int(os.environ.get("JSON_STREAM_CHUNK", 1000))
+
+
+def bson_default(obj):
+    """Encode the BSON types the json encoders do not know."""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, Decimal128):
+        return str(obj.to_decimal())
+    if isinstance(obj, datetime):
+        # Only reached with the stdlib backend; orjson handles datetimes itself
+        return (obj if obj.tzinfo else obj.replace(tzinfo=timezone.utc)).isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class StdlibJSONProvider(DefaultJSONProvider):
+    sort_keys = False
+
+    @staticmethod
+    def default(obj):
+        return bson_default(obj)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """orjson for dumps() and response(); parsing stays with the json module."""
+
+    # Naive datetimes from pymongo are UTC
+    OPTIONS = (orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+    def encode(self, obj, indent=False):
+        option = self.OPTIONS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, default=bson_default, option=option)
+
+    def dumps(self, obj, **kwargs):
+        return self.encode(obj, indent=bool(kwargs.get("indent"))).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(self.encode(obj, indent) + b"\n", mimetype=self.mimetype)
+
+
+PROVIDERS = {
+    "orjson": OrjsonProvider,
+    "stdlib": StdlibJSONProvider
+}
+
+
+def init_app(app, backend=JSON_BACKEND):
+    if backend not in PROVIDERS:
+        raise ValueError(f"Unknown JSON_BACKEND '{backend}' (choose from {', '.join(PROVIDERS)})")
+    if backend == "orjson" and orjson is None:
+        raise RuntimeError("JSON_BACKEND=orjson but orjson is not installed")
+    app.json = PROVIDERS[backend](app)
+
+
+def dumps(obj, backend=JSON_BACKEND):
+    """`obj` as UTF-8 JSON bytes, encoded like the Flask providers do."""
+    if backend == "orjson" and orjson is not None:
+        return orjson.dumps(obj, default=bson_default, option=OrjsonProvider.OPTIONS)
+    return json.dumps(obj, default=bson_default, ensure_ascii=False).encode()
+
+
+def stream_array(provider, items, chunk_size=STREAM_CHUNK):
+    """Yield a JSON array of `items` in chunks of chunk_size encoded elements."""
+    yield "["
+    for offset in range(0, len(items), chunk_size):
+        chunk = provider.dumps(items[offset:offset + chunk_size])
+        # Drop the chunk's own brackets and join chunks with a comma
+        yield ("," if offset else "") + chunk[1:-1]
+    yield "]\n"
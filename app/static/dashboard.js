@@ -0,0 +1,199 @@
+async function fetchUsageData() {
+  try {
+    const apiUrl = window.location.origin + '/api/usage';
+    console.log('Fetching data from:', apiUrl);
+
+    const response = await fetch(apiUrl);
+    if (!response.ok) {
+      throw new Error(`Server returned ${response.status}: ${response.statusText}`);
+    }
+
+    const data = await response.json();
+
+    if (data.error) {
+      throw new Error(`API error: ${data.error}`);
+    }
+
+    console.log(`Received ${data.length} data points`);
+    return data;
+  } catch (error) {
+    console.error('Error fetching data:', error);
+    throw error;
+  }
+}
+
+async function renderChart() {
+  const chartContainer = document.getElementById('chart-container');
+
+  try {
+    const usageData = await fetchUsageData();
+
+    if (!usageData || usageData.length === 0) {
+      chartContainer.innerHTML = '<div class="error-message">No data available for the selected time period.</div>';
+      return;
+    }
+
+    // Clear loading message
+    chartContainer.innerHTML = '<canvas id="usageChart"></canvas>';
+
+    const labels = usageData.map(point => point.label);
+    // usage is null for intervals without readings (the API's default fill);
+    // samples is 0 for every interval that was filled in
+    const usageValues = usageData.map(point => point.usage);
+    const samples = usageData.map(point => point.samples);
+
+    // Extract dates to create day separators
+    const uniqueDates = [];
+    const dateIndicesToMark = [];
+
+    // Use the fullDate field for accurate day separation
+    usageData.forEach((point, index) => {
+      const fullDate = point.fullDate; // Use the new fullDate field
+      if (!uniqueDates.includes(fullDate)) {
+        uniqueDates.push(fullDate);
+        if (index > 0) { // Don't mark the first data point
+          // Get readable date format for display
+          const displayDate = new Date(fullDate).toLocaleDateString('en-US', {
+            weekday: 'short', 
+            month: 'short', 
+            day: 'numeric'
+          });
+
+          dateIndicesToMark.push({
+            index: index,
+            date: displayDate
+          });
+        }
+      }
+    });
+
+    // Create annotation objects for each day separator
+    const annotations = {};
+    dateIndicesToMark.forEach((mark, i) => {
+      annotations[`line${i}`] = {
+        type: 'line',
+        xMin: mark.index,
+        xMax: mark.index,
+        borderColor: 'rgba(100, 100, 100, 0.75)',
+        borderWidth: 2,
+        borderDash: [6, 4],
+        label: {
+          display: true,
+          content: mark.date,
+          position: 'start',
+          backgroundColor: 'rgba(0, 0, 0, 0.65)',
+          color: 'white',
+          padding: {
+            top: 5,
+            bottom: 5,
+            left: 8,
+            right: 8
+          },
+          font: {
+            weight: 'bold',
+            size: 12
+          },
+          borderRadius: 4
+        }
+      };
+    });
+
+    const ctx = document.getElementById('usageChart').getContext('2d');
+    const chart = new Chart(ctx, {
+      type: 'line',
+      data: {
+        labels: labels,
+        datasets: [{
+          label: 'Electricity Usage (kW)',
+          data: usageValues,
+          borderColor: 'rgba(75, 192, 192, 1)',
+          backgroundColor: 'rgba(75, 192, 192, 0.1)',
+          fill: true,
+          tension: 0.3,
+          pointRadius: 1,
+          pointHoverRadius: 5,
+          // Leave a gap at null intervals instead of joining across them
+          spanGaps: false,
+          // Dash the line through interpolated or carried-forward intervals
+          segment: {
+            borderDash: ctx => (samples[ctx.p0DataIndex] === 0 || samples[ctx.p1DataIndex] === 0) ? [4, 4] : undefined
+          }
+        }]
+      },
+      options: {
+        responsive: true,
+        scales: {
+          x: {
+            title: {
+              display: true,
+              text: 'Time (EST) - 5-Minute Intervals'
+            },
+            ticks: {
+              maxRotation: 45,
+              minRotation: 45,
+              autoSkip: true,
+              maxTicksLimit: 24
+            }
+          },
+          y: {
+            title: {
+              display: true,
+              text: 'Electricity Usage (kW)'
+            },
+            min: 0
+          }
+        },
+        plugins: {
+          legend: {
+            display: true
+          },
+          tooltip: {
+            callbacks: {
+              label: function(context) {
+                if (samples[context.dataIndex] === 0) {
+                  return `Usage: ${context.parsed.y.toFixed(2)} kW (no readings, filled)`;
+                }
+                return `Usage: ${context.parsed.y.toFixed(2)} kW`;
+              }
+            }
+          },
+          annotation: {
+            annotations: annotations
+          }
+        }
+      }
+    });
+
+    subscribeToUpdates(chart, samples);
+  } catch (error) {
+    chartContainer.innerHTML = `<div class="error-message">Error loading data: ${error.message}</div>`;
+  }
+}
+
+// Keep the newest 5-minute buckets up to date from the server-sent event stream
+// instead of re-fetching the whole window
+function subscribeToUpdates(chart, samples) {
+  if (!window.EventSource) {
+    return;
+  }
+  const source = new EventSource(window.location.origin + '/api/usage/stream');
+  source.addEventListener('usage', (event) => {
+    const point = JSON.parse(event.data);
+    const labels = chart.data.labels;
+    const values = chart.data.datasets[0].data;
+    const index = labels.lastIndexOf(point.label);
+    if (index !== -1) {
+      values[index] = point.usage;
+      samples[index] = point.samples;
+    } else {
+      // The stream only carries the newest buckets, so a new label goes at the end
+      labels.push(point.label);
+      values.push(point.usage);
+      samples.push(point.samples);
+    }
+    chart.update('none');
+  });
+}
+
+// Render the chart when the page loads
+window.onload = renderChart;
@@ -0,0 +1,376 @@
+"""
+Usage aggregation engines behind /api/usage.
+
+Every engine returns the same thing: a list of (bucket_start, average_usage,
+samples) tuples sorted by bucket, where bucket_start is a naive UTC datetime
+truncated to BUCKET_MINUTES, average_usage is the mean current_usage of all
+readings in that bucket and samples is their number. Buckets without readings
+are left out; densify() turns such a series into a fixed-step one.
+
+- python:    fetch every reading in the window and bucket in a Python loop
+- aggregate: bucket on the server with $dateTrunc/$group
+- rollup:    read pre-aggregated buckets from ROLLUP_COLLECTION and bucket
+             only the readings after its newest bucket from the raw data;
+             refresh_rollup() runs from scripts/run_retention.py, never in
+             a request
+- columnar:  fetch only Timestamp and current_usage into NumPy arrays
+             (columnar.py) and bucket them with floor division and bincount
+"""
+import math
+import hashlib
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from pymongo import ASCENDING, DESCENDING
+import local_time
+
+BUCKET_MINUTES = 5
+WINDOW_DAYS = 3.5
+
+READINGS_COLLECTION = "sensor_readings"
+ROLLUP_COLLECTION = "usage_rollup_5m"
+
+# The default zone of labels and anomaly slots (USAGE_TIMEZONE, default US/Eastern)
+LOCAL_ZONE = local_time.get_zone()
+
+
+def _time_filter(start, end, user_ids=None):
+    query = {}
+    bounds = {}
+    if start is not None:
+        bounds["$gte"] = start
+    if end is not None:
+        bounds["$lt"] = end
+    if bounds:
+        query["Timestamp"] = bounds
+    if user_ids is not None:
+        # Equality on the metaField subfield lets the server skip whole
+        # buckets of other users and target the owning shard
+        query["metadata.UserId"] = user_ids[0] if len(user_ids) == 1 else {"$in": list(user_ids)}
+    return query
+
+
+def ensure_indexes(db):
+    """Indexes the usage queries rely on; create_index is a no-op for existing ones."""
+    # Per-user usage queries filter on the metaField's UserId and a time range
+    db[READINGS_COLLECTION].create_index([("metadata.UserId", 1), ("Timestamp", 1)])
+
+
+def floor_to_bucket(ts):
+    return ts.replace(minute=(ts.minute // BUCKET_MINUTES) * BUCKET_MINUTES, second=0, microsecond=0)
+
+
+def usage_python(db, start, end=None):
+    """Bucket every reading in the window in Python (the original implementation)."""
+    docs = db[READINGS_COLLECTION].find(_time_filter(start, end))
+
+    # We will group by 5-minute intervals in UTC,
+    # then convert to local time when formatting.
+    usage_by_interval = defaultdict(float)
+    count_by_interval = defaultdict(int)
+
+    for doc in docs:
+        ts_utc = doc.get("Timestamp")
+        current_usage = doc.get("current_usage", 0.0)
+
+        if ts_utc:
+            # Truncate to 5-minute intervals
+            interval_time = floor_to_bucket(ts_utc)
+
+            # Accumulate usage and count for averaging
+            usage_by_interval[interval_time] += float(current_usage)
+            count_by_interval[interval_time] += 1
+
+    # Average usage for each 5-minute interval, in ascending order
+    return [
+        (interval_time, usage_by_interval[interval_time] / count_by_interval[interval_time],
+         count_by_interval[interval_time])
+        for interval_time in sorted(usage_by_interval)
+    ]
+
+
+# The reading fields Python-side aggregation needs, as columnar.fetch() kinds
+# (columnar.DATE, columnar.DOUBLE)
+READING_COLUMNS = {"Timestamp": "date", "current_usage": "double"}
+
+
+def usage_columnar(db, start, end=None):
+    """The python engine's buckets, computed over two NumPy columns instead of a dict per reading."""
+    # Imported here to keep numpy off the worker boot path
+    import numpy as np
+    import columnar
+
+    columns = columnar.fetch(db[READINGS_COLLECTION], _time_filter(start, end), READING_COLUMNS)
+    # Readings without current_usage count as 0, as in usage_python()
+    usage_values = np.nan_to_num(columns["current_usage"], nan=0.0)
+    starts, sums, counts = columnar.bucket(columns["Timestamp"], usage_values, BUCKET_MINUTES * 60)
+    return list(zip(starts.tolist(), (sums / counts).tolist(), counts.tolist()))
+
+
+def bucket_pipeline(start, end=None, user_ids=None):
+    """$match + $group stages that sum and count readings per bucket (of the given users only)."""
+    return [
+        {"$match": _time_filter(start, end, user_ids)},
+        {"$group": {
+            "_id": {"$dateTrunc": {"date": "$Timestamp", "unit": "minute", "binSize": BUCKET_MINUTES}},
+            "total": {"$sum": "$current_usage"},
+            "count": {"$sum": 1}
+        }}
+    ]
+
+
+def bucket_intervals(docs):
+    """(bucket, average, samples) triples from documents with _id, total and count."""
+    return [(doc["_id"], doc["total"] / doc["count"], doc["count"]) for doc in docs]
+
+
+def usage_aggregate(db, start, end=None):
+    """Bucket on the server; only one small document per bucket crosses the wire."""
+    pipeline = bucket_pipeline(start, end) + [{"$sort": {"_id": 1}}]
+    return bucket_intervals(db[READINGS_COLLECTION].aggregate(pipeline))
+
+
+def refresh_rollup(db, since=None):
+    """
+    Recompute rollup buckets from `since` onwards and $merge them into
+    ROLLUP_COLLECTION. With since=None the refresh starts at the newest
+    stored bucket (which may still have been open when it was written), or
+    covers all readings if the rollup is empty. Readings that arrive late for
+    older buckets need an explicit `since`.
+    """
+    rollup = db[ROLLUP_COLLECTION]
+    if since is None:
+        newest = rollup.find_one({}, sort=[("_id", DESCENDING)])
+        since = newest["_id"] if newest else None
+    start = floor_to_bucket(since) if since is not None else None
+
+    pipeline = bucket_pipeline(start)
+    pipeline.append({"$merge": {"into": ROLLUP_COLLECTION, "on": "_id", "whenMatched": "replace"}})
+    db[READINGS_COLLECTION].aggregate(pipeline)
+
+
+def usage_rollup(db, start, end=None):
+    """
+    Pre-aggregated buckets up to the newest stored one, then the readings
+    from that bucket on (it may still have been open when it was written)
+    bucketed on the server. Read-only: a rollup that is behind or empty
+    costs at most a usage_aggregate() of the window, never a rebuild.
+    """
+    start = floor_to_bucket(start)
+    bounds = {"$gte": start}
+    if end is not None:
+        bounds["$lt"] = end
+    newest = db[ROLLUP_COLLECTION].find_one({"_id": bounds}, {"_id": 1}, sort=[("_id", DESCENDING)])
+    tail_start = newest["_id"] if newest else start
+    cursor = db[ROLLUP_COLLECTION].find({"_id": {"$gte": start, "$lt": tail_start}}).sort("_id", ASCENDING)
+    stored = [(doc["_id"], doc["total"] / doc["count"], doc["count"]) for doc in cursor]
+    return stored + usage_aggregate(db, tail_start, end)
+
+
+def user_usage(db, user_id, start, end=None):
+    """Buckets of one user's readings, served by the {metadata.UserId: 1, Timestamp: 1} index."""
+    pipeline = bucket_pipeline(start, end, [user_id]) + [{"$sort": {"_id": 1}}]
+    return [
+        (doc["_id"], doc["total"] / doc["count"], doc["count"])
+        for doc in db[READINGS_COLLECTION].aggregate(pipeline)
+    ]
+
+
+def users_usage(db, user_ids, start, end=None):
+    """
+    Buckets for several users from one pipeline grouped by (user, bucket).
+    Returns {user_id: [(bucket_start, average_usage, samples), ...]}, with an
+    empty list for users without readings. Grouping streams one document per
+    (user, bucket); a $facet per user would have to fit every series into a
+    single 16 MB result document.
+    """
+    pipeline = [
+        {"$match": _time_filter(start, end, user_ids)},
+        {"$group": {
+            "_id": {
+                "user": "$metadata.UserId",
+                "bucket": {"$dateTrunc": {"date": "$Timestamp", "unit": "minute", "binSize": BUCKET_MINUTES}}
+            },
+            "total": {"$sum": "$current_usage"},
+            "count": {"$sum": 1}
+        }},
+        {"$sort": {"_id.user": 1, "_id.bucket": 1}}
+    ]
+    series = {user_id: [] for user_id in user_ids}
+    for doc in db[READINGS_COLLECTION].aggregate(pipeline):
+        series[doc["_id"]["user"]].append((doc["_id"]["bucket"], doc["total"] / doc["count"], doc["count"]))
+    return series
+
+
+def latest_timestamp(db):
+    """Timestamp of the newest reading, or None when there are none."""
+    newest = db[READINGS_COLLECTION].find_one({}, {"Timestamp": 1}, sort=[("Timestamp", DESCENDING)])
+    return newest["Timestamp"] if newest else None
+
+
+def device_totals(db, start, end=None):
+    """Per-device reading count, total and average usage in the window."""
+    pipeline = [
+        {"$match": _time_filter(start, end)},
+        {"$group": {
+            "_id": "$metadata.deviceId",
+            "total": {"$sum": "$current_usage"},
+            "count": {"$sum": 1}
+        }},
+        {"$sort": {"_id": 1}}
+    ]
+    return [
+        {"deviceId": doc["_id"], "readings": doc["count"], "total": doc["total"], "average": doc["total"] / doc["count"]}
+        for doc in db[READINGS_COLLECTION].aggregate(pipeline)
+    ]
+
+
+ENGINES = {
+    "python": usage_python,
+    "aggregate": usage_aggregate,
+    "rollup": usage_rollup,
+    "columnar": usage_columnar
+}
+
+
+def compute_usage(db, start, end=None, engine="python"):
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown usage engine '{engine}' (choose from {', '.join(ENGINES)})")
+    return ENGINES[engine](db, start, end)
+
+
+FILL_POLICIES = ("none", "null", "linear", "locf")
+
+
+def densify(intervals, start, end, step, policy="null"):
+    """
+    Fixed-step series from `start` (a bucket boundary) up to `end`: buckets
+    without readings get samples=0 and an average chosen by `policy`:
+
+    - none:   leave them out (the engines' sparse output)
+    - null:   None, so charts show a gap
+    - linear: interpolated between the neighbouring buckets with readings
+              (None before the first and after the last one)
+    - locf:   the last observed average (None before the first one)
+    """
+    if policy not in FILL_POLICIES:
+        raise ValueError(f"Unknown fill policy '{policy}' (choose from {', '.join(FILL_POLICIES)})")
+    if policy == "none":
+        return list(intervals)
+
+    observed = {bucket: (avg_usage, samples) for bucket, avg_usage, samples in intervals}
+    dense = []
+    bucket = start
+    while bucket < end:
+        avg_usage, samples = observed.get(bucket, (None, 0))
+        dense.append([bucket, avg_usage, samples])
+        bucket += step
+
+    if policy == "locf":
+        last = None
+        for point in dense:
+            if point[1] is None:
+                point[1] = last
+            else:
+                last = point[1]
+    elif policy == "linear":
+        previous = None
+        for index, point in enumerate(dense):
+            if point[2] == 0:
+                continue
+            if previous is not None and index - previous > 1:
+                left, right = dense[previous][1], point[1]
+                span = index - previous
+                for gap in range(previous + 1, index):
+                    dense[gap][1] = left + (right - left) * (gap - previous) / span
+            previous = index
+    return [tuple(point) for point in dense]
+
+
+def parse_window(args, max_days=None):
+    """
+    (start, end) in naive UTC from the ?start=&end= (ISO 8601) or ?days=
+    query arguments; defaults to the last WINDOW_DAYS days. ?days= must be
+    positive, and the window, however it is given, at most `max_days` long
+    (None: no limit). Raises ValueError.
+    """
+    def parse(name):
+        value = args.get(name)
+        if not value:
+            return None
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        try:
+            return parsed.astimezone(timezone.utc).replace(tzinfo=None) if parsed.tzinfo else parsed
+        except OverflowError:
+            raise ValueError(f"{name} is out of range")
+
+    now = datetime.utcnow()
+    end = parse("end")
+    start = parse("start")
+    if start is None:
+        days = float(args.get("days", WINDOW_DAYS))
+        if not math.isfinite(days) or days <= 0 or (max_days is not None and days > max_days):
+            limit = f"at most {max_days:g}" if max_days is not None else "finite"
+            raise ValueError(f"days must be positive and {limit}")
+        try:
+            start = (end or now) - timedelta(days=days)
+        except OverflowError:
+            raise ValueError("days reaches before the earliest representable date")
+    if end is not None and end <= start:
+        raise ValueError("end must be after start")
+    if max_days is not None and (end or now) - start > timedelta(days=max_days):
+        raise ValueError(f"the window must be at most {max_days:g} days long")
+    return start, end
+
+
+def parse_fill(args, default):
+    """The ?fill= policy, or `default`. Raises ValueError."""
+    fill = args.get("fill", default)
+    if fill not in FILL_POLICIES:
+        raise ValueError(f"fill must be one of {', '.join(FILL_POLICIES)}")
+    return fill
+
+
+def usage_etag(latest, start, end, fill, engine, zone=None):
+    """
+    Validator for an /api/usage response: the newest reading plus the
+    window's first and last bucket, so new readings and the window moving
+    on both change it. Late readings older than the newest one do not.
+    """
+    last_bucket = floor_to_bucket(end or datetime.utcnow())
+    key = f"{latest}|{floor_to_bucket(start)}|{last_bucket}|{fill}|{engine}|{zone or local_time.DEFAULT_ZONE}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def parse_timezone(args):
+    """The ?tz= zone name (IANA), or local_time.DEFAULT_ZONE. Raises ValueError."""
+    zone = args.get("tz") or local_time.DEFAULT_ZONE
+    local_time.get_zone(zone)
+    return zone
+
+
+def format_points(intervals, zone=None):
+    """/api/usage data points for (bucket, avg_usage, samples) intervals, labelled in `zone`."""
+    intervals = list(intervals)
+    labels, dates = local_time.labels([interval[0] for interval in intervals], zone)
+    points = []
+    for (_, avg_usage, samples), label, date in zip(intervals, labels, dates):
+        # "MM/DD hh:mm AM/PM" keeps the date part for day separators; fullDate
+        # is for the frontend. samples=0 marks a filled gap.
+        points.append({"label": label, "usage": avg_usage, "fullDate": date, "samples": samples})
+    return points
+
+
+def format_point(interval_utc, avg_usage, samples=None, zone=None):
+    """One /api/usage data point, labelled in local time (`zone`, default local_time.DEFAULT_ZONE)."""
+    (label,), (date,) = local_time.labels([interval_utc], zone)
+    point = {
+        # Format: "MM/DD hh:mm AM/PM" - Keep the date part for day separators
+        "label": label,
+        "usage": avg_usage,
+        # Add full date info for the frontend to use
+        "fullDate": date
+    }
+    if samples is not None:
+        # Readings behind the point; 0 marks a filled gap
+        point["samples"] = samples
+    return point
@@ -0,0 +1,226 @@
+"""
+Live usage updates for /api/usage/stream (server-sent events).
+
+One UsageTailer per process watches sensor_readings for new readings and
+keeps the open 5-minute buckets in memory. Every update is fanned out to all
+connected clients through per-client queues, so N dashboards cost a single
+database watcher instead of N repeated window scans.
+
+The tailer uses a change stream when the collection supports one (a regular
+collection on a replica set) and otherwise polls; time series collections do
+not support change streams. Set USAGE_STREAM_MODE to "changestream" or
+"poll" to force a mode. Polling re-aggregates the open buckets each time and
+sends those whose totals changed, so readings posted late still update them.
+In either mode a reading for a bucket that is no longer open only shows up
+in /api/usage.
+
+The tailer thread starts with the first subscriber and stops once nobody has
+been subscribed for USAGE_STREAM_IDLE seconds.
+
+Under gunicorn every open stream holds a worker thread for as long as the
+browser stays connected, so at most USAGE_STREAM_MAX_CLIENTS streams are
+served per process (default half of WEB_THREADS, at least 1); subscribe()
+refuses the rest and the route answers them with 503.
+"""
+import os
+import json
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from pymongo.errors import OperationFailure, PyMongoError
+import db
+import usage
+
+STREAM_MODE = os.environ.get("USAGE_STREAM_MODE", "auto")
+POLL_INTERVAL = float(os.environ.get("USAGE_STREAM_POLL_INTERVAL", 5))
+IDLE_TIMEOUT = float(os.environ.get("USAGE_STREAM_IDLE", 60))
+# Seconds between SSE comments that keep proxies from closing idle streams
+KEEPALIVE = 15
+# Updates buffered per client before it is considered too slow and dropped
+CLIENT_QUEUE_SIZE = 100
+# Open buckets remembered; older ones are complete and can be forgotten
+OPEN_BUCKETS = 3
+# Concurrent streams per process; the rest of the worker's threads stay free for requests
+MAX_CLIENTS = int(os.environ.get("USAGE_STREAM_MAX_CLIENTS", max(int(os.environ.get("WEB_THREADS", 4)) // 2, 1)))
+
+
+class UsageTailer:
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        # bucket start -> [total usage, reading count]
+        self._buckets = {}
+
+    # --- Subscribers ---
+
+    def subscribe(self):
+        """A queue of updates for a new client, or None when MAX_CLIENTS are already subscribed."""
+        client_queue = queue.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        with self._lock:
+            if len(self._subscribers) >= MAX_CLIENTS:
+                return None
+            self._subscribers.add(client_queue)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="usage-tailer", daemon=True)
+                self._thread.start()
+        return client_queue
+
+    def unsubscribe(self, client_queue):
+        with self._lock:
+            self._subscribers.discard(client_queue)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def _publish(self, update):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for client_queue in subscribers:
+            try:
+                client_queue.put_nowait(update)
+            except queue.Full:
+                # A client that cannot keep up is disconnected rather than
+                # letting its backlog grow without bound
+                self.unsubscribe(client_queue)
+                try:
+                    client_queue.get_nowait()
+                except queue.Empty:
+                    pass
+                client_queue.put_nowait(None)
+
+    # --- Bucketing ---
+
+    def _seed(self, collection):
+        """
+        Load the totals of the open buckets, so the first update of a bucket
+        the tailer joined partway through carries the average of all its
+        readings, not only of those seen since.
+        """
+        step = timedelta(minutes=usage.BUCKET_MINUTES)
+        start = usage.floor_to_bucket(datetime.utcnow()) - (OPEN_BUCKETS - 1) * step
+        self._buckets = {
+            doc["_id"]: [doc["total"], doc["count"]]
+            for doc in collection.aggregate(usage.bucket_pipeline(start))
+        }
+
+    @staticmethod
+    def _update(bucket, totals):
+        update = usage.format_point(bucket, totals[0] / totals[1], totals[1])
+        update["bucket"] = bucket.isoformat()
+        return update
+
+    def _apply(self, reading):
+        ts = reading.get("Timestamp")
+        if ts is None:
+            return
+        bucket = usage.floor_to_bucket(ts)
+        totals = self._buckets.setdefault(bucket, [0.0, 0])
+        totals[0] += float(reading.get("current_usage", 0.0))
+        totals[1] += 1
+        for stale in sorted(self._buckets)[:-OPEN_BUCKETS]:
+            del self._buckets[stale]
+        if bucket not in self._buckets:
+            # A late reading for a closed bucket; its average would only
+            # cover the readings seen since, so it is not sent
+            return
+        return self._update(bucket, totals)
+
+    def _emit(self, readings):
+        updates = {}
+        for reading in readings:
+            update = self._apply(reading)
+            if update:
+                # Only the latest state of each bucket is worth sending
+                updates[update["bucket"]] = update
+        for update in updates.values():
+            self._publish(update)
+
+    # --- Watchers ---
+
+    def _idle(self):
+        """True once nobody has been subscribed for IDLE_TIMEOUT seconds."""
+        if self.subscriber_count():
+            self._idle_since = None
+            return False
+        if self._idle_since is None:
+            self._idle_since = time.monotonic()
+        return time.monotonic() - self._idle_since > IDLE_TIMEOUT
+
+    def _use_change_stream(self, collection):
+        if STREAM_MODE != "auto":
+            return STREAM_MODE == "changestream"
+        info = next(collection.database.list_collections(filter={"name": collection.name}), None)
+        return not (info and info.get("type") == "timeseries")
+
+    def _watch(self, collection):
+        pipeline = [{"$match": {"operationType": "insert"}}]
+        with collection.watch(pipeline, max_await_time_ms=int(KEEPALIVE * 1000)) as stream:
+            # Seeded after the stream is open, so no insert falls between the
+            # two; one landing while the seed runs may be counted twice
+            self._seed(collection)
+            while stream.alive and not self._idle():
+                change = stream.try_next()
+                if change is not None:
+                    self._emit([change["fullDocument"]])
+
+    def _poll(self, collection):
+        # A Timestamp high-water mark would skip readings that devices post
+        # late, so every poll recomputes the open buckets (a few minutes of
+        # readings) and sends the ones whose totals changed
+        self._seed(collection)
+        while not self._idle():
+            time.sleep(POLL_INTERVAL)
+            previous = self._buckets
+            self._seed(collection)
+            for bucket, totals in sorted(self._buckets.items()):
+                if previous.get(bucket) != totals:
+                    self._publish(self._update(bucket, totals))
+
+    def _run(self):
+        self._idle_since = None
+        collection = db.get_collection(usage.READINGS_COLLECTION)
+        while True:
+            if self._idle():
+                # Decide under the lock so a concurrent subscribe() either
+                # sees this thread still running or starts a new one
+                with self._lock:
+                    if not self._subscribers:
+                        self._thread = None
+                        print("Usage stream: no subscribers, tailer stopped")
+                        return
+                continue
+            try:
+                if self._use_change_stream(collection):
+                    try:
+                        self._watch(collection)
+                        continue
+                    except OperationFailure as e:
+                        # Standalone servers and time series collections cannot be watched
+                        print(f"Usage stream: change stream unavailable ({e}), polling instead")
+                self._poll(collection)
+            except PyMongoError as e:
+                print(f"Usage stream error: {e}; retrying in {POLL_INTERVAL}s")
+                time.sleep(POLL_INTERVAL)
+
+
+tailer = UsageTailer()
+
+
+def event_stream(client_queue):
+    """Yield SSE frames for one client until it disconnects or is dropped."""
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                update = client_queue.get(timeout=KEEPALIVE)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            if update is None:
+                return
+            yield f"event: usage\ndata: {json.dumps(update)}\n\n"
+    finally:
+        tailer.unsubscribe(client_queue)
@@ -0,0 +1,11 @@
+"""
+WSGI entry point for production serving:
+
+    gunicorn -c app/gunicorn.conf.py --chdir app wsgi:app
+
+The MongoClient is not created here; each worker creates its own on first use
+(see db.get_client) and gunicorn.conf.py closes it when the worker exits.
+"""
+from app import create_app
+
+app = create_app()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Concurrency at equal memory: the gunicorn (gthread) profile versus the ASGI
+mode (uvicorn + Motor, app/asgi.py).
+
+Both servers get the same number of worker processes, so their memory is
+dominated by the same interpreter, app and driver footprint. Each is driven
+at increasing client concurrency with the closed-loop client from
+bench_serving.py while the resident memory of its whole process tree is
+sampled. The threaded server has at most workers * threads requests in
+flight and queues the rest in its accept backlog; the async server holds
+every request it accepts as a coroutine. The per-level numbers show what
+each costs in latency and memory as concurrency grows.
+
+    python benchmarks/bench_async.py --workers 2 --threads 8 --concurrency 8 32 128 --output async.json
+
+Reported per server and concurrency level: requests/sec, p50/p99 latency,
+errors, peak RSS and requests/sec per GB of peak RSS.
+"""
+import os
+import signal
+import argparse
+import threading
+import subprocess
+
+import common
+from bench_serving import APP_DIR, drive, wait_for_port
+
+SERVERS = {
+    "gthread": {
+        "port": 8056,
+        "command": ["gunicorn", "-c", os.path.join(APP_DIR, "gunicorn.conf.py"), "--chdir", APP_DIR, "wsgi:app"]
+    },
+    "async": {
+        "port": 8057,
+        "command": ["uvicorn", "--app-dir", APP_DIR, "asgi:app", "--host", "127.0.0.1", "--no-access-log"]
+    }
+}
+
+
+def tree_rss(session_id):
+    """Resident memory in bytes of every process in the session (the server and its workers)."""
+    total = 0
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            if os.getsid(int(pid)) != session_id:
+                continue
+            with open(f"/proc/{pid}/statm") as f:
+                total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            continue
+    return total
+
+
+class PeakRSS:
+    """Samples tree_rss() on a background thread and keeps the maximum."""
+
+    def __init__(self, session_id, interval=0.2):
+        self.session_id = session_id
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, tree_rss(self.session_id))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+def run_server(name, args):
+    server = SERVERS[name]
+    port = server["port"]
+    command = server["command"] + (["--port", str(port), "--workers", str(args.workers)] if name == "async" else [])
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(args.workers), WEB_THREADS=str(args.threads))
+
+    print(f"Starting {name} server on port {port} ({args.workers} workers)...")
+    proc = subprocess.Popen(command, env=env, cwd=APP_DIR,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=True)
+    try:
+        if not wait_for_port(port):
+            raise RuntimeError(f"{name} server did not start")
+        drive(port, args.path, args.concurrency[0], min(5, args.duration))
+        levels = {}
+        for concurrency in args.concurrency:
+            with PeakRSS(proc.pid) as rss:
+                result = drive(port, args.path, concurrency, args.duration)
+            result["peak_rss_mb"] = round(rss.peak / 2**20, 1)
+            result["requests_per_sec_per_gb"] = round(result["requests_per_sec"] / (rss.peak / 2**30), 1) if rss.peak else None
+            levels[str(concurrency)] = result
+            print(f"{name} @ {concurrency}: {result['requests_per_sec']} req/s, p99 {result['p99_ms']} ms, "
+                  f"{result['errors']} errors, peak RSS {result['peak_rss_mb']} MB")
+        return levels
+    finally:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare threaded and async serving at equal memory')
+    parser.add_argument('--path', default='/api/usage', help='Endpoint to drive (default: /api/usage)')
+    parser.add_argument('--workers', type=int, default=2, help='Worker processes for both servers (default: 2)')
+    parser.add_argument('--threads', type=int, default=8, help='Threads per gunicorn worker (default: 8)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[8, 32, 128],
+                        help='Client concurrency levels (default: 8 32 128)')
+    parser.add_argument('--duration', type=int, default=20, help='Seconds per level (default: 20)')
+    parser.add_argument('--servers', nargs='+', default=list(SERVERS), choices=list(SERVERS))
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    results = {
+        "path": args.path,
+        "workers": args.workers,
+        "threads": args.threads,
+        "duration": args.duration,
+        "servers": {name: run_server(name, args) for name in args.servers}
+    }
+    if args.output:
+        common.write_results(args.output, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Worker boot cost: import time of the WSGI entry point, measured with
+`python -X importtime`.
+
+Each run is a fresh interpreter importing app/wsgi.py (no network access is
+involved since the MongoClient is created lazily). The cumulative time of the
+top-level import and of the heaviest packages is reported as the median over
+all runs.
+
+    python benchmarks/bench_import_time.py --runs 15 --output benchmarks/results/import_time.json
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(ROOT, "app")
+
+# Packages whose cost we track explicitly
+WATCHED = ["flask", "pymongo", "pymongo.encryption", "bson", "boto3", "botocore", "pytz", "qe_utils", "numpy"]
+
+
+def parse_importtime(stderr):
+    """Map module name -> cumulative microseconds from -X importtime output"""
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        # "import time:  self [us] | cumulative [us] | module" (module is indented by depth)
+        _, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        cumulative[name.strip()] = int(cumulative_us)
+    return cumulative
+
+
+def run_once(module):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=APP_DIR, capture_output=True, text=True, check=True
+    )
+    return parse_importtime(result.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure import time of the app entry point')
+    parser.add_argument('--module', default='wsgi', help='Module to import from app/ (default: wsgi)')
+    parser.add_argument('--runs', type=int, default=15, help='Fresh interpreters to sample (default: 15)')
+    parser.add_argument('--top', type=int, default=15, help='Heaviest modules to list (default: 15)')
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    samples = [run_once(args.module) for _ in range(args.runs)]
+
+    def median_ms(name):
+        values = [sample[name] for sample in samples if name in sample]
+        return round(statistics.median(values) / 1000, 1) if values else None
+
+    total = median_ms(args.module)
+    watched = {name: median_ms(name) for name in WATCHED}
+    # Only count top-level entries once (e.g. "flask", not "flask.app")
+    names = {name for sample in samples for name in sample if "." not in name}
+    heaviest = sorted(((median_ms(name), name) for name in names), reverse=True)[:args.top]
+
+    print(f"import {args.module}: {total} ms (median of {args.runs} runs)")
+    for name, ms in watched.items():
+        print(f"  {name:<20} {ms if ms is not None else 'not imported'}")
+    print("Heaviest top-level packages (cumulative ms):")
+    for ms, name in heaviest:
+        print(f"  {name:<20} {ms}")
+
+    if args.output:
+        results = {
+            "module": args.module,
+            "runs": args.runs,
+            "python": sys.version.split()[0],
+            "total_ms": total,
+            "watched_ms": watched,
+            "heaviest_ms": {name: ms for ms, name in heaviest}
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
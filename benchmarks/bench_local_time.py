@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Time the local-time labels of /api/usage points (app/local_time.py).
+
+Labels a --days long series of 5-minute buckets with usage.format_points()
+and with the per-point astimezone()/strftime() formatting it replaced, and
+reports the median of --repeat runs of each. Runs without MongoDB. DST
+correctness is covered by tests/test_local_time.py.
+
+    python benchmarks/bench_local_time.py --days 31 --output benchmarks/results/local_time.json
+"""
+import time
+import argparse
+import statistics
+from datetime import datetime, timedelta, timezone
+
+import common
+import local_time
+import usage
+
+
+def legacy_format(intervals):
+    """The per-point formatting format_point() used to do (taking buckets as UTC)."""
+    zone = local_time.get_zone()
+    points = []
+    for interval_utc, avg_usage, samples in intervals:
+        local = interval_utc.replace(tzinfo=timezone.utc).astimezone(zone)
+        points.append({"label": local.strftime("%m/%d %I:%M %p"), "usage": avg_usage,
+                       "fullDate": local.strftime("%Y-%m-%d"), "samples": samples})
+    return points
+
+
+def timed(run, repeat):
+    timings = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - began)
+    return round(statistics.median(timings), 4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time DST-aware usage labels')
+    parser.add_argument('--days', type=float, default=31, help='Length of the timed series in days (default: 31)')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per formatter (default: 5)')
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    # Ends after the US/Eastern fall-back day so the series crosses a DST change
+    end = datetime(2024, 11, 10)
+    step = timedelta(minutes=usage.BUCKET_MINUTES)
+    count = int(timedelta(days=args.days) / step)
+    intervals = [(end - step * (count - index), 1.0, 1) for index in range(count)]
+    results = {
+        "points": len(intervals),
+        "format_points_seconds": timed(lambda: usage.format_points(intervals), args.repeat),
+        "per_point_seconds": timed(lambda: legacy_format(intervals), args.repeat)
+    }
+    print(f"{results['points']} points: format_points {results['format_points_seconds']}s, "
+          f"per point {results['per_point_seconds']}s")
+    if args.output:
+        common.write_results(args.output, results)
+
+
+if __name__ == "__main__":
+    main()
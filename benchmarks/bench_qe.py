@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Latency of the /api/qe_demo query with automatic encryption versus prepared
+(explicitly encrypted, cached) filters from qe_utils.PreparedQueries.
+
+Three paths run the same query against QE_NAMESPACE, each --repeat times
+after --warmup untimed runs:
+
+  - auto: one long-lived auto-encryption client; every find() goes through
+    query analysis and payload encryption
+  - prepared: the filter is encrypted once and served from the LRU; the
+    client bypasses query analysis and only decrypts results
+  - prepared_uncached: the same client with a cache size of 0, so every
+    query pays the explicit encryption
+
+For each path it reports latency (min / median / p95, ms) and the matching
+document count; the counts must agree. Uses the app's MONGODB_URI and AWS_*
+settings and the data written by scripts/migrate_to_encrypted.py:
+
+    python benchmarks/bench_qe.py --repeat 200 --output benchmarks/results/qe.json
+"""
+import time
+import argparse
+import statistics
+
+import common
+import qe_utils
+
+
+def timed(run, repeat, warmup):
+    for _ in range(warmup):
+        run()
+    timings = []
+    count = 0
+    for _ in range(repeat):
+        began = time.perf_counter()
+        count = len(run())
+        timings.append(time.perf_counter() - began)
+    timings.sort()
+    return {
+        "count": count,
+        "latency_min_ms": round(timings[0] * 1000, 3),
+        "latency_median_ms": round(statistics.median(timings) * 1000, 3),
+        "latency_p95_ms": round(timings[min(len(timings) - 1, int(0.95 * len(timings)))] * 1000, 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare automatic and prepared Queryable Encryption queries')
+    parser.add_argument('--repeat', type=int, default=100, help='Timed queries per path (default: 100)')
+    parser.add_argument('--warmup', type=int, default=5, help='Untimed queries per path (default: 5)')
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    db_name, coll_name = qe_utils.QE_NAMESPACE.split(".")
+    encrypted_client, client_encryption = qe_utils.get_encryption_client()
+    auto = encrypted_client[db_name][coll_name]
+    uncached = qe_utils.PreparedQueries(max_size=0)
+
+    paths = {
+        "auto": lambda: list(auto.find(qe_utils.SENIOR_WEST_COAST_FILTER)),
+        "prepared": qe_utils.prepared.find,
+        "prepared_uncached": uncached.find
+    }
+    results = {"repeat": args.repeat, "warmup": args.warmup, "paths": {}}
+    try:
+        for name, run in paths.items():
+            result = timed(run, args.repeat, args.warmup)
+            results["paths"][name] = result
+            print(f"{name:>17}: median {result['latency_median_ms']} ms, p95 {result['latency_p95_ms']} ms, "
+                  f"{result['count']} documents")
+    finally:
+        uncached.close()
+        qe_utils.prepared.close()
+        qe_utils.close_encryption_resources(encrypted_client, client_encryption)
+
+    counts = {result["count"] for result in results["paths"].values()}
+    if len(counts) > 1:
+        print(f"WARNING: paths returned different counts: {counts}")
+    if args.output:
+        common.write_results(args.output, results)
+
+
+if __name__ == "__main__":
+    main()
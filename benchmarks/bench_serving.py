@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Requests/sec for /api/usage under the Flask dev server versus the gunicorn
+production profile.
+
+Both servers are started as subprocesses with the same MONGODB_* environment,
+driven by the same closed-loop client (N threads, each issuing requests back
+to back for a fixed duration), then stopped.
+
+    python benchmarks/bench_serving.py --concurrency 16 --duration 30 --output serving.json
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import threading
+import subprocess
+import http.client
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(ROOT, "app")
+
+PROFILES = {
+    "dev": {
+        "port": 5055,
+        "command": [sys.executable, os.path.join(APP_DIR, "app.py")]
+    },
+    "production": {
+        "port": 8055,
+        "command": ["gunicorn", "-c", os.path.join(APP_DIR, "gunicorn.conf.py"), "--chdir", APP_DIR, "wsgi:app"]
+    }
+}
+
+
+def wait_for_port(port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/")
+            conn.getresponse().read()
+            return True
+        except OSError:
+            time.sleep(0.5)
+    return False
+
+
+def drive(port, path, concurrency, duration):
+    """Closed-loop load: each thread sends the next request as soon as the last one returns"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.time() + duration
+
+    def worker():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        local = []
+        local_errors = 0
+        while time.time() < stop_at:
+            start = time.perf_counter()
+            try:
+                conn.request("GET", path)
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    local_errors += 1
+            except (OSError, http.client.HTTPException):
+                local_errors += 1
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                continue
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    latencies.sort()
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 1) if latencies else None
+
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "requests_per_sec": round(len(latencies) / duration, 1),
+        "p50_ms": percentile(0.50),
+        "p99_ms": percentile(0.99)
+    }
+
+
+def run_profile(name, args):
+    profile = PROFILES[name]
+    env = dict(os.environ, PORT=str(profile["port"]))
+    if args.workers:
+        env["WEB_CONCURRENCY"] = str(args.workers)
+    if args.threads:
+        env["WEB_THREADS"] = str(args.threads)
+
+    print(f"Starting {name} server on port {profile['port']}...")
+    # Own process group so the dev server's reloader child is stopped too
+    proc = subprocess.Popen(profile["command"], env=env, cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=True)
+    try:
+        if not wait_for_port(profile["port"]):
+            raise RuntimeError(f"{name} server did not start")
+        # Warm up connection pools and caches before measuring
+        drive(profile["port"], args.path, args.concurrency, min(5, args.duration))
+        result = drive(profile["port"], args.path, args.concurrency, args.duration)
+    finally:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(timeout=30)
+
+    print(f"{name}: {result['requests_per_sec']} req/s, p50 {result['p50_ms']} ms, "
+          f"p99 {result['p99_ms']} ms, {result['errors']} errors")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the dev server with the production serving profile')
+    parser.add_argument('--path', default='/api/usage', help='Endpoint to drive (default: /api/usage)')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrent client threads (default: 16)')
+    parser.add_argument('--duration', type=int, default=30, help='Seconds per profile (default: 30)')
+    parser.add_argument('--workers', type=int, help='Override WEB_CONCURRENCY for the production profile')
+    parser.add_argument('--threads', type=int, help='Override WEB_THREADS for the production profile')
+    parser.add_argument('--profiles', nargs='+', default=list(PROFILES), choices=list(PROFILES))
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    results = {
+        "path": args.path,
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "profiles": {name: run_profile(name, args) for name in args.profiles}
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Compare shard keys and time-series granularities for sensor_readings.
+
+Stands up a local sharded cluster (a one-node config server replica set,
+--shards one-node shard replica sets and a mongos, all as child processes
+with data in a temporary directory), generates readings for --homes homes,
+then for every candidate shard key and granularity:
+
+  - recreates sensor_readings as a sharded time-series collection and
+    inserts the readings from --writers threads: ingest throughput
+  - optionally lets the balancer run for --balance-wait seconds, then
+    reports buckets, bytes and chunks per shard and the max/mean byte ratio
+  - runs the dashboard query (every home over the window) and the per-user
+    query (one home, cycling through homes) --repeat times each: latency,
+    and how many shards mongos sent them to (1 = targeted)
+
+    python benchmarks/bench_sharding.py --bin-dir ~/mongodb/bin --shards 3 --homes 50 --days 2 \\
+        --output benchmarks/results/sharding.json
+
+--uri runs against an existing sharded cluster's mongos instead (the
+scratch database is dropped). Needs MongoDB 6.0+ binaries (sharded time
+series with a hashed or compound metaField shard key).
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+import threading
+from datetime import datetime, timedelta, timezone
+
+import common
+from pymongo import MongoClient
+
+import usage
+from insert_sensor_data import generate_readings
+
+CANDIDATES = {
+    # The whole metaField, the original shard key
+    "meta": {"metadata": 1},
+    "user": {"metadata.UserId": 1},
+    # What shellCommands.js shards on
+    "user_time": {"metadata.UserId": 1, "Timestamp": 1},
+    "user_hashed": {"metadata.UserId": "hashed"},
+}
+GRANULARITIES = ("seconds", "minutes", "hours")
+
+
+class LocalCluster:
+    """A throwaway sharded cluster of local mongod/mongos processes."""
+
+    def __init__(self, bin_dir, shards, base_port, cache_gb):
+        self.bin_dir = bin_dir
+        self.shards = shards
+        self.base_port = base_port
+        self.cache_gb = cache_gb
+        self.workdir = tempfile.mkdtemp(prefix="bench-sharding-")
+        self.processes = []
+
+    def _binary(self, name):
+        return os.path.join(self.bin_dir, name) if self.bin_dir else name
+
+    def _spawn(self, name, args):
+        log = os.path.join(self.workdir, f"{name}.log")
+        command = [self._binary("mongos" if name == "mongos" else "mongod"), "--bind_ip", "127.0.0.1",
+                   "--logpath", log] + args
+        self.processes.append(subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+
+    def _mongod(self, name, port, role):
+        dbpath = os.path.join(self.workdir, name)
+        os.makedirs(dbpath)
+        self._spawn(name, [role, "--replSet", name, "--port", str(port), "--dbpath", dbpath,
+                           "--wiredTigerCacheSizeGB", str(self.cache_gb)])
+
+    def _initiate(self, name, port, configsvr=False):
+        client = MongoClient("127.0.0.1", port, directConnection=True, serverSelectionTimeoutMS=30000)
+        config = {"_id": name, "members": [{"_id": 0, "host": f"127.0.0.1:{port}"}]}
+        if configsvr:
+            config["configsvr"] = True
+        client.admin.command("replSetInitiate", config)
+        deadline = time.monotonic() + 60
+        while not client.admin.command("hello").get("isWritablePrimary"):
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{name} did not elect a primary")
+            time.sleep(0.5)
+        client.close()
+
+    def start(self):
+        config_port = self.base_port
+        self._mongod("config", config_port, "--configsvr")
+        shard_ports = {f"shard{i}": self.base_port + 1 + i for i in range(self.shards)}
+        for name, port in shard_ports.items():
+            self._mongod(name, port, "--shardsvr")
+
+        self._initiate("config", config_port, configsvr=True)
+        for name, port in shard_ports.items():
+            self._initiate(name, port)
+
+        mongos_port = self.base_port + 1 + self.shards
+        self._spawn("mongos", ["--configdb", f"config/127.0.0.1:{config_port}", "--port", str(mongos_port)])
+        uri = f"mongodb://127.0.0.1:{mongos_port}"
+        client = MongoClient(uri, serverSelectionTimeoutMS=60000)
+        for name, port in shard_ports.items():
+            client.admin.command("addShard", f"{name}/127.0.0.1:{port}")
+        client.close()
+        print(f"Cluster up: {self.shards} shards, mongos at {uri} (data in {self.workdir})")
+        return uri
+
+    def stop(self):
+        for proc in reversed(self.processes):
+            proc.terminate()
+        for proc in self.processes:
+            try:
+                proc.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def generate_homes(homes, days):
+    """({home: readings}, end) for the `days` days ending today at 00:00 UTC."""
+    end = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=timezone.utc)
+    start = end - timedelta(days=days)
+    print(f"Generating {days} days of readings for {homes} homes...")
+    readings = {f"user{home}": generate_readings(start, end, user_id=f"user{home}") for home in range(homes)}
+    return readings, end
+
+
+def create_sharded(client, database, key, granularity):
+    db = client[database]
+    db.drop_collection(usage.READINGS_COLLECTION)
+    client.admin.command("enableSharding", database)
+    client.admin.command(
+        "shardCollection", f"{database}.{usage.READINGS_COLLECTION}",
+        key=key,
+        timeseries={"timeField": "Timestamp", "metaField": "metadata", "granularity": granularity}
+    )
+    return db[usage.READINGS_COLLECTION]
+
+
+def ingest(collection, readings, writers, batch_size):
+    """Insert every home's readings from `writers` threads; returns docs/sec of wall time."""
+    batches = [docs[i:i + batch_size] for docs in readings.values() for i in range(0, len(docs), batch_size)]
+    lock = threading.Lock()
+
+    def writer():
+        while True:
+            with lock:
+                if not batches:
+                    return
+                batch = batches.pop()
+            # insert_many adds _id to the dicts; copy so every candidate gets fresh documents
+            collection.insert_many([dict(doc) for doc in batch], ordered=False)
+
+    total = sum(len(docs) for docs in readings.values())
+    began = time.perf_counter()
+    threads = [threading.Thread(target=writer) for _ in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - began
+    return {"documents": total, "seconds": round(elapsed, 2), "docs_per_sec": round(total / elapsed)}
+
+
+def distribution(client, database):
+    """Buckets, bytes and chunks per shard for the collection's buckets namespace."""
+    buckets = client[database][f"system.buckets.{usage.READINGS_COLLECTION}"]
+    shards = {}
+    for doc in buckets.aggregate([{"$collStats": {"storageStats": {}}}]):
+        shards[doc["shard"]] = {"buckets": doc["storageStats"]["count"], "bytes": doc["storageStats"]["size"],
+                                "chunks": 0}
+
+    config = client["config"]
+    entry = config["collections"].find_one({"_id": buckets.full_name})
+    if entry is not None:
+        chunks = config["chunks"].aggregate([
+            {"$match": {"uuid": entry["uuid"]}},
+            {"$group": {"_id": "$shard", "chunks": {"$sum": 1}}}
+        ])
+        for doc in chunks:
+            shards.setdefault(doc["_id"], {"buckets": 0, "bytes": 0, "chunks": 0})["chunks"] = doc["chunks"]
+
+    sizes = [shard["bytes"] for shard in shards.values()]
+    mean = statistics.mean(sizes) if sizes else 0
+    return {
+        "shards": shards,
+        "shards_with_data": sum(1 for size in sizes if size),
+        "max_to_mean_bytes": round(max(sizes) / mean, 2) if mean else None
+    }
+
+
+def wait_for_balance(client, database, seconds):
+    """Let the balancer run for up to `seconds`, stopping early once it reports the collection balanced."""
+    client.admin.command("balancerStart")
+    deadline = time.monotonic() + seconds
+    namespace = f"{database}.{usage.READINGS_COLLECTION}"
+    while time.monotonic() < deadline:
+        status = client.admin.command("balancerCollectionStatus", namespace)
+        if status.get("balancerCompliant"):
+            return True
+        time.sleep(2)
+    return False
+
+
+def shards_targeted(db, pipeline):
+    """Shards mongos routes the aggregation to, from its explain output."""
+    explain = db.command("explain", {"aggregate": usage.READINGS_COLLECTION, "pipeline": pipeline, "cursor": {}},
+                         verbosity="queryPlanner")
+    return len(explain.get("shards", {})) or 1
+
+
+def time_reads(db, pipelines, repeat):
+    timings = []
+    for i in range(repeat):
+        began = time.perf_counter()
+        list(db[usage.READINGS_COLLECTION].aggregate(pipelines[i % len(pipelines)]))
+        timings.append(time.perf_counter() - began)
+    timings.sort()
+    return {
+        "shards": shards_targeted(db, pipelines[0]),
+        "latency_median": round(statistics.median(timings), 4),
+        "latency_p95": round(timings[min(len(timings) - 1, int(0.95 * len(timings)))], 4)
+    }
+
+
+def run_candidate(client, args, readings, end, name, granularity):
+    collection = create_sharded(client, args.database, CANDIDATES[name], granularity)
+    result = {"key": CANDIDATES[name], "granularity": granularity}
+    result["ingest"] = ingest(collection, readings, args.writers, args.batch_size)
+    if args.balance_wait:
+        result["balanced"] = wait_for_balance(client, args.database, args.balance_wait)
+    result["distribution"] = distribution(client, args.database)
+
+    db = client[args.database]
+    window_start = end.replace(tzinfo=None) - timedelta(days=min(usage.WINDOW_DAYS, args.days))
+    homes = list(readings)
+    result["dashboard"] = time_reads(db, [usage.bucket_pipeline(window_start)], args.repeat)
+    result["per_user"] = time_reads(
+        db, [usage.bucket_pipeline(window_start, user_ids=[home]) for home in homes], args.repeat)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare shard keys and granularities for sensor_readings')
+    parser.add_argument('--uri', help='mongos of an existing sharded cluster (default: start a local one)')
+    parser.add_argument('--bin-dir', help='Directory with mongod and mongos (default: PATH)')
+    parser.add_argument('--shards', type=int, default=3, help='Shards in the local cluster (default: 3)')
+    parser.add_argument('--base-port', type=int, default=28000, help='First port of the local cluster (default: 28000)')
+    parser.add_argument('--cache-gb', type=float, default=0.25, help='WiredTiger cache per mongod (default: 0.25)')
+    parser.add_argument('--database', default=common.DEFAULT_DATABASE,
+                        help=f'Scratch database, dropped per candidate (default: {common.DEFAULT_DATABASE})')
+    parser.add_argument('--homes', type=int, default=50, help='Homes to generate readings for (default: 50)')
+    parser.add_argument('--days', type=int, default=2, help='Days of readings per home (default: 2)')
+    parser.add_argument('--keys', nargs='+', default=list(CANDIDATES), choices=list(CANDIDATES))
+    parser.add_argument('--granularities', nargs='+', default=["seconds", "minutes"], choices=GRANULARITIES)
+    parser.add_argument('--writers', type=int, default=8, help='Concurrent insert threads (default: 8)')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Documents per insert_many (default: 1000)')
+    parser.add_argument('--balance-wait', type=float, default=0,
+                        help='Seconds to let the balancer run after ingest (default: 0, measure as inserted)')
+    parser.add_argument('--repeat', type=int, default=20, help='Timed runs per read query (default: 20)')
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    readings, end = generate_homes(args.homes, args.days)
+    cluster = None if args.uri else LocalCluster(args.bin_dir, args.shards, args.base_port, args.cache_gb)
+    try:
+        uri = args.uri or cluster.start()
+        client = MongoClient(uri)
+        results = {
+            "meta": {
+                "server": client.server_info()["version"],
+                "shards": len(client.admin.command("listShards")["shards"])
+            },
+            "homes": args.homes,
+            "days": args.days,
+            "candidates": {}
+        }
+        for name in args.keys:
+            for granularity in args.granularities:
+                label = f"{name}/{granularity}"
+                print(f"\n=== {label} ===")
+                result = run_candidate(client, args, readings, end, name, granularity)
+                results["candidates"][label] = result
+                print(f"ingest {result['ingest']['docs_per_sec']} docs/s, "
+                      f"{result['distribution']['shards_with_data']} shards with data "
+                      f"(max/mean {result['distribution']['max_to_mean_bytes']}), "
+                      f"dashboard {result['dashboard']['latency_median']}s on {result['dashboard']['shards']} shards, "
+                      f"per-user {result['per_user']['latency_median']}s on {result['per_user']['shards']} shards")
+        client[args.database].drop_collection(usage.READINGS_COLLECTION)
+        client.close()
+    finally:
+        if cluster is not None:
+            cluster.stop()
+
+    if args.output:
+        common.write_results(args.output, results)
+
+
+if __name__ == "__main__":
+    main()
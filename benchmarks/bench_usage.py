@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Benchmark the /api/usage aggregation engines across data sizes.
+
+For each scale the benchmark database is reseeded with generated readings
+(scale 1 = the volume insert_sensor_data.py writes today, scale N = N homes),
+then every engine in usage.ENGINES runs in its own subprocess so that peak RSS
+is attributable to that engine alone. Per engine it reports:
+
+  - latency over --repeat runs (min / median / p95, seconds)
+  - peak RSS of the process and growth over the post-import baseline (MB)
+  - bytes of server replies received, measured in a separate untimed pass
+    with a CommandListener so the accounting does not skew latency
+
+Requires a local mongod (5.0+ for time series collections and $dateTrunc):
+
+    python benchmarks/bench_usage.py --scales 1 10 100 --output benchmarks/results/usage.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import statistics
+import subprocess
+from datetime import timedelta
+
+import common
+from bson import encode
+from pymongo import MongoClient, monitoring
+
+import usage
+
+
+class ReplyBytes(monitoring.CommandListener):
+    """Sums the BSON size of every command reply."""
+
+    def __init__(self):
+        self.total = 0
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.total += len(encode(event.reply))
+
+    def failed(self, event):
+        pass
+
+
+def window(db):
+    """The dashboard window, anchored on the newest reading so runs are repeatable."""
+    newest = db[usage.READINGS_COLLECTION].find_one({}, {"Timestamp": 1}, sort=[("Timestamp", -1)])
+    return newest["Timestamp"] - timedelta(days=usage.WINDOW_DAYS)
+
+
+def rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_engine(args):
+    """Child process: time one engine and print a JSON result line."""
+    engine = usage.ENGINES[args.run_engine]
+    client = MongoClient(args.uri)
+    db = client[args.database]
+    start = window(db)
+
+    result = {}
+    if args.run_engine == "rollup":
+        # The first refresh builds the whole rollup; report it separately
+        db[usage.ROLLUP_COLLECTION].drop()
+        began = time.perf_counter()
+        usage.refresh_rollup(db)
+        result["prime_seconds"] = round(time.perf_counter() - began, 4)
+
+    baseline_rss = rss_mb()
+    timings = []
+    points = 0
+    for _ in range(args.repeat):
+        began = time.perf_counter()
+        points = len(engine(db, start))
+        timings.append(time.perf_counter() - began)
+    peak_rss = rss_mb()
+
+    counter = ReplyBytes()
+    counting_client = MongoClient(args.uri, event_listeners=[counter])
+    engine(counting_client[args.database], start)
+    counting_client.close()
+    client.close()
+
+    timings.sort()
+    result.update({
+        "points": points,
+        "latency_min": round(timings[0], 4),
+        "latency_median": round(statistics.median(timings), 4),
+        "latency_p95": round(timings[min(len(timings) - 1, int(0.95 * len(timings)))], 4),
+        "peak_rss_mb": peak_rss,
+        "rss_growth_mb": round(peak_rss - baseline_rss, 1),
+        "bytes_received": counter.total
+    })
+    print(json.dumps(result))
+
+
+def measure(args, engine):
+    command = [sys.executable, os.path.abspath(__file__), "--run-engine", engine,
+               "--uri", args.uri, "--database", args.database, "--repeat", str(args.repeat)]
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark usage engines across data sizes')
+    parser.add_argument('--uri', default=common.DEFAULT_URI, help=f'MongoDB URI (default: {common.DEFAULT_URI})')
+    parser.add_argument('--database', default=common.DEFAULT_DATABASE,
+                        help=f'Scratch database, dropped and reseeded (default: {common.DEFAULT_DATABASE})')
+    parser.add_argument('--scales', nargs='+', type=int, default=[1, 10, 100], help='Data volume multipliers')
+    parser.add_argument('--engines', nargs='+', default=list(usage.ENGINES), choices=list(usage.ENGINES))
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per engine (default: 5)')
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    parser.add_argument('--run-engine', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_engine:
+        run_engine(args)
+        return
+
+    client = MongoClient(args.uri)
+    db = client[args.database]
+    results = {"meta": {"repeat": args.repeat, "server": client.server_info()["version"]}, "scales": {}}
+
+    for scale in args.scales:
+        homes = scale * common.HOMES_PER_SCALE
+        print(f"\n=== Scale {scale}x ({homes} homes) ===")
+        readings = common.seed_readings(db, homes)
+        scale_result = {"homes": homes, "readings": readings, "engines": {}}
+        for engine in args.engines:
+            result = measure(args, engine)
+            scale_result["engines"][engine] = result
+            print(f"{engine:>10}: median {result['latency_median']}s, p95 {result['latency_p95']}s, "
+                  f"peak RSS {result['peak_rss_mb']} MB, {result['bytes_received']} bytes, "
+                  f"{result['points']} points")
+        results["scales"][str(scale)] = scale_result
+
+    client.close()
+    if args.output:
+        common.write_results(args.output, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Helpers shared by the benchmarks: import paths for app/ and scripts/, seeding
+a benchmark database with generated readings, and writing results as JSON.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(ROOT, "app")
+SCRIPTS_DIR = os.path.join(ROOT, "scripts")
+
+for path in (APP_DIR, SCRIPTS_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+DEFAULT_URI = "mongodb://localhost:27017"
+DEFAULT_DATABASE = "smart_home_bench"
+
+# Homes (users with the generator's four devices) per unit of scale. Scale 1
+# is the volume insert_sensor_data.py produces today: one home, four days.
+HOMES_PER_SCALE = 1
+SEED_DAYS = 4
+
+
+def seed_readings(db, homes, days=SEED_DAYS):
+    """
+    Recreate sensor_readings with `homes` users' worth of generated readings
+    ending today at 00:00 UTC, in the same shape as insert_sensor_data.py.
+    """
+    from insert_sensor_data import create_readings_collection, generate_readings, upsert_devices
+
+    collection = create_readings_collection(db)
+    upsert_devices(db)
+    end_date = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=timezone.utc)
+    start_date = end_date - timedelta(days=days)
+    total = 0
+    for home in range(homes):
+        readings = generate_readings(start_date, end_date, user_id=f"user{home}")
+        collection.insert_many(readings, ordered=False)
+        total += len(readings)
+        print(f"  seeded home {home + 1}/{homes} ({total} readings)")
+    return total
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path, results):
+    """Write results with enough context to compare runs across commits."""
+    results = dict(results)
+    results.setdefault("meta", {}).update({
+        "commit": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "host": platform.node()
+    })
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"Wrote results to {path}")
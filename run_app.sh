@@ -46,4 +46,11 @@ echo "3. Ensure your MongoDB user has the appropriate permissions"
 echo ""
 
 # Start the Flask app
-python app/app.py 
\ No newline at end of file
+# ./run_app.sh         -> Flask development server (debugger and reloader enabled)
+# ./run_app.sh --prod  -> gunicorn production profile (see app/gunicorn.conf.py)
+if [ "$1" == "--prod" ]; then
+    echo "Starting gunicorn production profile on port ${PORT:-8000}"
+    exec gunicorn -c app/gunicorn.conf.py --chdir app wsgi:app
+else
+    python app/app.py
+fi
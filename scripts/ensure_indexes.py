@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Create the indexes the app's queries rely on in an existing deployment.
+
+insert_sensor_data.py and refresh_device_stats.py create their indexes when
+they run; this adds them to a database set up before those indexes existed
+(e.g. {metadata.UserId: 1, Timestamp: 1} for the per-user usage routes)
+without dropping or reloading anything. Existing indexes are left as they
+are, so it is safe to run on every deploy.
+
+    python scripts/ensure_indexes.py
+"""
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+import connection  # noqa: E402
+import device_stats  # noqa: E402
+import usage  # noqa: E402
+
+DATABASE_NAME = "smart_home"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create the indexes the app relies on')
+    parser.add_argument('--uri', help='Full connection string (defaults to the MONGODB_* environment variables)')
+    parser.add_argument('--database', default=DATABASE_NAME, help=f'Database (default: {DATABASE_NAME})')
+    args = parser.parse_args()
+
+    client = connection.create_client(args.uri, appname="ensure-indexes")
+    db = client[args.database]
+    usage.ensure_indexes(db)
+    device_stats.ensure_indexes(db)
+    print(f"Indexes in place on {args.database}")
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Index advisor for the smart_home collections.
+
+Runs the query shapes that the app and the scripts actually issue against a
+database, reads the executionStats from explain, and reports which shapes are
+missing a supporting index. For every candidate index it estimates the
+docs-examined reduction (by counting the documents that fall inside the
+candidate's index bounds) and the write amplification (index entries and key
+bytes added per inserted document). With --apply the candidates are built and
+every shape is measured again.
+
+Examples:
+    python scripts/index_advisor.py
+    python scripts/index_advisor.py --uri mongodb://localhost:27017 \\
+        --database smart_home_advisor --seed 5000 --apply
+"""
+import os
+import sys
+import json
+import argparse
+from datetime import datetime, timedelta, timezone
+from bson import BSON
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+import connection  # noqa: E402
+import read_profiles  # noqa: E402
+from insert_sensor_data import USER_ID, create_readings_collection, generate_readings, upsert_devices
+from insert_user_data import generate_user_data
+
+DATABASE_NAME = "smart_home"
+
+# Number of documents sampled when estimating index key sizes
+SAMPLE_SIZE = 500
+
+
+def latest_timestamp(db):
+    """Return the newest reading timestamp so the usage window matches the data set"""
+    doc = db["sensor_readings"].find_one({}, {"Timestamp": 1}, sort=[("Timestamp", -1)])
+    return doc["Timestamp"] if doc else datetime.utcnow()
+
+
+def query_shapes(db):
+    """
+    The query shapes issued by the app and the scripts.
+
+    Each shape has a filter (the part an index can serve) plus the command that
+    is actually explained. 'candidates' lists the indexes worth evaluating,
+    ordered Equality -> Sort -> Range.
+    """
+    cutoff = latest_timestamp(db) - timedelta(days=3.5)
+    usage_filter = {"Timestamp": {"$gte": cutoff}}
+    user_filter = {"metadata.UserId": USER_ID, "Timestamp": {"$gte": cutoff}}
+
+    # Parameters are fixed (instead of random as in overload_system.py) so that
+    # before/after measurements are comparable.
+    overload_filter = {
+        "birthday": {"$gte": "1980-01-01"},
+        "devices.energyConsumption": {"$gt": 100},
+        "location.region": {"$in": ["West Coast", "Northeast", "Southeast", "Midwest"]}
+    }
+    region_filter = {"global_region": "Europe"}
+    wildcard_filter = {"location.city": "San Francisco", "devices.brand": "Philips"}
+
+    return [
+        {
+            "name": "usage_window",
+            "source": "app/app.py get_usage()",
+            "collection": "sensor_readings",
+            "filter": usage_filter,
+            "command": {"find": "sensor_readings", "filter": usage_filter},
+            "candidates": [[("Timestamp", 1)]]
+        },
+        {
+            "name": "user_usage_window",
+            "source": "app/app.py get_user_usage()",
+            "collection": "sensor_readings",
+            "filter": user_filter,
+            "command": {"find": "sensor_readings", "filter": user_filter},
+            "candidates": [[("metadata.UserId", 1), ("Timestamp", 1)]]
+        },
+        {
+            "name": "overload_match",
+            "source": "scripts/overload_system.py generate_unoptimized_query()",
+            "collection": "users",
+            "filter": overload_filter,
+            # The original pipeline starts with $sample and $unwind, which
+            # prevents any index use. The $match is explained as the leading
+            # stage, which is where an index can help.
+            "command": {
+                "aggregate": "users",
+                "pipeline": [
+                    {"$match": overload_filter},
+                    {"$unwind": "$devices"},
+                    {"$match": {"devices.energyConsumption": {"$gt": 100}}},
+                    {"$group": {
+                        "_id": {
+                            "region": "$location.region",
+                            "city": "$location.city",
+                            "device_type": "$devices.deviceType",
+                            "brand": "$devices.brand"
+                        },
+                        "total_users": {"$addToSet": "$user_id"},
+                        "total_consumption": {"$sum": "$devices.energyConsumption"}
+                    }}
+                ],
+                "cursor": {}
+            },
+            "candidates": [
+                [("location.region", 1), ("devices.energyConsumption", 1), ("birthday", 1)],
+                [("location.region", 1), ("birthday", 1), ("devices.energyConsumption", 1)]
+            ],
+            "note": "$sample before $match in overload_system.py disables index use entirely"
+        },
+        {
+            "name": "global_region_find",
+            "source": "scripts/insert_user_data.py main()",
+            "collection": "users",
+            "filter": region_filter,
+            "command": {"find": "users", "filter": region_filter, "limit": 5},
+            "candidates": [[("global_region", 1)]]
+        },
+        {
+            "name": "city_device_brand",
+            "source": "scripts/sample_queries.js compound wildcard query",
+            "collection": "users",
+            "filter": wildcard_filter,
+            "command": {
+                "find": "users",
+                "filter": wildcard_filter,
+                "projection": {"email": 1}
+            },
+            "candidates": [[("location.city", 1), ("devices.$**", 1)]]
+        }
+    ]
+
+
+def find_execution_stats(explain):
+    """Locate the executionStats block, which moves around for aggregates and time series views"""
+    if isinstance(explain, dict):
+        if "executionStats" in explain:
+            return explain["executionStats"]
+        for value in explain.values():
+            found = find_execution_stats(value)
+            if found:
+                return found
+    elif isinstance(explain, list):
+        for value in explain:
+            found = find_execution_stats(value)
+            if found:
+                return found
+    return None
+
+
+def plan_stages(node):
+    """Collect the stage names of a plan tree (COLLSCAN, IXSCAN, FETCH, ...)"""
+    stages = []
+    if isinstance(node, dict):
+        if "stage" in node:
+            stages.append(node["stage"])
+        for value in node.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(node, list):
+        for value in node:
+            stages.extend(plan_stages(value))
+    return stages
+
+
+def measure(db, shape):
+    """Explain a shape with executionStats and summarise the numbers we care about"""
+    explain = db.command("explain", shape["command"], verbosity="executionStats")
+    stats = find_execution_stats(explain) or {}
+    stages = plan_stages(stats.get("executionStages", {}))
+    return {
+        "docs_examined": stats.get("totalDocsExamined"),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "returned": stats.get("nReturned"),
+        "time_ms": stats.get("executionTimeMillis"),
+        "plan": "COLLSCAN" if "COLLSCAN" in stages else ("IXSCAN" if "IXSCAN" in stages else ",".join(stages[:3]))
+    }
+
+
+def index_name(keys):
+    return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+
+def existing_index_keys(collection):
+    return [list(spec["key"].items()) for spec in collection.list_indexes()]
+
+
+def is_covered(keys, existing):
+    """True if an existing index already has the candidate as a prefix"""
+    return any(index[:len(keys)] == list(keys) for index in existing)
+
+
+def estimate_docs_examined(collection, shape, keys):
+    """
+    Estimate docs examined with the candidate index in place.
+
+    Predicates on the indexed fields are applied to index keys before any
+    document is fetched, so the fetch count is the number of documents that
+    match those predicates.
+    """
+    fields = {field for field, _ in keys}
+    bounded = {
+        field: predicate for field, predicate in shape["filter"].items()
+        if field in fields or any(f.endswith("$**") and field.startswith(f[:-3]) for f in fields)
+    }
+    if not bounded:
+        return None
+    estimate = collection.count_documents(bounded)
+    limit = shape["command"].get("limit")
+    return min(estimate, limit) if limit else estimate
+
+
+def value_at(doc, path):
+    """Resolve a dotted path, expanding arrays the way a multikey index does"""
+    values = [doc]
+    for part in path.split("."):
+        next_values = []
+        for value in values:
+            if isinstance(value, dict) and part in value:
+                value = value[part]
+                next_values.extend(value if isinstance(value, list) else [value])
+            elif isinstance(value, list):
+                for item in value:
+                    if isinstance(item, dict) and part in item:
+                        next_values.append(item[part])
+        values = next_values
+    return values
+
+
+def estimate_write_cost(collection, keys):
+    """Estimate index entries and key bytes written per inserted document"""
+    entries = 0
+    key_bytes = 0
+    sampled = 0
+    for doc in collection.aggregate([{"$sample": {"size": SAMPLE_SIZE}}]):
+        sampled += 1
+        per_field = []
+        for field, _ in keys:
+            if field.endswith("$**"):
+                # Wildcard indexes write one key per leaf field under the prefix
+                root = value_at(doc, field[:-4])
+                leaves = [v for item in root if isinstance(item, dict) for v in item.values()]
+                per_field.append(leaves or [None])
+            else:
+                per_field.append(value_at(doc, field) or [None])
+        # A compound index may only be multikey on one field; the number of
+        # keys per document is the product of the per-field fan-out.
+        fan_out = 1
+        for values in per_field:
+            fan_out *= len(values)
+        entries += fan_out
+        key_bytes += fan_out * sum(len(BSON.encode({"k": values[0]})) for values in per_field)
+    if not sampled:
+        return {"entries_per_insert": 0, "key_bytes_per_insert": 0}
+    return {
+        "entries_per_insert": round(entries / sampled, 2),
+        "key_bytes_per_insert": round(key_bytes / sampled, 1)
+    }
+
+
+def advise(db, apply=False):
+    """Measure every shape, evaluate candidates, optionally build them and re-measure"""
+    report = []
+    for shape in query_shapes(db):
+        collection = db[shape["collection"]]
+        existing = existing_index_keys(collection)
+        before = measure(db, shape)
+
+        candidates = []
+        for keys in shape["candidates"]:
+            covered = is_covered(keys, existing)
+            estimate = estimate_docs_examined(collection, shape, keys)
+            candidate = {
+                "index": index_name(keys),
+                "keys": keys,
+                "exists": covered,
+                "estimated_docs_examined": estimate,
+                "write_cost": estimate_write_cost(collection, keys),
+                "existing_indexes_on_collection": len(existing)
+            }
+            if before["docs_examined"] and estimate is not None:
+                candidate["estimated_reduction_pct"] = round(
+                    100.0 * (before["docs_examined"] - estimate) / before["docs_examined"], 1
+                )
+            candidates.append(candidate)
+
+        # Recommend the candidate that examines the fewest documents, unless an
+        # existing index already serves the shape.
+        missing = [c for c in candidates if not c["exists"] and c["estimated_docs_examined"] is not None]
+        recommended = None
+        if before["plan"] == "COLLSCAN" and missing:
+            recommended = min(missing, key=lambda c: c["estimated_docs_examined"])
+
+        entry = {
+            "shape": shape["name"],
+            "source": shape["source"],
+            "collection": shape["collection"],
+            "before": before,
+            "candidates": candidates,
+            "recommended": recommended["index"] if recommended else None,
+            "note": shape.get("note")
+        }
+
+        if apply and recommended:
+            print(f"Building {recommended['index']} on {shape['collection']}...")
+            collection.create_index(recommended["keys"], name=recommended["index"])
+            entry["after"] = measure(db, shape)
+
+        report.append(entry)
+    return report
+
+
+def print_report(report):
+    for entry in report:
+        before = entry["before"]
+        print(f"\n=== {entry['shape']} ({entry['source']}) ===")
+        print(f"Collection: {entry['collection']}")
+        print(f"Current plan: {before['plan']}, docs examined: {before['docs_examined']}, "
+              f"returned: {before['returned']}, time: {before['time_ms']} ms")
+        if entry["note"]:
+            print(f"Note: {entry['note']}")
+        for candidate in entry["candidates"]:
+            status = "exists" if candidate["exists"] else "missing"
+            reduction = candidate.get("estimated_reduction_pct")
+            reduction_text = f", {reduction}% fewer docs examined" if reduction is not None else ""
+            cost = candidate["write_cost"]
+            print(f"  {candidate['index']} [{status}]: ~{candidate['estimated_docs_examined']} docs examined"
+                  f"{reduction_text}; write cost ~{cost['entries_per_insert']} entries / "
+                  f"{cost['key_bytes_per_insert']} key bytes per insert")
+        if entry["recommended"]:
+            print(f"Recommended: {entry['recommended']}")
+        else:
+            print("Recommended: no new index")
+        if "after" in entry:
+            after = entry["after"]
+            print(f"After build: plan {after['plan']}, docs examined: {after['docs_examined']}, "
+                  f"time: {after['time_ms']} ms")
+
+
+def seed(db, num_users, days):
+    """Populate a scratch database with users and sensor readings of the production shape"""
+    print(f"Seeding {db.name} with {num_users} users per region and {days} days of readings...")
+    users = db["users"]
+    users.delete_many({})
+    for region in ["North America", "Europe"]:
+        users.insert_many(generate_user_data(num_users, region))
+
+    readings = create_readings_collection(db)
+    upsert_devices(db)
+    end_date = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=timezone.utc)
+    docs = generate_readings(end_date - timedelta(days=days), end_date)
+    readings.insert_many(docs)
+    print(f"Inserted {users.count_documents({})} users and {len(docs)} readings")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report missing indexes for the smart_home query shapes')
+    parser.add_argument('--uri', help='Full connection string (defaults to the MONGODB_* environment variables)')
+    parser.add_argument('--database', default=DATABASE_NAME, help=f'Database to analyse (default: {DATABASE_NAME})')
+    parser.add_argument('--seed', type=int, metavar='NUM_USERS',
+                        help='Populate the database with a representative data set first (not allowed on smart_home)')
+    parser.add_argument('--days', type=int, default=4, help='Days of readings to seed (default: 4)')
+    parser.add_argument('--apply', action='store_true', help='Build the recommended indexes and re-measure')
+    parser.add_argument('--json', metavar='PATH', help='Also write the report as JSON')
+    read_profiles.add_argument(parser)
+    args = parser.parse_args()
+
+    client = connection.create_client(args.uri, appname="index-advisor")
+    # Explains run on the member the profile selects, e.g. an analytics node
+    db = read_profiles.with_profile(client[args.database], read_profiles.select("index_advisor", args.read_profile))
+
+    if args.seed:
+        if args.database == DATABASE_NAME:
+            parser.error("--seed would overwrite smart_home; pass a scratch --database")
+        seed(db, args.seed, args.days)
+
+    report = advise(db, apply=args.apply)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"\nWrote report to {args.json}")
+
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
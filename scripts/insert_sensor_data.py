@@ -1,57 +1,28 @@
 #!/usr/bin/env python3
 import os
+import sys
 import random
+import argparse
 from datetime import datetime, timedelta, timezone
-from pymongo import MongoClient, errors
+from pymongo import errors
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+import connection  # noqa: E402
+# By name: the module-level `devices` below is the list of example devices
+from devices import DEVICES_COLLECTION, STATIC_FIELDS  # noqa: E402
 
 # --- Configuration / Parameters ---
 # Modify N_DAYS here to change how many days of data you want
 N_DAYS = 4  # Generate 4 days of data to cover the 3.5 day display window
 
-MONGODB_URI = os.environ.get("MONGODB_URI")          # e.g. "cluster0.mongodb.net"
-MONGODB_USERNAME = os.environ.get("MONGODB_USERNAME") # e.g. "myUser"
-MONGODB_PASSWORD = os.environ.get("MONGODB_PASSWORD") # e.g. "myPassword"
-
-# Construct the connection string for MongoDB
-connection_string = f"mongodb+srv://{MONGODB_USERNAME}:{MONGODB_PASSWORD}@{MONGODB_URI}/?retryWrites=true&w=majority"
-client = MongoClient(connection_string)
-
 # Define database/collection - Changed from home_energy to smart_home
-db = client["smart_home"]
-collection_name = "sensor_readings"
-
-# --- First drop the existing collection if it exists ---
-try:
-    db.drop_collection(collection_name)
-    print(f"Dropped existing collection '{collection_name}' from smart_home database")
-except Exception as e:
-    print(f"Note: Could not drop collection: {e}")
-
-# --- Create a time series collection (if it doesn't exist) ---
-try:
-    db.create_collection(
-        collection_name,
-        timeseries={
-            "timeField": "Timestamp",  # field with datetime
-            "metaField": "metadata",   # single field that will contain both userId and deviceId
-            "granularity": "minutes"
-        }
-    )
-    print(f"Created time series collection '{collection_name}' in smart_home database")
-except errors.CollectionInvalid:
-    print(f"Collection '{collection_name}' already exists (or creation not supported).")
-
-collection = db[collection_name]
+DATABASE_NAME = "smart_home"
+COLLECTION_NAME = "sensor_readings"
 
 # --- Data Generation ---
 
 USER_ID = "user123"  # single user; change or loop as needed
 
-# We define the end date as "today at 00:00 UTC"
-# and generate data going backwards for N_DAYS.
-end_date = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=timezone.utc)
-start_date = end_date - timedelta(days=N_DAYS)
-
 # Example devices for each category
 devices = [
     {
@@ -59,28 +30,28 @@ devices = [
         "category": "HEATER",
         "brand": "AcmeHeating",
         "model": "HeatMax1000",
-        "name": "LivingRoomHeater"
+        "device_name": "LivingRoomHeater"
     },
     {
         "deviceId": "OVEN001",
         "category": "OVEN",
         "brand": "BakersDelight",
         "model": "OvenProX2",
-        "name": "KitchenOven"
+        "device_name": "KitchenOven"
     },
     {
         "deviceId": "TV001",
         "category": "TV",
         "brand": "ScreenMaster",
         "model": "TV-LCD55",
-        "name": "LivingRoomTV"
+        "device_name": "LivingRoomTV"
     },
     {
         "deviceId": "MISC001",
         "category": "MISC_APPLIANCE",
         "brand": "GenericBrand",
         "model": "MiscModel42",
-        "name": "RandomAppliance"
+        "device_name": "RandomAppliance"
     }
 ]
 
@@ -300,91 +271,155 @@ def get_current_usage(category, t):
 
     return 0.0
 
-# For storing all generated readings
-all_readings = []
-
-# Generate data for each day in [start_date, end_date)
-current_day = start_date
-while current_day < end_date:
-    # Weather effect for the current day (affects heater usage)
-    is_cold_day = random.random() < 0.4  # 40% chance of a cold day
-    cold_factor = 1.3 if is_cold_day else 1.0
-    
-    # Some days devices might be off completely (e.g., nobody home)
-    away_from_home = random.random() < 0.1  # 10% chance nobody's home
-    
-    # Generate data for each minute of the current day
-    for minute_offset in range(24 * 60):  # for each minute of the day
-        current_time = current_day + timedelta(minutes=minute_offset)
+def create_readings_collection(db, collection_name=COLLECTION_NAME):
+    """Drop and recreate the sensor readings time series collection"""
+    # --- First drop the existing collection if it exists ---
+    try:
+        db.drop_collection(collection_name)
+        print(f"Dropped existing collection '{collection_name}' from {db.name} database")
+    except Exception as e:
+        print(f"Note: Could not drop collection: {e}")
 
-        # If we've reached or passed the end date, break
-        if current_time >= end_date:
-            break
-        
-        # Maybe skip some readings to simulate connectivity issues (creates gaps in the data)
-        if random.random() < 0.005:  # 0.5% chance of missing a reading
-            continue
-            
-        # Generate readings for each device
-        for dev in devices:
-            # If nobody's home, only report standby power for most devices 
-            # (except MISC_APPLIANCE which might include automated systems)
-            if away_from_home and dev["category"] != "MISC_APPLIANCE":
-                usage = random.uniform(0.02, 0.1)  # minimal standby power
-                device_state = "standby"
-            else:
-                # Get baseline usage for this device at this time
-                usage = get_current_usage(dev["category"], current_time)
-                
-                # Apply cold weather factor to heater
-                if dev["category"] == "HEATER" and is_cold_day:
-                    usage *= cold_factor
-                
-                # Determine device state based on usage and time
-                device_state = get_device_state(dev["category"], usage, current_time)
-            
-            # Get additional metrics
-            temperature = get_temperature(dev["category"], device_state, current_time)
-            pressure = get_pressure(dev["category"], device_state, current_time)
-            battery_level = get_battery_level(dev["category"], current_time, dev["deviceId"])
-            
-            # Create the reading document with flattened structure (no Device object)
-            reading = {
-                # The timeField for the time series collection must be a datetime
-                "Timestamp": current_time,
-                
-                # Combine metadata fields into a single field
-                "metadata": {
-                    "UserId": USER_ID,
-                    "deviceId": dev["deviceId"]
-                },
-
-                # Device properties at root level
-                "brand": dev["brand"],
-                "model": dev["model"],
-                "device_name": dev["name"],
-                "category": dev["category"],
-                "current_usage": usage,
-                
-                # New metrics
-                "temperature": temperature,
-                "pressure": pressure,
-                "device_state": device_state,
-                "battery_level": battery_level
+    # --- Create a time series collection (if it doesn't exist) ---
+    try:
+        db.create_collection(
+            collection_name,
+            timeseries={
+                "timeField": "Timestamp",  # field with datetime
+                "metaField": "metadata",   # single field that will contain both userId and deviceId
+                "granularity": "minutes"
             }
-            all_readings.append(reading)
+        )
+        print(f"Created time series collection '{collection_name}' in {db.name} database")
+    except errors.CollectionInvalid:
+        print(f"Collection '{collection_name}' already exists (or creation not supported).")
 
-    # Move to the next day
-    current_day += timedelta(days=1)
+    # Per-user usage queries filter on the metaField's UserId and a time range
+    db[collection_name].create_index([("metadata.UserId", 1), ("Timestamp", 1)])
 
-# Insert the generated documents in one bulk operation
-try:
-    if all_readings:
-        result = collection.insert_many(all_readings)
-        print(f"Inserted {len(result.inserted_ids)} documents into '{collection_name}'.")
-    else:
-        print("No readings generated (start_date >= end_date).")
-except Exception as e:
-    print(f"Error inserting documents: {e}")
+    return db[collection_name]
+
+def upsert_devices(db):
+    """Store the static attributes of every device once, keyed by deviceId"""
+    for dev in devices:
+        db[DEVICES_COLLECTION].update_one(
+            {"_id": dev["deviceId"]},
+            {"$set": {
+                **{field: dev[field] for field in STATIC_FIELDS},
+                "updated_at": datetime.now(timezone.utc)
+            }},
+            upsert=True
+        )
+    print(f"Upserted {len(devices)} devices into '{DEVICES_COLLECTION}'")
+
+def generate_readings(start_date, end_date, user_id=USER_ID):
+    """Generate minute-level readings for every device of one user in [start_date, end_date)"""
+    # For storing all generated readings
+    all_readings = []
+
+    # Generate data for each day in [start_date, end_date)
+    current_day = start_date
+    while current_day < end_date:
+        # Weather effect for the current day (affects heater usage)
+        is_cold_day = random.random() < 0.4  # 40% chance of a cold day
+        cold_factor = 1.3 if is_cold_day else 1.0
+
+        # Some days devices might be off completely (e.g., nobody home)
+        away_from_home = random.random() < 0.1  # 10% chance nobody's home
+
+        # Generate data for each minute of the current day
+        for minute_offset in range(24 * 60):  # for each minute of the day
+            current_time = current_day + timedelta(minutes=minute_offset)
+
+            # If we've reached or passed the end date, break
+            if current_time >= end_date:
+                break
+
+            # Maybe skip some readings to simulate connectivity issues (creates gaps in the data)
+            if random.random() < 0.005:  # 0.5% chance of missing a reading
+                continue
+
+            # Generate readings for each device
+            for dev in devices:
+                # If nobody's home, only report standby power for most devices
+                # (except MISC_APPLIANCE which might include automated systems)
+                if away_from_home and dev["category"] != "MISC_APPLIANCE":
+                    usage = random.uniform(0.02, 0.1)  # minimal standby power
+                    device_state = "standby"
+                else:
+                    # Get baseline usage for this device at this time
+                    usage = get_current_usage(dev["category"], current_time)
+
+                    # Apply cold weather factor to heater
+                    if dev["category"] == "HEATER" and is_cold_day:
+                        usage *= cold_factor
+
+                    # Determine device state based on usage and time
+                    device_state = get_device_state(dev["category"], usage, current_time)
+
+                # Get additional metrics
+                temperature = get_temperature(dev["category"], device_state, current_time)
+                pressure = get_pressure(dev["category"], device_state, current_time)
+                battery_level = get_battery_level(dev["category"], current_time, dev["deviceId"])
+
+                # Create the reading document with flattened structure (no Device object)
+                reading = {
+                    # The timeField for the time series collection must be a datetime
+                    "Timestamp": current_time,
+
+                    # Combine metadata fields into a single field
+                    "metadata": {
+                        "UserId": user_id,
+                        "deviceId": dev["deviceId"]
+                    },
+
+                    # Static device properties (brand, model, ...) are stored once
+                    # in the devices collection, see upsert_devices()
+                    "current_usage": usage,
+
+                    # New metrics
+                    "temperature": temperature,
+                    "pressure": pressure,
+                    "device_state": device_state,
+                    "battery_level": battery_level
+                }
+                all_readings.append(reading)
+
+        # Move to the next day
+        current_day += timedelta(days=1)
+
+    return all_readings
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate and insert sensor readings into MongoDB')
+    parser.add_argument('--days', type=int, default=N_DAYS,
+                        help=f'Number of days of data to generate (default: {N_DAYS})')
+    args = parser.parse_args()
+
+    # Connection string and client settings are shared with the app (app/connection.py)
+    client = connection.create_client(appname="insert-sensor-data")
+    db = client[DATABASE_NAME]
+    collection = create_readings_collection(db)
+    upsert_devices(db)
+
+    # We define the end date as "today at 00:00 UTC"
+    # and generate data going backwards for the requested number of days.
+    end_date = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=timezone.utc)
+    start_date = end_date - timedelta(days=args.days)
+
+    all_readings = generate_readings(start_date, end_date)
+
+    # Insert the generated documents in one bulk operation
+    try:
+        if all_readings:
+            result = collection.insert_many(all_readings)
+            print(f"Inserted {len(result.inserted_ids)} documents into '{COLLECTION_NAME}'.")
+        else:
+            print("No readings generated (start_date >= end_date).")
+    except Exception as e:
+        print(f"Error inserting documents: {e}")
+
+    client.close()
 
-client.close()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
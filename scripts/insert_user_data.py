@@ -1,9 +1,12 @@
 import random
 import os
+import sys
 import argparse
-from pymongo import MongoClient
 from datetime import datetime, timedelta
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+import connection  # noqa: E402
+
 def generate_user_data(num_users=1000, global_region=None):
     """
     Generates sample user documents with an embedded 'devices' array.
@@ -91,7 +94,9 @@ def generate_user_data(num_users=1000, global_region=None):
             },
             "global_region": global_region if global_region else "North America",
             "birthday": generate_birthday(),
-            "devices": devices
+            "devices": devices,
+            # Watermark for the incremental device_stats refresh
+            "updated_at": datetime.utcnow()
         }
         users.append(user_doc)
 
@@ -118,15 +123,10 @@ def main():
     
     # Connect to MongoDB
     try:
-        uri = os.getenv('MONGODB_URI')
-        username = os.getenv('MONGODB_USERNAME')
-        password = os.getenv('MONGODB_PASSWORD')
-        
-        if not all([uri, username, password]):
+        if not all([connection.MONGODB_URI, connection.MONGODB_USERNAME, connection.MONGODB_PASSWORD]):
             raise ValueError("Missing required MongoDB environment variables")
             
-        connection_string = f"mongodb+srv://{username}:{password}@{uri}"
-        client = MongoClient(connection_string)
+        client = connection.create_client(appname="insert-user-data")
         client.admin.command('ping')
         print("Successfully connected to MongoDB!")
     except Exception as e:
@@ -145,6 +145,7 @@ def main():
     # Insert the new user data
     result = users_collection.insert_many(users_data)
     print(f"\nInserted {len(result.inserted_ids)} users")
+    print("Run scripts/refresh_device_stats.py --full to rebuild device_stats")
 
     # Example queries
     print("\nExecuting sample queries...")
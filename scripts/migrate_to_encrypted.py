@@ -1,17 +1,17 @@
 #!/usr/bin/env python3
 import os
+import sys
 from datetime import datetime
-from pymongo import MongoClient
 from pymongo.encryption import ClientEncryption
 from pymongo.encryption_options import AutoEncryptionOpts
 from bson.binary import STANDARD
 from bson.codec_options import CodecOptions
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+import connection  # noqa: E402
+
 # MongoDB and AWS settings
 kms_provider_name = "aws"  # Using AWS KMS instead of "local"
-uri = os.environ.get("MONGODB_URI")
-mongodb_username = os.environ.get("MONGODB_USERNAME")
-mongodb_password = os.environ.get("MONGODB_PASSWORD")
 aws_access_key = os.environ.get("AWS_ACCESS_KEY")
 aws_secret_key = os.environ.get("AWS_SECRET_KEY")
 aws_kms_key_id = os.environ.get("AWS_KMS_KEY_ID")
@@ -34,8 +34,7 @@ source_namespace = f"{source_database}.{source_collection}"
 def setup_encryption():
     """Set up MongoDB client with encryption configuration"""
     # Connect to MongoDB
-    connection_string = f"mongodb+srv://{mongodb_username}:{mongodb_password}@{uri}/?retryWrites=true&w=majority"
-    client = MongoClient(connection_string)
+    client = connection.create_client(appname="migrate-to-encrypted")
     
     # Create key vault for storing encryption keys
     if key_vault_collection_name not in client[key_vault_database_name].list_collection_names():
@@ -120,8 +119,8 @@ def setup_encryption():
     }
     
     # Create client with automatic encryption
-    encrypted_client = MongoClient(
-        connection_string,
+    encrypted_client = connection.create_client(
+        appname="migrate-to-encrypted",
         auto_encryption_opts=AutoEncryptionOpts(
             kms_providers=kms_providers,
             key_vault_namespace=key_vault_namespace,
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Move the static device attributes (brand, model, device_name, category) out
+of existing sensor_readings documents and into the devices collection.
+
+1. One aggregation collects the attributes of every deviceId and upserts
+   them into `devices`.
+2. Readings are rewritten in Timestamp windows (--batch-hours each) with
+   update_many + $unset, so each batch is a bounded amount of work and the
+   script can be interrupted and re-run safely.
+
+Updating non-metaField fields of a time series collection requires MongoDB
+7.0 or later. Storage is released as buckets are rewritten; run `compact` on
+system.buckets.sensor_readings afterwards to return it to the OS.
+
+    python scripts/normalize_devices.py --dry-run
+    python scripts/normalize_devices.py --batch-hours 6
+"""
+import os
+import sys
+import time
+import argparse
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+import connection  # noqa: E402
+import devices  # noqa: E402
+
+DATABASE_NAME = "smart_home"
+READINGS_COLLECTION = "sensor_readings"
+
+
+def collect_devices(db, dry_run=False):
+    """Upsert one devices document per deviceId from the attributes on its readings"""
+    pipeline = [
+        {"$match": {"brand": {"$exists": True}}},
+        {"$group": {
+            "_id": "$metadata.deviceId",
+            **{field: {"$last": f"${field}"} for field in devices.STATIC_FIELDS}
+        }}
+    ]
+    found = list(db[READINGS_COLLECTION].aggregate(pipeline, allowDiskUse=True))
+    print(f"Found attributes for {len(found)} devices")
+    for device in found:
+        device_id = device.pop("_id")
+        print(f"  {device_id}: {device}")
+        if not dry_run:
+            db[devices.DEVICES_COLLECTION].update_one(
+                {"_id": device_id},
+                {"$set": {**device, "updated_at": datetime.now(timezone.utc)}},
+                upsert=True
+            )
+    return len(found)
+
+
+def strip_readings(db, batch_hours, pause, dry_run=False):
+    """Remove the static attributes from readings, one Timestamp window at a time"""
+    readings = db[READINGS_COLLECTION]
+    denormalized = {"brand": {"$exists": True}}
+    first = readings.find_one(denormalized, {"Timestamp": 1}, sort=[("Timestamp", 1)])
+    last = readings.find_one(denormalized, {"Timestamp": 1}, sort=[("Timestamp", -1)])
+    if not first:
+        print("No readings carry device attributes; nothing to do")
+        return 0
+
+    window = timedelta(hours=batch_hours)
+    start = first["Timestamp"]
+    total = 0
+    while start <= last["Timestamp"]:
+        end = start + window
+        batch_filter = {"Timestamp": {"$gte": start, "$lt": end}, **denormalized}
+        if dry_run:
+            modified = readings.count_documents(batch_filter)
+        else:
+            modified = readings.update_many(
+                batch_filter,
+                {"$unset": {field: "" for field in devices.STATIC_FIELDS}}
+            ).modified_count
+        total += modified
+        print(f"  {start:%Y-%m-%d %H:%M} - {end:%Y-%m-%d %H:%M}: {modified} readings"
+              f"{' would be' if dry_run else ''} rewritten ({total} total)")
+        start = end
+        if pause:
+            # Give the cluster room for foreground traffic between batches
+            time.sleep(pause)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Normalize device attributes out of sensor readings')
+    parser.add_argument('--uri', help='Full connection string (defaults to the MONGODB_* environment variables)')
+    parser.add_argument('--database', default=DATABASE_NAME, help=f'Database (default: {DATABASE_NAME})')
+    parser.add_argument('--batch-hours', type=float, default=24, help='Hours of readings per batch (default: 24)')
+    parser.add_argument('--pause', type=float, default=0.5, help='Seconds to sleep between batches (default: 0.5)')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing')
+    args = parser.parse_args()
+
+    client = connection.create_client(args.uri, appname="normalize-devices")
+    db = client[args.database]
+
+    print("Step 1: collecting device attributes...")
+    collect_devices(db, args.dry_run)
+    print("Step 2: rewriting readings...")
+    total = strip_readings(db, args.batch_hours, args.pause, args.dry_run)
+    print(f"Done: {total} readings {'would be ' if args.dry_run else ''}rewritten")
+
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
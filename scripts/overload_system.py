@@ -1,37 +1,46 @@
 #!/usr/bin/env python3
 import os
+import sys
+import argparse
 import time
 import datetime
-import pymongo
 from bson import json_util
 import json
 import concurrent.futures
 import threading
 import random
 
-# MongoDB connection settings from environment variables
-MONGODB_URI = os.environ.get("MONGODB_URI")
-MONGODB_USERNAME = os.environ.get("MONGODB_USERNAME")
-MONGODB_PASSWORD = os.environ.get("MONGODB_PASSWORD")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+import connection  # noqa: E402
+import read_profiles  # noqa: E402
 
-# Construct the connection string
-MONGODB_URL = f"mongodb+srv://{MONGODB_USERNAME}:{MONGODB_PASSWORD}@{MONGODB_URI}/?retryWrites=true&w=majority"
 
 # Database and collection names
 DATABASE_NAME = "smart_home"
 COLLECTION_NAME = "users"
 
-# Thread-local storage for MongoDB connections
-thread_local = threading.local()
+# Number of parallel query threads; the shared client's pool holds one
+# connection per thread
+NUM_THREADS = 35
+
+# One client shared by all threads (MongoClient is thread-safe)
+_client = None
+# Members the load is sent to; set from --read-profile
+READ_PROFILE = "analytics"
+_client_lock = threading.Lock()
 
 # Global flag to control when threads should stop
 STOP_THREADS = False
 
 def get_mongodb_connection():
-    """Get a thread-local MongoDB connection"""
-    if not hasattr(thread_local, "client"):
-        thread_local.client = pymongo.MongoClient(MONGODB_URL)
-    return thread_local.client, thread_local.client[DATABASE_NAME][COLLECTION_NAME]
+    """Get the shared MongoDB client, creating and pre-warming it on first use"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = connection.create_client(appname="overload", maxPoolSize=NUM_THREADS, minPoolSize=NUM_THREADS)
+            connection.prewarm(_client, NUM_THREADS)
+    collection = _client[DATABASE_NAME][COLLECTION_NAME]
+    return _client, read_profiles.with_profile(collection, READ_PROFILE)
 
 def print_full_query(query_params):
     """Print the full aggregation pipeline"""
@@ -172,14 +181,8 @@ def run_continuous_queries(thread_id, duration_seconds):
                 print(f"Error details: {str(query_error)[:200]}")
                 print(f"Thread {thread_id} has encountered {error_count} errors so far")
                 
-                if "connection" in str(query_error).lower() or "network" in str(query_error).lower():
-                    try:
-                        print(f"Thread {thread_id} attempting to reconnect...")
-                        thread_local.client = pymongo.MongoClient(MONGODB_URL)
-                        _, collection = get_mongodb_connection()
-                        print(f"Thread {thread_id} reconnection successful")
-                    except Exception as reconnect_error:
-                        print(f"Thread {thread_id} reconnection failed: {str(reconnect_error)[:100]}")
+                # Network errors need no reconnect here: the pool replaces
+                # broken connections on the next checkout
             
     except Exception as thread_error:
         print(f"Thread {thread_id} encountered a fatal error: {str(thread_error)[:150]}...")
@@ -188,9 +191,6 @@ def run_continuous_queries(thread_id, duration_seconds):
             thread_duration = time.time() - thread_start_time
             print(f"Thread {thread_id} ending after {thread_duration:.2f} seconds, "
                   f"completed {query_count} queries, encountered {error_count} errors")
-            
-            if hasattr(thread_local, "client"):
-                thread_local.client.close()
         except:
             pass
     
@@ -198,14 +198,21 @@ def run_continuous_queries(thread_id, duration_seconds):
 
 def main():
     """Main function to run continuous load test"""
-    global STOP_THREADS
+    global STOP_THREADS, READ_PROFILE
+
+    parser = argparse.ArgumentParser(description='Run a continuous aggregation load against the users collection')
+    parser.add_argument('--minutes', type=float, default=10, help='Test duration in minutes (default: 10)')
+    read_profiles.add_argument(parser, default="analytics")
+    args = parser.parse_args()
+    READ_PROFILE = read_profiles.select("overload", args.read_profile)
     
     # Configuration
-    num_threads = 35       # Number of parallel threads
-    duration_minutes = 10  # Total duration in minutes
+    num_threads = NUM_THREADS
+    duration_minutes = args.minutes  # Total duration in minutes
     
     print("\n========== STARTING CONTINUOUS LOAD TEST ==========")
-    print(f"Running {num_threads} parallel threads continuously for {duration_minutes} minutes")
+    print(f"Running {num_threads} parallel threads continuously for {duration_minutes} minutes "
+          f"(read profile: {READ_PROFILE})")
     print(f"Each thread will run queries non-stop with no pauses")
     
     total_start_time = time.time()
@@ -270,12 +277,9 @@ def main():
         # Set the stop flag to make sure all threads exit
         STOP_THREADS = True
         
-        # Attempt to close any remaining connections
-        try:
-            client = pymongo.MongoClient(MONGODB_URL)
-            client.close()
-        except:
-            pass
+        # Close the shared client and its pooled connections
+        if _client is not None:
+            _client.close()
     
     # Calculate final statistics
     total_duration = time.time() - total_start_time
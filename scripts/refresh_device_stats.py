@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Refresh the materialized device_stats collection (see app/device_stats.py)
+from the users changed since the last run.
+
+    python scripts/refresh_device_stats.py                  # incremental
+    python scripts/refresh_device_stats.py --full           # after bulk deletes or insert_user_data.py
+    python scripts/refresh_device_stats.py --interval 60    # keep running
+"""
+import os
+import sys
+import time
+import argparse
+from pymongo.errors import PyMongoError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+import connection  # noqa: E402
+import device_stats  # noqa: E402
+
+DATABASE_NAME = "smart_home"
+
+
+def run_once(db, full=False):
+    began = time.perf_counter()
+    processed = device_stats.refresh(db, full=full)
+    if processed is None:
+        print("Another refresh is running; skipped")
+    else:
+        print(f"Refreshed device_stats from {processed} users in {time.perf_counter() - began:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Refresh the materialized device_stats collection')
+    parser.add_argument('--uri', help='Full connection string (defaults to the MONGODB_* environment variables)')
+    parser.add_argument('--database', default=DATABASE_NAME, help=f'Database (default: {DATABASE_NAME})')
+    parser.add_argument('--full', action='store_true', help='Reprocess every user and drop deleted ones')
+    parser.add_argument('--interval', type=float, help='Repeat every INTERVAL seconds instead of running once')
+    args = parser.parse_args()
+
+    client = connection.create_client(args.uri, appname="device-stats")
+    db = client[args.database]
+    device_stats.ensure_indexes(db)
+
+    run_once(db, full=args.full)
+    while args.interval:
+        time.sleep(args.interval)
+        try:
+            run_once(db)
+        except PyMongoError as e:
+            print(f"Refresh failed ({e}); retrying in {args.interval:g}s")
+
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Scheduled retention job: roll raw sensor readings up into the hourly and
+daily summary tiers (see app/retention.py) and the 5-minute buckets of the
+rollup usage engine (app/usage.py) and, with --apply-ttl, set the expiry of
+each tier.
+
+Run it at least hourly, e.g. from cron:
+
+    0 * * * * cd /path/to/repo && python scripts/run_retention.py
+
+or keep it running on its own:
+
+    python scripts/run_retention.py --apply-ttl --interval 3600
+
+Summaries need MongoDB 7.0+ ($percentile).
+"""
+import os
+import sys
+import time
+import argparse
+from datetime import datetime
+from pymongo.errors import PyMongoError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+import connection  # noqa: E402
+import retention  # noqa: E402
+import usage  # noqa: E402
+
+DATABASE_NAME = "smart_home"
+
+
+def run_once(db, since=None):
+    began = time.perf_counter()
+    starts = retention.run_rollups(db, since=since)
+    for tier, start in starts.items():
+        print(f"  {tier}: refreshed from {start or 'the first reading'}")
+    # The 5-minute buckets the rollup usage engine reads
+    usage.refresh_rollup(db, since=since)
+    print(f"  {usage.ROLLUP_COLLECTION}: refreshed")
+    print(f"Rollups done in {time.perf_counter() - began:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Roll sensor readings up into retention tiers')
+    parser.add_argument('--uri', help='Full connection string (defaults to the MONGODB_* environment variables)')
+    parser.add_argument('--database', default=DATABASE_NAME, help=f'Database (default: {DATABASE_NAME})')
+    parser.add_argument('--since', type=datetime.fromisoformat,
+                        help='Recompute buckets from this UTC time (for late readings)')
+    parser.add_argument('--apply-ttl', action='store_true',
+                        help=f'Expire raw readings after {retention.RAW_DAYS:g} days and hourly '
+                             f'summaries after {retention.HOURLY_DAYS:g} days')
+    parser.add_argument('--interval', type=float, help='Repeat every INTERVAL seconds instead of running once')
+    args = parser.parse_args()
+
+    client = connection.create_client(args.uri, appname="retention")
+    db = client[args.database]
+
+    # Roll up first so nothing expires before it has been summarised
+    run_once(db, args.since)
+    if args.apply_ttl:
+        retention.apply_ttl(db)
+        print("TTL applied")
+
+    while args.interval:
+        time.sleep(args.interval)
+        try:
+            run_once(db)
+        except PyMongoError as e:
+            print(f"Rollup failed ({e}); retrying in {args.interval:g}s")
+
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,33 @@
 //Percentile Query to show whether Christmas power usage is unusual compared to normal days
+//(the app computes this continuously per weekday/hour: GET /api/usage/anomalies)
 
-db.power_readings.aggregate([
+db.sensor_readings.aggregate([
   // Match December data
   {
     $match: {
-      timestamp: {
+      Timestamp: {
         $gte: ISODate("2024-12-01T00:00:00Z"),
         $lt: ISODate("2025-01-01T00:00:00Z")
-      },
-      "device_id.Category": "Appliance"  // Focus on one category for clarity
+      }
+    }
+  },
+  // Focus on one category for clarity (device attributes live in the devices collection)
+  {
+    $lookup: {
+      from: "devices",
+      localField: "metadata.deviceId",
+      foreignField: "_id",
+      as: "device"
     }
   },
+  { $match: { "device.category": "MISC_APPLIANCE" } },
   // Use percentile operator to analyze power consumption
   {
     $group: {
       _id: null,
       regularDays: {
         $percentile: {
-          input: "$current_power",
+          input: "$current_usage",
           p: [0.5, 0.95],  // Median and 95th percentile
           method: "approximate"
         }
@@ -27,10 +37,10 @@ db.power_readings.aggregate([
         $push: {
           $cond: [
             { $and: [
-              { $gte: ["$timestamp", ISODate("2024-12-25T00:00:00Z")] },
-              { $lt: ["$timestamp", ISODate("2024-12-26T00:00:00Z")] }
+              { $gte: ["$Timestamp", ISODate("2024-12-25T00:00:00Z")] },
+              { $lt: ["$Timestamp", ISODate("2024-12-26T00:00:00Z")] }
             ]},
-            "$current_power",
+            "$current_usage",
             null
           ]
         }
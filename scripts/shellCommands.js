@@ -11,6 +11,10 @@ db.users.find({"location.city": "New York", "devices.deviceType": "Space Heater"
 sh.enableSharding("smart_home")
 sh.shardCollection(
     "smart_home.sensor_readings",
+    // insert_sensor_data.py creates the collection with granularity "minutes";
+    // benchmarks/bench_sharding.py compares keys and granularities. Change
+    // the key only on its results, and keep it on metaField subfields:
+    // MongoDB 8.0 deprecates the timeField in time series shard keys
     { "metadata": 1 },
     { 
       timeseries: { 
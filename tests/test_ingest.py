@@ -0,0 +1,106 @@
+"""Validation and the write buffer behind POST /api/readings (app/ingest.py)."""
+import threading
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+import db
+import ingest
+
+
+class StubCollection:
+    """Records insert_many() batches; raises for documents whose Timestamp is `poison`."""
+
+    def __init__(self, poison=None):
+        self.poison = poison
+        self.inserted = []
+        self.flushed = threading.Event()
+
+    def insert_many(self, docs, ordered=True):
+        if any(doc.get("Timestamp") == self.poison for doc in docs):
+            raise OverflowError("date value out of range")
+        self.inserted.extend(docs)
+        self.flushed.set()
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    stub = StubCollection(poison="poison")
+    monkeypatch.setattr(db, "get_collection", lambda name=None: stub)
+    return stub
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_flusher_survives_a_batch_that_cannot_be_encoded(collection):
+    buffer = ingest.WriteBuffer(max_size=10, flush_size=1, flush_interval=0.01)
+    try:
+        assert buffer.offer([{"Timestamp": "poison"}])
+        assert wait_for(lambda: len(buffer) == 0)
+        for index in range(20):
+            assert buffer.offer([{"Timestamp": index}])
+            assert wait_for(lambda: len(collection.inserted) == index + 1)
+    finally:
+        buffer.close()
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_dead_flusher_is_restarted(collection):
+    buffer = ingest.WriteBuffer(max_size=10, flush_size=1, flush_interval=0.01)
+    try:
+        # A flusher that dies anyway (here: an exception from outside _insert's handling)
+        def crash(batch):
+            raise RuntimeError("flusher bug")
+        buffer._insert = crash
+        assert buffer.offer([{"Timestamp": 1}])
+        assert wait_for(lambda: not buffer._thread.is_alive())
+        del buffer._insert
+        assert buffer.offer([{"Timestamp": 2}])
+        assert wait_for(lambda: len(collection.inserted) == 1)
+    finally:
+        buffer.close()
+
+
+def reading(**fields):
+    return {"Timestamp": "2024-11-03T12:00:00Z", "current_usage": 1.5,
+            "metadata": {"UserId": "user", "deviceId": "device"}, **fields}
+
+
+@pytest.mark.parametrize("timestamp", [
+    "9999-12-31T23:00:00-05:00",
+    "0001-01-01T00:30:00+01:00",
+    1e20,
+    float("nan"),
+    float("inf"),
+    10 ** 400,
+    {"$date": 1e20},
+])
+def test_out_of_range_timestamps_are_rejected(timestamp):
+    with pytest.raises(ingest.ValidationError):
+        ingest.validate_reading(reading(Timestamp=timestamp))
+
+
+def test_timestamps_are_normalized_to_utc():
+    doc = ingest.validate_reading(reading(Timestamp="2024-11-03T01:30:00-05:00"))
+    assert doc["Timestamp"] == datetime(2024, 11, 3, 6, 30, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("value", [float("nan"), float("inf"), float("-inf"), 10 ** 400])
+def test_non_finite_numbers_are_rejected(value):
+    with pytest.raises(ingest.ValidationError):
+        ingest.validate_reading(reading(current_usage=value))
+
+
+def test_nan_in_a_json_body_is_rejected():
+    [raw] = ingest.parse_body(b'{"Timestamp": "2024-11-03T12:00:00Z", "current_usage": NaN,'
+                              b' "metadata": {"UserId": "user", "deviceId": "device"}}', "application/json")
+    with pytest.raises(ingest.ValidationError):
+        ingest.validate_reading(raw)
@@ -0,0 +1,93 @@
+"""DST correctness of the /api/usage labels (app/local_time.py)."""
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+import local_time
+import usage
+
+# Zones and their 2024 (spring forward, fall back) local dates
+DST_DAYS = {
+    "US/Eastern": ("2024-03-10", "2024-11-03"),
+    "Europe/London": ("2024-03-31", "2024-10-27"),
+    "Australia/Sydney": ("2024-10-06", "2024-04-07"),
+}
+BUCKETS_PER_HOUR = 60 // usage.BUCKET_MINUTES
+
+
+def buckets_around(day):
+    """Naive UTC 5-minute buckets from two days before to two days after `day`."""
+    date = datetime.strptime(day, "%Y-%m-%d")
+    start, end = date - timedelta(days=2), date + timedelta(days=2)
+    step = timedelta(minutes=usage.BUCKET_MINUTES)
+    return [start + step * index for index in range(int((end - start) / step))]
+
+
+def reference(series, zone):
+    local = [ts.replace(tzinfo=timezone.utc).astimezone(ZoneInfo(zone)) for ts in series]
+    return [ts.strftime("%m/%d %I:%M %p") for ts in local], [ts.strftime("%Y-%m-%d") for ts in local]
+
+
+def day_labels(zone, day):
+    labels, dates = local_time.labels(buckets_around(day), zone)
+    return [label for label, date in zip(labels, dates) if date == day]
+
+
+CASES = [(zone, days[0]) for zone, days in DST_DAYS.items()] + [(zone, days[1]) for zone, days in DST_DAYS.items()]
+
+
+@pytest.mark.parametrize("zone,day", CASES)
+def test_labels_match_zoneinfo(zone, day):
+    series = buckets_around(day)
+    assert local_time.labels(series, zone) == reference(series, zone)
+
+
+@pytest.mark.parametrize("zone", DST_DAYS)
+def test_spring_forward_skips_an_hour(zone):
+    labels = day_labels(zone, DST_DAYS[zone][0])
+    assert len(labels) == 23 * BUCKETS_PER_HOUR
+    assert len(set(labels)) == len(labels)
+
+
+@pytest.mark.parametrize("zone", DST_DAYS)
+def test_fall_back_repeats_an_hour(zone):
+    labels = day_labels(zone, DST_DAYS[zone][1])
+    assert len(labels) == 25 * BUCKETS_PER_HOUR
+    repeated = [label for label, count in Counter(labels).items() if count > 1]
+    assert len(repeated) == BUCKETS_PER_HOUR
+    assert all(count <= 2 for count in Counter(labels).values())
+
+
+@pytest.mark.parametrize("zone", DST_DAYS)
+def test_ordinary_day_has_24_hours(zone):
+    day = (datetime.strptime(DST_DAYS[zone][0], "%Y-%m-%d") + timedelta(days=14)).strftime("%Y-%m-%d")
+    labels = day_labels(zone, day)
+    assert len(labels) == 24 * BUCKETS_PER_HOUR
+    assert len(set(labels)) == len(labels)
+
+
+def test_naive_buckets_are_utc_whatever_the_host_tz(monkeypatch):
+    monkeypatch.setenv("TZ", "Asia/Kolkata")
+    time.tzset()
+    try:
+        point = usage.format_point(datetime(2024, 3, 10, 7, 0), 1.0, zone="US/Eastern")
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+    # 07:00 UTC is 03:00 EDT, right after the spring-forward change
+    assert point == {"label": "03/10 03:00 AM", "usage": 1.0, "fullDate": "2024-03-10"}
+
+
+def test_format_points_matches_format_point():
+    intervals = [(bucket, 1.5, 3) for bucket in buckets_around("2024-11-03")]
+    assert usage.format_points(intervals, "US/Eastern") == [
+        usage.format_point(*interval, zone="US/Eastern") for interval in intervals
+    ]
+
+
+def test_unknown_zone_is_a_value_error():
+    with pytest.raises(ValueError):
+        usage.parse_timezone({"tz": "Mars/Base"})
@@ -0,0 +1,46 @@
+"""Sampler lifetime of profiled requests (app/profiling.py)."""
+import threading
+
+import pytest
+from flask import Flask
+
+import profiling
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_TOKEN", "secret")
+    monkeypatch.setattr(profiling, "PROFILE_ROUTES", {"/ok", "/boom"})
+    app = Flask(__name__)
+    app.config["PROPAGATE_EXCEPTIONS"] = True
+    profiling.init_app(app)
+
+    @app.route("/ok")
+    def ok():
+        return "ok"
+
+    @app.route("/boom")
+    def boom():
+        raise RuntimeError("boom")
+
+    return app.test_client()
+
+
+def samplers():
+    return [thread for thread in threading.enumerate() if thread.name == "profile-sampler"]
+
+
+HEADERS = {"X-Profile-Token": "secret", "X-Profile": "1"}
+
+
+def test_profiled_request_stores_a_profile(client):
+    response = client.get("/ok", headers=HEADERS)
+    assert response.headers["X-Profile-Id"]
+    assert not samplers()
+
+
+def test_failing_profiled_request_stops_its_sampler(client):
+    with pytest.raises(RuntimeError):
+        client.get("/boom", headers=HEADERS)
+    assert not samplers()
+    assert profiling._index["/boom"]
@@ -0,0 +1,124 @@
+"""
+The usage tailer (app/usage_stream.py) against a real replica set, in both
+change stream and poll mode.
+
+Needs a replica set, e.g. the single-node one from the README; set
+MONGODB_TEST_URI if it is not on localhost:27017. Skipped when none is
+reachable. Each run uses and then drops its own database.
+"""
+import os
+import queue
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+import db
+import usage
+import usage_stream
+
+TEST_URI = os.environ.get("MONGODB_TEST_URI", "mongodb://localhost:27017/?directConnection=true")
+# Seconds to wait for the tailer to notice a reading
+TIMEOUT = 10
+
+
+@pytest.fixture(scope="module")
+def client():
+    client = MongoClient(TEST_URI, serverSelectionTimeoutMS=1000)
+    try:
+        hello = client.admin.command("hello")
+    except PyMongoError as e:
+        pytest.skip(f"no MongoDB at {TEST_URI}: {e}")
+    if "setName" not in hello:
+        pytest.skip(f"{TEST_URI} is not a replica set member")
+    yield client
+    client.close()
+
+
+@pytest.fixture(params=["changestream", "poll"])
+def readings(request, client, monkeypatch):
+    """sensor_readings in a scratch database: a regular collection for change streams, time series for polling."""
+    database = client[f"usage_stream_test_{os.getpid()}"]
+    client.drop_database(database.name)
+    if request.param == "poll":
+        database.create_collection(usage.READINGS_COLLECTION, timeseries={
+            "timeField": "Timestamp", "metaField": "metadata", "granularity": "minutes"})
+    else:
+        database.create_collection(usage.READINGS_COLLECTION)
+    monkeypatch.setattr(db, "get_collection", lambda name=None: database[name])
+    monkeypatch.setattr(usage_stream, "STREAM_MODE", request.param)
+    monkeypatch.setattr(usage_stream, "POLL_INTERVAL", 0.2)
+    monkeypatch.setattr(usage_stream, "KEEPALIVE", 0.2)
+    monkeypatch.setattr(usage_stream, "IDLE_TIMEOUT", 0)
+    yield database[usage.READINGS_COLLECTION]
+    client.drop_database(database.name)
+
+
+@pytest.fixture
+def subscribe():
+    tailer = usage_stream.UsageTailer()
+    subscribed = []
+
+    def subscribe():
+        client_queue = tailer.subscribe()
+        subscribed.append(client_queue)
+        return tailer, client_queue
+
+    yield subscribe
+    for client_queue in subscribed:
+        tailer.unsubscribe(client_queue)
+    if tailer._thread is not None:
+        tailer._thread.join(TIMEOUT)
+
+
+def reading(ts, current_usage):
+    return {"Timestamp": ts, "current_usage": current_usage, "metadata": {"UserId": "user", "deviceId": "device"}}
+
+
+def wait_seeded(tailer):
+    deadline = time.monotonic() + TIMEOUT
+    while not tailer._buckets:
+        assert time.monotonic() < deadline, "tailer did not seed the open buckets"
+        time.sleep(0.05)
+
+
+def next_update(client_queue, bucket):
+    """The next update for `bucket`, skipping updates of other buckets."""
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            update = client_queue.get(timeout=TIMEOUT)
+        except queue.Empty:
+            break
+        if update["bucket"] == bucket.isoformat():
+            return update
+    pytest.fail(f"no update for {bucket}")
+
+
+def test_new_reading_updates_the_seeded_bucket(readings, subscribe):
+    bucket = usage.floor_to_bucket(datetime.utcnow())
+    readings.insert_one(reading(bucket, 10.0))
+    tailer, client_queue = subscribe()
+    wait_seeded(tailer)
+
+    readings.insert_one(reading(bucket + timedelta(seconds=1), 20.0))
+    update = next_update(client_queue, bucket)
+    # The average covers the reading from before the tailer started too
+    assert update["samples"] == 2
+    assert update["usage"] == pytest.approx(15.0)
+
+
+def test_late_reading_updates_an_open_bucket(readings, subscribe):
+    now = usage.floor_to_bucket(datetime.utcnow())
+    previous = now - timedelta(minutes=usage.BUCKET_MINUTES)
+    readings.insert_many([reading(previous, 4.0), reading(now, 1.0)])
+    tailer, client_queue = subscribe()
+    wait_seeded(tailer)
+
+    # Posted after newer readings, as a device catching up would
+    readings.insert_one(reading(previous + timedelta(seconds=30), 8.0))
+    update = next_update(client_queue, previous)
+    assert update["samples"] == 2
+    assert update["usage"] == pytest.approx(6.0)
@@ -0,0 +1,40 @@
+"""?days= / ?start=&end= parsing shared by the usage routes (usage.parse_window)."""
+from datetime import datetime, timedelta
+
+import pytest
+
+import retention
+import usage
+
+
+def test_default_window():
+    start, end = usage.parse_window({}, retention.RAW_WINDOW_DAYS)
+    assert end is None
+    assert datetime.utcnow() - start == pytest.approx(timedelta(days=usage.WINDOW_DAYS), abs=timedelta(seconds=5))
+
+
+def test_window_at_the_limit_is_accepted():
+    start, _ = usage.parse_window({"days": "30"}, 30)
+    assert start < datetime.utcnow()
+
+
+@pytest.mark.parametrize("args", [
+    {"days": "0"},
+    {"days": "-1"},
+    {"days": "nan"},
+    {"days": "inf"},
+    {"days": "1e300"},
+    {"days": "31"},
+    {"start": "2020-01-01T00:00:00Z", "end": "2021-01-01T00:00:00Z"},
+    {"start": "2000-01-01T00:00:00Z"},
+    {"start": "2024-01-02T00:00:00Z", "end": "2024-01-01T00:00:00Z"},
+])
+def test_bad_windows_are_rejected(args):
+    with pytest.raises(ValueError):
+        usage.parse_window(args, 30)
+
+
+def test_max_window_is_finite():
+    assert retention.MAX_WINDOW_DAYS
+    with pytest.raises(ValueError):
+        usage.parse_window({"days": str(retention.MAX_WINDOW_DAYS + 1)}, retention.MAX_WINDOW_DAYS)